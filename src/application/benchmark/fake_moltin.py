@@ -0,0 +1,259 @@
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import urlsplit, parse_qs
+import json
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+def make_product_dct(number: int) -> Dict:
+    amount = 1000 + number * 10
+    formatted_price = '${:.2f}'.format(amount / 100)
+    return {
+        'type': 'product',
+        'id': 'product-{}'.format(number),
+        'name': 'Product {}'.format(number),
+        'slug': 'product-{}'.format(number),
+        'sku': 'SKU{}'.format(number),
+        'description': 'Description of product {}.'.format(number),
+        'status': 'live',
+        'price': [{'amount': amount, 'currency': 'USD', 'includes_tax': True}],
+        'meta': {
+            'timestamps': {
+                'created_at': '2019-01-01T00:00:00+00:00',
+                'updated_at': '2019-01-01T00:00:00+00:00',
+            },
+            'display_price': {
+                'with_tax': {
+                    'amount': amount,
+                    'currency': 'USD',
+                    'formatted': formatted_price,
+                }
+            }
+        },
+        'relationships': {
+            'main_image': {'data': {'type': 'main_image', 'id': 'file-{}'.format(number)}}
+        },
+    }
+
+
+def make_file_dct(file_id: str) -> Dict:
+    return {
+        'type': 'file',
+        'id': file_id,
+        'file_name': '{}.png'.format(file_id),
+        'link': {'href': 'https://files.example.com/{}.png'.format(file_id)},
+    }
+
+
+def make_display_price(amount: int) -> Dict:
+    formatted = '${:.2f}'.format(amount / 100)
+    return {'amount': amount, 'currency': 'USD', 'formatted': formatted}
+
+
+def make_cart_item_dct(item_id: str, product_dct: Dict, quantity: int) -> Dict:
+    unit_amount = product_dct['price'][0]['amount']
+    return {
+        'id': item_id,
+        'type': 'cart_item',
+        'product_id': product_dct['id'],
+        'name': product_dct['name'],
+        'description': product_dct['description'],
+        'sku': product_dct['sku'],
+        'quantity': quantity,
+        'value': {'amount': unit_amount * quantity, 'currency': 'USD'},
+        'meta': {
+            'display_price': {
+                'with_tax': {
+                    'unit': make_display_price(unit_amount),
+                    'value': make_display_price(unit_amount * quantity),
+                }
+            }
+        },
+    }
+
+
+class FakeMoltinRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle('get')
+
+    def do_POST(self):
+        self._handle('post')
+
+    def do_PUT(self):
+        self._handle('put')
+
+    def do_DELETE(self):
+        self._handle('delete')
+
+    def _handle(self, method):
+        fake_moltin = self.server.fake_moltin
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length)
+        parts = urlsplit(self.path)
+        params = {name: values[0] for name, values in parse_qs(parts.query).items()}
+
+        if fake_moltin.latency:
+            time.sleep(fake_moltin.latency)
+        status, response = fake_moltin.dispatch(method, parts.path, params, body)
+
+        content = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeMoltinServer:
+    """
+    Local HTTP server which imitates the part of Moltin API used by the bot.
+    The catalog is generated from catalog_size, carts are kept in memory.
+    Every response is delayed by latency seconds.
+    """
+
+    def __init__(
+            self,
+            catalog_size: int = 100,
+            latency: float = 0.0,
+            listen: str = '127.0.0.1',
+            port: int = 0,
+    ):
+        self.latency = latency
+        self.products = [make_product_dct(number) for number in range(catalog_size)]
+        self.products_by_id = {product['id']: product for product in self.products}
+        self.carts = {}
+        self.flows = []
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((listen, port), FakeMoltinRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake_moltin = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, name='fake-moltin', daemon=True
+        )
+        self._thread.start()
+        logger.debug('Fake Moltin started at {}'.format(self.url))
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def update_product(self, product_id: str, **fields):
+        """Change fields of a product like Moltin does, with its update time."""
+        with self._lock:
+            product_dct = self.products_by_id[product_id]
+            product_dct.update(fields)
+            product_dct['meta']['timestamps']['updated_at'] = datetime.now(
+                timezone.utc
+            ).isoformat()
+
+    def dispatch(self, method: str, path: str, params: Dict, body: bytes):
+        with self._lock:
+            self.requests += 1
+        segments = [segment for segment in path.split('/') if segment]
+
+        if segments == ['oauth', 'access_token'] and method == 'post':
+            return 200, {'access_token': uuid.uuid4().hex, 'expires': time.time() + 3600}
+        if segments[:1] != ['v2'] or len(segments) < 2:
+            return 404, self._error(404, 'Not found')
+
+        resource, arguments = segments[1], segments[2:]
+        if resource == 'products' and method == 'get':
+            return self._get_products(arguments, params)
+        if resource == 'files' and method == 'get' and len(arguments) == 1:
+            return 200, {'data': make_file_dct(arguments[0])}
+        if resource == 'carts' and arguments:
+            return self._handle_cart(method, arguments, body)
+        if resource == 'flows' and method == 'post':
+            with self._lock:
+                self.flows.append(json.loads(body)['data'])
+            return 201, {'data': {'id': uuid.uuid4().hex, 'type': 'flow'}}
+        return 404, self._error(404, 'Not found')
+
+    def _get_products(self, arguments: List[str], params: Dict):
+        if arguments:
+            product_dct = self.products_by_id.get(arguments[0])
+            if product_dct is None:
+                return 404, self._error(404, 'Product not found')
+            return 200, {'data': product_dct}
+
+        limit = int(params.get('page[limit]', 100))
+        offset = int(params.get('page[offset]', 0))
+        return 200, {
+            'data': self.products[offset:offset + limit],
+            'meta': {'results': {'total': len(self.products)}},
+        }
+
+    def _handle_cart(self, method: str, arguments: List[str], body: bytes):
+        cart_reference = arguments[0]
+        with self._lock:
+            cart = self.carts.setdefault(cart_reference, {})
+
+            if len(arguments) == 1 and method == 'get':
+                amount = sum(item['value']['amount'] for item in cart.values())
+                return 200, {
+                    'data': {
+                        'id': cart_reference,
+                        'type': 'cart',
+                        'meta': {
+                            'display_price': {'with_tax': make_display_price(amount)},
+                            'timestamps': {'created_at': '2019-07-13T19:29:31Z'},
+                        },
+                    }
+                }
+            if arguments[1:] != ['items'] and len(arguments) != 3:
+                return 404, self._error(404, 'Not found')
+
+            if method == 'get':
+                return 200, {'data': list(cart.values())}
+            if method == 'post':
+                data = json.loads(body)['data']
+                product_dct = self.products_by_id.get(data['id'])
+                if product_dct is None:
+                    return 404, self._error(404, 'Product not found')
+                item_id = 'item-{}'.format(data['id'])
+                quantity = data['quantity']
+                if item_id in cart:
+                    quantity += cart[item_id]['quantity']
+                cart[item_id] = make_cart_item_dct(item_id, product_dct, quantity)
+                return 201, {'data': list(cart.values())}
+            if method == 'put' and len(arguments) == 3:
+                item_dct = cart.get(arguments[2])
+                if item_dct is None:
+                    return 404, self._error(404, 'Item not found')
+                product_dct = self.products_by_id[item_dct['product_id']]
+                quantity = json.loads(body)['data']['quantity']
+                cart[arguments[2]] = make_cart_item_dct(
+                    arguments[2], product_dct, quantity
+                )
+                return 200, {'data': list(cart.values())}
+            if method == 'delete' and len(arguments) == 3:
+                cart.pop(arguments[2], None)
+                return 200, {'data': list(cart.values())}
+        return 404, self._error(404, 'Not found')
+
+    @staticmethod
+    def _error(status: int, title: str) -> Dict:
+        return {'errors': [{'status': status, 'title': title, 'detail': title}]}
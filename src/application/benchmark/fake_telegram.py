@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+from typing import Dict, List
+import itertools
+import threading
+import time
+
+
+class StubBot:
+    """
+    Stands in for telegram.Bot: records every call instead of talking
+    to Telegram. Each call is delayed by latency seconds.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = []
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _record(self, method: str, chat_id, **kwargs) -> SimpleNamespace:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            message_id = next(self._message_ids)
+            self.calls.append((method, chat_id, kwargs))
+        return SimpleNamespace(message_id=message_id, chat_id=chat_id, photo=None)
+
+    def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        return self._record('send_message', chat_id, text=text, reply_markup=reply_markup)
+
+    def send_photo(self, chat_id, photo, caption=None, reply_markup=None, **kwargs):
+        message = self._record(
+            'send_photo', chat_id, photo=photo, caption=caption, reply_markup=reply_markup
+        )
+        # Photo sent by a link is uploaded and gets a file_id, like in Telegram.
+        file_id = 'uploaded:{}'.format(photo) if photo.startswith('http') else photo
+        message.photo = [SimpleNamespace(file_id=file_id)]
+        return message
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        return self._record('delete_message', chat_id, message_id=message_id)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, reply_markup=None,
+                          **kwargs):
+        message = self._record(
+            'edit_message_text', chat_id, message_id=message_id, text=text,
+            reply_markup=reply_markup,
+        )
+        message.message_id = message_id
+        message.text = text
+        return message
+
+    def edit_message_reply_markup(self, chat_id=None, message_id=None,
+                                  reply_markup=None, **kwargs):
+        message = self._record(
+            'edit_message_reply_markup', chat_id, message_id=message_id,
+            reply_markup=reply_markup,
+        )
+        message.message_id = message_id
+        return message
+
+    def edit_message_media(self, chat_id=None, message_id=None, media=None,
+                           reply_markup=None, **kwargs):
+        message = self._record(
+            'edit_message_media', chat_id, message_id=message_id, media=media,
+            reply_markup=reply_markup,
+        )
+        message.message_id = message_id
+        photo = media.media
+        file_id = 'uploaded:{}'.format(photo) if photo.startswith('http') else photo
+        message.photo = [SimpleNamespace(file_id=file_id)]
+        return message
+
+    def get_calls(self, method: str = None) -> List:
+        with self._lock:
+            return [call for call in self.calls if method is None or call[0] == method]
+
+    def count_calls(self) -> Dict[str, int]:
+        counts = {}
+        for method, chat_id, kwargs in self.get_calls():
+            counts[method] = counts.get(method, 0) + 1
+        return counts
+
+
+def make_message(bot: StubBot, chat_id: int, text: str = None, message_id: int = 0):
+    return SimpleNamespace(
+        chat_id=chat_id,
+        message_id=message_id,
+        text=text,
+        reply_text=lambda reply, **kwargs: bot.send_message(chat_id, reply, **kwargs),
+    )
+
+
+def make_message_update(bot: StubBot, chat_id: int, text: str) -> SimpleNamespace:
+    """Update with the attributes of telegram.Update used by BotProcessor."""
+    return SimpleNamespace(
+        message=make_message(bot, chat_id, text), callback_query=None
+    )
+
+
+def make_callback_query_update(
+        bot: StubBot, chat_id: int, data: str, message_id: int = 0
+) -> SimpleNamespace:
+    callback_query = SimpleNamespace(
+        data=data, message=make_message(bot, chat_id, message_id=message_id)
+    )
+    return SimpleNamespace(message=None, callback_query=callback_query)
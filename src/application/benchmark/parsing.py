@@ -0,0 +1,107 @@
+"""
+CPU cost of decoding a catalog response, creating products and reading
+their prices, compared with the standard json module, regular dataclasses
+and an uncached price parse:
+
+    python -m application.benchmark.parsing --products 1000
+"""
+from dataclasses import asdict, dataclass
+from decimal import Decimal
+from typing import Dict, Union
+import argparse
+import json
+import re
+import sys
+import time
+
+from application import fastjson
+from application.benchmark.fake_moltin import make_product_dct
+from application.ecommerce_api.moltin_api import parse
+from application.models import Product
+
+
+@dataclass
+class DictProduct:
+    """Product as it was before slots and the cached price parse."""
+    id: str
+    type: str
+    name: str
+    description: str
+    slug: str
+    sku: str
+    currency: Union[str, None] = None
+    formatted_price_with_tax: Union[str, None] = None
+    main_image_id: Union[str, None] = None
+
+    @property
+    def price(self) -> Decimal:
+        return Decimal(re.sub(r'[^\d\.]', '', self.formatted_price_with_tax))
+
+
+def make_catalog_content(products: int) -> bytes:
+    return json.dumps({
+        'data': [make_product_dct(number) for number in range(products)],
+        'meta': {'results': {'total': products}},
+    }).encode('utf-8')
+
+
+def measure(func, iterations: int) -> float:
+    """Return CPU seconds spent per call."""
+    func()
+    started_at = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - started_at) / iterations
+
+
+def create_products(product_cls, products_kwargs):
+    return [product_cls(**kwargs) for kwargs in products_kwargs]
+
+
+def read_prices(products):
+    return [product.price for product in products]
+
+
+def run(products: int = 1000, iterations: int = 20) -> Dict[str, float]:
+    content = make_catalog_content(products)
+    products_kwargs = [
+        asdict(product)
+        for product in parse.parse_products_list_response(json.loads(content)['data'])
+    ]
+    dict_products = create_products(DictProduct, products_kwargs)
+    slotted_products = create_products(Product, products_kwargs)
+    return {
+        'decode_baseline': measure(lambda: json.loads(content), iterations),
+        'decode': measure(lambda: fastjson.loads(content), iterations),
+        'create_baseline': measure(
+            lambda: create_products(DictProduct, products_kwargs), iterations
+        ),
+        'create': measure(lambda: create_products(Product, products_kwargs), iterations),
+        'prices_baseline': measure(lambda: read_prices(dict_products), iterations),
+        'prices': measure(lambda: read_prices(slotted_products), iterations),
+        'product_bytes_baseline': (
+            sys.getsizeof(dict_products[0]) + sys.getsizeof(dict_products[0].__dict__)
+        ),
+        'product_bytes': sys.getsizeof(slotted_products[0]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark catalog parsing.')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    report = run(args.products, args.iterations)
+    print('json backend: {}'.format(fastjson.backend))
+    for name in ('decode', 'create', 'prices'):
+        print('{:<8} {:>10.1f} ms, baseline {:>10.1f} ms'.format(
+            name, report[name] * 1000, report['{}_baseline'.format(name)] * 1000
+        ))
+    print('product  {:>10} bytes, baseline {:>7} bytes'.format(
+        report['product_bytes'], report['product_bytes_baseline']
+    ))
+
+
+if __name__ == '__main__':
+    main()
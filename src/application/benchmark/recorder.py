@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+from typing import Dict
+import threading
+import time
+
+from application.bot.loadgen import percentile
+
+
+class LatencyRecorder:
+    """
+    Collects durations by name and reports count, mean and percentiles.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, duration: float):
+        with self._lock:
+            self.durations.setdefault(name, []).append(duration)
+
+    @contextmanager
+    def measure(self, name: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started_at)
+
+    def wrap(self, name: str, func):
+        def wrapped(*args, **kwargs):
+            with self.measure(name):
+                return func(*args, **kwargs)
+
+        return wrapped
+
+    def get_report(self) -> Dict[str, Dict]:
+        with self._lock:
+            durations = {name: list(values) for name, values in self.durations.items()}
+        return {
+            name: {
+                'count': len(values),
+                'mean': sum(values) / len(values),
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+            }
+            for name, values in durations.items()
+        }
+
+
+def format_report(report: Dict[str, Dict]) -> str:
+    lines = ['{:<24} {:>7} {:>9} {:>9} {:>9} {:>9}'.format(
+        'name', 'count', 'mean, ms', 'p50, ms', 'p95, ms', 'p99, ms'
+    )]
+    for name, stats in sorted(report.items()):
+        lines.append('{:<24} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            name,
+            stats['count'],
+            stats['mean'] * 1000,
+            stats['p50'] * 1000,
+            stats['p95'] * 1000,
+            stats['p99'] * 1000,
+        ))
+    return '\n'.join(lines)
@@ -0,0 +1,93 @@
+"""
+Per-request CPU cost of response logging in MoltinApiSession
+for a large catalog response:
+
+    python -m application.benchmark.response_logging --products 500
+"""
+from datetime import timedelta
+from typing import Dict
+import argparse
+import json
+import logging
+import time
+
+import requests
+
+from application.benchmark.fake_moltin import make_product_dct
+from application.ecommerce_api.moltin_api import moltin
+from application.ecommerce_api.moltin_api.moltin import MoltinApiSession
+
+
+def make_response(products: int) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.url = 'http://fakeapi.com/v2/products'
+    response.elapsed = timedelta(milliseconds=50)
+    response._content = json.dumps({
+        'data': [make_product_dct(number) for number in range(products)],
+        'meta': {'results': {'total': products}},
+    }).encode('utf-8')
+    return response
+
+
+def eager_request(response: requests.Response) -> Dict:
+    """Request handling which formats the response for the log unconditionally."""
+    response_dict = response.json()
+    moltin.logger.debug(
+        'json response from {} with status code {} : {}'.format(
+            response.url, response.status_code, response_dict
+        )
+    )
+    return response_dict
+
+
+def measure(func, iterations: int) -> float:
+    """Return CPU seconds spent per call."""
+    func()
+    started_at = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - started_at) / iterations
+
+
+def run(products: int = 500, iterations: int = 50) -> Dict[str, float]:
+    response = make_response(products)
+    session = MoltinApiSession('http://fakeapi.com', 'client id', 'client secret')
+    session.access_token = 'access_token'
+    session.access_token_expires_in = time.time() + 3600
+    session._send_with_retries = lambda method, url, **kwargs: response
+
+    moltin_logger = moltin.logger
+    level, propagate = moltin_logger.level, moltin_logger.propagate
+    handler = logging.NullHandler()
+    moltin_logger.addHandler(handler)
+    moltin_logger.propagate = False
+    try:
+        moltin_logger.setLevel(logging.INFO)
+        report = {
+            'eager_info': measure(lambda: eager_request(response), iterations),
+            'lazy_info': measure(lambda: session.get('v2/products'), iterations),
+        }
+        moltin_logger.setLevel(logging.DEBUG)
+        report['eager_debug'] = measure(lambda: eager_request(response), iterations)
+        report['lazy_debug'] = measure(lambda: session.get('v2/products'), iterations)
+    finally:
+        moltin_logger.removeHandler(handler)
+        moltin_logger.setLevel(level)
+        moltin_logger.propagate = propagate
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark response logging.')
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    report = run(args.products, args.iterations)
+    for name, seconds in sorted(report.items()):
+        print('{:<12} {:>10.1f} us per request'.format(name, seconds * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Benchmark of the bot request path. BotProcessor talks to a local fake Moltin
+and a stub bot, user states are kept in fakeredis or in a given Redis:
+
+    python -m application.benchmark.runner --sessions 200 --moltin-latency 0.05
+
+With --send-queue handlers only queue their messages, they are delivered
+within the Telegram rate limits and the time to deliver them is reported.
+"""
+from typing import Dict
+import argparse
+import logging
+import os
+import time
+
+import fakeredis
+from jinja2 import Environment, FileSystemLoader
+
+from application.benchmark.fake_moltin import FakeMoltinServer
+from application.benchmark.fake_telegram import StubBot
+from application.benchmark.recorder import LatencyRecorder, format_report
+from application.benchmark.scenarios import SCENARIOS, run_scenarios
+from application.bot import telegram_bot
+from application.bot.send_queue import SendQueue
+from application.bot.telegram_bot import BotProcessor
+from application.database import RedisStorage
+from application.ecommerce_api.moltin_api.cache import CachedMoltinApi
+from application.ecommerce_api.moltin_api.moltin import MoltinApi, MoltinApiSession
+from application.ecommerce_api.moltin_api.shadow_cart import ShadowCartMoltinApi
+
+state_handlers = (
+    'handle_start',
+    'handle_menu',
+    'handle_product',
+    'handle_cart',
+    'handle_begin_checkout',
+)
+
+
+def create_processor(
+        moltin_api: MoltinApi, recorder: LatencyRecorder, send_queue: SendQueue = None
+) -> BotProcessor:
+    """BotProcessor whose state handlers report their duration to recorder."""
+    templates_directory = os.path.join(
+        os.path.dirname(os.path.abspath(telegram_bot.__file__)), 'templates'
+    )
+    env = Environment(loader=FileSystemLoader(templates_directory))
+    processor = BotProcessor(moltin_api, env, send_queue=send_queue)
+    for name in state_handlers:
+        setattr(processor, name, recorder.wrap(name, getattr(processor, name)))
+    return processor
+
+
+def run(
+        scenario_names,
+        sessions: int = 100,
+        concurrency: int = 10,
+        catalog_size: int = 100,
+        moltin_latency: float = 0.0,
+        telegram_latency: float = 0.0,
+        catalog_cache: bool = False,
+        redis_url: str = None,
+        shadow_cart: bool = False,
+        send_queue: bool = False,
+        telegram_global_rate: float = 30.0,
+        telegram_chat_rate: float = 1.0,
+) -> Dict:
+    if redis_url:
+        RedisStorage.initialize(url=redis_url, max_connections=concurrency * 2)
+    else:
+        RedisStorage.connection = fakeredis.FakeRedis()
+
+    fake_moltin = FakeMoltinServer(catalog_size=catalog_size, latency=moltin_latency)
+    fake_moltin.start()
+    try:
+        session = MoltinApiSession(fake_moltin.url, 'client id', 'client secret')
+        if shadow_cart:
+            moltin_api = ShadowCartMoltinApi(session)
+        elif catalog_cache:
+            moltin_api = CachedMoltinApi(session)
+        else:
+            moltin_api = MoltinApi(session)
+
+        recorder = LatencyRecorder()
+        bot = StubBot(latency=telegram_latency)
+        queue = None
+        if send_queue:
+            queue = SendQueue(
+                bot,
+                global_rate=telegram_global_rate,
+                global_burst=telegram_global_rate,
+                chat_rate=telegram_chat_rate,
+            )
+            queue.start()
+        processor = create_processor(moltin_api, recorder, queue)
+        product_ids = [product['id'] for product in fake_moltin.products]
+        report = run_scenarios(
+            processor.handle_use_reply,
+            bot,
+            product_ids,
+            scenario_names,
+            sessions=sessions,
+            concurrency=concurrency,
+            recorder=recorder,
+        )
+        if queue is not None:
+            started_at = time.perf_counter()
+            queue.stop()
+            report['delivery_elapsed'] = time.perf_counter() - started_at
+            report['bot_calls'] = bot.count_calls()
+        if shadow_cart:
+            moltin_api.shutdown()
+        report['moltin_requests'] = fake_moltin.requests
+        return report
+    finally:
+        fake_moltin.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bot request path.')
+    parser.add_argument(
+        '--scenario',
+        action='append',
+        choices=sorted(SCENARIOS),
+        default=None,
+        help='scenario to play, can be repeated, all scenarios by default',
+    )
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--catalog-size', type=int, default=100)
+    parser.add_argument('--moltin-latency', type=float, default=0.0)
+    parser.add_argument('--telegram-latency', type=float, default=0.0)
+    parser.add_argument('--catalog-cache', action='store_true')
+    parser.add_argument(
+        '--shadow-cart', action='store_true', help='implies --catalog-cache'
+    )
+    parser.add_argument('--send-queue', action='store_true')
+    parser.add_argument('--telegram-global-rate', type=float, default=30.0)
+    parser.add_argument('--telegram-chat-rate', type=float, default=1.0)
+    parser.add_argument(
+        '--redis-url', default=None, help='use Redis instead of fakeredis'
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = run(
+        args.scenario or sorted(SCENARIOS),
+        sessions=args.sessions,
+        concurrency=args.concurrency,
+        catalog_size=args.catalog_size,
+        moltin_latency=args.moltin_latency,
+        telegram_latency=args.telegram_latency,
+        catalog_cache=args.catalog_cache,
+        redis_url=args.redis_url,
+        shadow_cart=args.shadow_cart,
+        send_queue=args.send_queue,
+        telegram_global_rate=args.telegram_global_rate,
+        telegram_chat_rate=args.telegram_chat_rate,
+    )
+
+    print(
+        'sessions: {sessions}, updates: {updates}, elapsed: {elapsed:.2f}s, '
+        '{updates_per_second:.1f} updates/s, moltin requests: {moltin_requests}'.format(
+            **report
+        )
+    )
+    if 'delivery_elapsed' in report:
+        print('messages delivered {:.2f}s after the last update'.format(
+            report['delivery_elapsed']
+        ))
+    print('bot calls: {}'.format(report['bot_calls']))
+    print(format_report(report['latency']))
+
+
+if __name__ == '__main__':
+    main()
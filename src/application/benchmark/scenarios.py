@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+import json
+import random
+import time
+
+from application.benchmark.fake_telegram import (
+    StubBot,
+    make_message_update,
+    make_callback_query_update,
+)
+from application.benchmark.recorder import LatencyRecorder
+
+MESSAGE = 'message'
+CALLBACK = 'callback'
+
+
+def browse_menu(product_ids: List[str]) -> List[Tuple[str, str]]:
+    return [
+        (MESSAGE, '/start'),
+        (CALLBACK, 'menu_page:1'),
+        (CALLBACK, 'menu_page:0'),
+        (CALLBACK, random.choice(product_ids)),
+        (CALLBACK, 'menu'),
+    ]
+
+
+def add_to_cart(product_ids: List[str]) -> List[Tuple[str, str]]:
+    product_id = random.choice(product_ids)
+    return [
+        (MESSAGE, '/start'),
+        (CALLBACK, product_id),
+        (CALLBACK, json.dumps({'id': product_id, 'qty': '1'})),
+    ]
+
+
+def view_cart(product_ids: List[str]) -> List[Tuple[str, str]]:
+    return [
+        (MESSAGE, '/start'),
+        (CALLBACK, 'cart'),
+        (CALLBACK, 'menu'),
+    ]
+
+
+def search(product_ids: List[str]) -> List[Tuple[str, str]]:
+    """Products of the fake catalog are named after their position."""
+    number = random.randrange(len(product_ids))
+    return [
+        (MESSAGE, '/start'),
+        (MESSAGE, 'product {}'.format(number)),
+        (CALLBACK, product_ids[number]),
+        (CALLBACK, 'menu'),
+    ]
+
+
+def checkout(product_ids: List[str]) -> List[Tuple[str, str]]:
+    return add_to_cart(product_ids) + [
+        (CALLBACK, 'cart'),
+        (CALLBACK, 'begin_checkout'),
+        (MESSAGE, '+10000000000'),
+    ]
+
+
+SCENARIOS = {
+    'browse': browse_menu,
+    'add_to_cart': add_to_cart,
+    'cart': view_cart,
+    'search': search,
+    'checkout': checkout,
+}
+
+
+def run_scenarios(
+        handle_update: Callable,
+        bot: StubBot,
+        product_ids: List[str],
+        scenario_names: List[str],
+        sessions: int = 100,
+        concurrency: int = 10,
+        recorder: LatencyRecorder = None,
+) -> Dict:
+    """
+    Play sessions of the given scenarios, each session is a separate chat
+    whose updates are handled one after another. Sessions run concurrently.
+    """
+    recorder = recorder or LatencyRecorder()
+    sessions_scenarios = [scenario_names[number % len(scenario_names)]
+                          for number in range(sessions)]
+
+    def play(scenario_name, chat_id):
+        steps = SCENARIOS[scenario_name](product_ids)
+        for kind, text in steps:
+            if kind == MESSAGE:
+                update = make_message_update(bot, chat_id, text)
+            else:
+                update = make_callback_query_update(bot, chat_id, text)
+            with recorder.measure('update'):
+                handle_update(bot, update)
+        return len(steps)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        updates = sum(
+            executor.map(play, sessions_scenarios, range(1, sessions + 1))
+        )
+    elapsed = time.perf_counter() - started_at
+
+    return {
+        'sessions': sessions,
+        'updates': updates,
+        'elapsed': elapsed,
+        'updates_per_second': updates / elapsed if elapsed else 0.0,
+        'latency': recorder.get_report(),
+        'bot_calls': bot.count_calls(),
+    }
@@ -0,0 +1,67 @@
+"""
+Time to build the product search index, to update it after a catalog
+refresh and to answer typed queries:
+
+    python -m application.benchmark.search --products 10000
+"""
+from dataclasses import replace
+from typing import Dict
+import argparse
+import random
+import time
+
+from application.benchmark.fake_moltin import make_product_dct
+from application.ecommerce_api.moltin_api.parse import parse_products_list_response
+from application.ecommerce_api.moltin_api.search import ProductSearchIndex
+
+
+def measure_once(func) -> float:
+    started_at = time.perf_counter()
+    func()
+    return time.perf_counter() - started_at
+
+
+def run(products: int = 10000, queries: int = 1000, changed: float = 0.01) -> Dict:
+    catalog = parse_products_list_response(
+        [make_product_dct(number) for number in range(products)]
+    )
+    index = ProductSearchIndex()
+    build = measure_once(lambda: index.update(catalog))
+
+    refreshed_catalog = list(catalog)
+    for number in random.sample(range(products), int(products * changed)):
+        product = refreshed_catalog[number]
+        refreshed_catalog[number] = replace(product, name=product.name + ' new')
+    update = measure_once(lambda: index.update(refreshed_catalog))
+
+    search_queries = [
+        random.choice(['product {}', 'sku{}', 'description of {}']).format(
+            random.randrange(products)
+        )
+        for _ in range(queries)
+    ]
+    search = measure_once(lambda: [index.search(query) for query in search_queries])
+    return {
+        'build': build,
+        'update': update,
+        'search': search / queries,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the product search index.')
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument(
+        '--changed', type=float, default=0.01, help='share of products changed'
+    )
+    args = parser.parse_args()
+
+    report = run(args.products, args.queries, args.changed)
+    print('build   {:>10.1f} ms'.format(report['build'] * 1000))
+    print('update  {:>10.1f} ms'.format(report['update'] * 1000))
+    print('search  {:>10.3f} ms per query'.format(report['search'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
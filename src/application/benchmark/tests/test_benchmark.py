@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+import json
+
+import pytest
+
+from application.benchmark import response_logging
+from application.benchmark.fake_moltin import FakeMoltinServer
+from application.benchmark.fake_telegram import StubBot
+from application.benchmark.recorder import LatencyRecorder
+from application.benchmark.scenarios import SCENARIOS, run_scenarios
+from application.ecommerce_api.moltin_api.moltin import MoltinApi, MoltinApiSession
+from application.ecommerce_api.moltin_api.exceptions import MoltinApiError
+
+
+@pytest.fixture
+def fake_moltin():
+    server = FakeMoltinServer(catalog_size=25)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def moltin_api(fake_moltin):
+    session = MoltinApiSession(fake_moltin.url, 'client id', 'client secret')
+    return MoltinApi(session)
+
+
+def test_fake_moltin_serves_catalog(moltin_api):
+    products, total = moltin_api.get_products_page(offset=20, limit=10)
+    assert total == 25
+    assert [product.id for product in products] == [
+        'product-{}'.format(number) for number in range(20, 25)
+    ]
+    assert len(moltin_api.get_all_products(page_size=10)) == 25
+
+    product = moltin_api.get_product_by_id('product-3')
+    file = moltin_api.get_file_by_id(product.main_image_id)
+    assert product.formatted_price_with_tax == '$10.30'
+    assert file.link == 'https://files.example.com/file-3.png'
+
+
+def test_fake_moltin_keeps_carts(moltin_api, fake_moltin):
+    moltin_api.add_product_to_cart('1', 'product-1', quantity=2)
+    moltin_api.add_product_to_cart('1', 'product-2')
+    moltin_api.remove_item_from_cart('1', 'item-product-2')
+
+    cart_header, cart_content = moltin_api.get_cart_with_items('1')
+    assert cart_header.formatted_price_with_tax == '$20.20'
+    assert [(item.product_id, item.quantity) for item in cart_content] == [
+        ('product-1', 2)
+    ]
+
+    with pytest.raises(MoltinApiError):
+        moltin_api.add_product_to_cart('1', 'unknown product')
+
+    moltin_api.create_flow({'name': '1'})
+    assert fake_moltin.flows == [{'name': '1'}]
+
+
+def test_scenarios_played_per_chat_in_order():
+    handled = []
+
+    def handle_update(bot, update):
+        if update.message:
+            handled.append((update.message.chat_id, update.message.text))
+            update.message.reply_text('ok')
+        else:
+            query = update.callback_query
+            handled.append((query.message.chat_id, query.data))
+            bot.delete_message(chat_id=query.message.chat_id, message_id=0)
+
+    bot = StubBot()
+    report = run_scenarios(
+        handle_update,
+        bot,
+        ['product-1'],
+        ['checkout', 'cart'],
+        sessions=4,
+        concurrency=2,
+    )
+
+    assert report['updates'] == 2 * 6 + 2 * 3
+    assert report['latency']['update']['count'] == report['updates']
+    assert report['bot_calls'] == {'send_message': 6, 'delete_message': 12}
+    checkout_steps = [text for chat_id, text in handled if chat_id == 1]
+    assert checkout_steps == [
+        text for kind, text in SCENARIOS['checkout'](['product-1'])
+    ]
+    assert json.loads(checkout_steps[2]) == {'id': 'product-1', 'qty': '1'}
+
+
+def test_stub_bot_edits_messages_in_place():
+    bot = StubBot()
+    message = bot.send_message(1, 'menu')
+
+    edited = bot.edit_message_text('cart', chat_id=1, message_id=message.message_id)
+    assert (edited.message_id, edited.text) == (message.message_id, 'cart')
+
+    photo_message = bot.send_photo(1, 'file-id')
+    media = SimpleNamespace(media='http://example.com/photo.jpg', caption='product')
+    edited = bot.edit_message_media(
+        chat_id=1, message_id=photo_message.message_id, media=media
+    )
+    assert edited.message_id == photo_message.message_id
+    assert edited.photo[-1].file_id == 'uploaded:http://example.com/photo.jpg'
+    assert bot.count_calls() == {
+        'send_message': 1,
+        'send_photo': 1,
+        'edit_message_text': 1,
+        'edit_message_media': 1,
+    }
+
+
+def test_latency_recorder_report():
+    recorder = LatencyRecorder()
+    for duration in range(1, 101):
+        recorder.record('handle_menu', duration / 1000)
+
+    report = recorder.get_report()['handle_menu']
+    assert report['count'] == 100
+    assert report['p50'] == pytest.approx(0.051, abs=0.001)
+    assert report['p99'] == pytest.approx(0.099, abs=0.001)
+
+
+def test_response_logging_benchmark():
+    report = response_logging.run(products=20, iterations=2)
+    assert sorted(report) == ['eager_debug', 'eager_info', 'lazy_debug', 'lazy_info']
@@ -0,0 +1,57 @@
+from typing import Union
+import logging
+
+import redis
+
+from application.database import RedisStorage
+from application.metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramFileIdCache:
+    """
+    Maps Moltin file ids to file_id of the photo uploaded to Telegram,
+    so a photo is uploaded once and then sent by its file_id without
+    asking Moltin for the file. Telegram file ids are valid only for the
+    bot which uploaded the file, keep one Redis database per bot.
+    Redis errors are logged and treated as a cache miss.
+    """
+
+    key_template = 'telegram:file_id:{}'
+
+    def get(self, moltin_file_id: str) -> Union[str, None]:
+        key = TelegramFileIdCache.key_template.format(moltin_file_id)
+        try:
+            file_id = RedisStorage.get(key)
+        except redis.RedisError as e:
+            logger.error('Cannot read {} from cache: {}'.format(key, str(e)))
+            return None
+        metrics.increment(
+            'cache_requests_total',
+            cache='telegram_file_id',
+            result='miss' if file_id is None else 'hit',
+        )
+        return file_id
+
+    def set(self, moltin_file_id: str, file_id: str):
+        key = TelegramFileIdCache.key_template.format(moltin_file_id)
+        try:
+            RedisStorage.set(key, file_id)
+        except redis.RedisError as e:
+            logger.error('Cannot write {} to cache: {}'.format(key, str(e)))
+
+    def delete(self, moltin_file_id: str):
+        key = TelegramFileIdCache.key_template.format(moltin_file_id)
+        try:
+            RedisStorage.delete(key)
+        except redis.RedisError as e:
+            logger.error('Cannot delete {} from cache: {}'.format(key, str(e)))
+
+
+def get_photo_file_id(message) -> Union[str, None]:
+    """file_id of the largest size of the photo in a sent message."""
+    photo = getattr(message, 'photo', None)
+    if not photo:
+        return None
+    return photo[-1].file_id
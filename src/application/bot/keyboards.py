@@ -0,0 +1,61 @@
+from typing import Callable, Hashable, Union
+import threading
+
+
+class KeyboardCache:
+    """
+    Reply markups built for one version of the catalog. Markups of an older
+    version are never served: the cache is emptied when a newer version is
+    seen or when the catalog reports a refresh.
+    Without a version, e.g. the catalog is not cached, markups are built
+    on every call.
+    A version which changes a few products keeps the markups which do
+    not depend on them, see keep_valid.
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self.version = None
+        self._markups = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: Union[int, None], build: Callable):
+        if version is None:
+            return build()
+
+        with self._lock:
+            if self.version is None or version > self.version:
+                self.version = version
+                self._markups = {}
+            elif version < self.version:
+                return build()
+            markup = self._markups.get(key)
+
+        if markup is None:
+            markup = build()
+            with self._lock:
+                if version == self.version and len(self._markups) < self.max_size:
+                    self._markups[key] = markup
+        return markup
+
+    def invalidate(self, version: Union[int, None] = None):
+        with self._lock:
+            self._markups = {}
+            if version is not None:
+                self.version = version
+
+    def keep_valid(self, version: int, is_outdated: Callable[[Hashable], bool]):
+        """
+        Move markups of the previous version for which is_outdated(key)
+        is false to the new version, drop the rest.
+        """
+        with self._lock:
+            if self.version is None or self.version != version - 1:
+                self._markups = {}
+            else:
+                self._markups = {
+                    key: markup
+                    for key, markup in self._markups.items()
+                    if not is_outdated(key)
+                }
+            self.version = version
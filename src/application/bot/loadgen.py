@@ -0,0 +1,143 @@
+"""
+Load generator for the webhook mode.
+Replays synthetic Telegram updates against a running webhook server:
+
+    python -m application.bot.loadgen http://localhost:8443/<token> --updates 1000
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import argparse
+import itertools
+import random
+import threading
+import time
+
+import requests
+
+update_ids = itertools.count(1)
+update_ids_lock = threading.Lock()
+
+
+def _next_update_id() -> int:
+    with update_ids_lock:
+        return next(update_ids)
+
+
+def _make_chat(chat_id: int) -> Dict:
+    return {'id': chat_id, 'type': 'private', 'first_name': 'User {}'.format(chat_id)}
+
+
+def make_message_update(chat_id: int, text: str) -> Dict:
+    update_id = _next_update_id()
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': _make_chat(chat_id),
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+            'text': text,
+        },
+    }
+
+
+def make_callback_query_update(chat_id: int, data: str) -> Dict:
+    update_id = _next_update_id()
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(chat_id),
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': _make_chat(chat_id),
+            },
+        },
+    }
+
+
+def make_updates(count: int, chats: int, callbacks: List[str]) -> List[Dict]:
+    updates = []
+    for _ in range(count):
+        chat_id = random.randint(1, chats)
+        if random.random() < 0.1:
+            updates.append(make_message_update(chat_id, '/start'))
+        else:
+            updates.append(make_callback_query_update(chat_id, random.choice(callbacks)))
+    return updates
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def replay(url: str, updates: List[Dict], concurrency: int = 10) -> Dict:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def send(update):
+        started_at = time.monotonic()
+        try:
+            status = session.post(url, json=update, timeout=10).status_code
+        except requests.RequestException:
+            status = None
+        return status, time.monotonic() - started_at
+
+    started_at = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, updates))
+    elapsed = time.monotonic() - started_at
+
+    latencies = [latency for status, latency in results]
+    return {
+        'updates': len(updates),
+        'accepted': sum(1 for status, latency in results if status == 200),
+        'rejected': sum(1 for status, latency in results if status == 503),
+        'failed': sum(1 for status, latency in results if status not in (200, 503)),
+        'elapsed': elapsed,
+        'updates_per_second': len(updates) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay synthetic Telegram updates.')
+    parser.add_argument('url', help='webhook url including the token path')
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument(
+        '--callback',
+        action='append',
+        default=None,
+        help='callback data to send, can be repeated',
+    )
+    args = parser.parse_args()
+
+    callbacks = args.callback or ['menu', 'cart']
+    updates = make_updates(args.updates, args.chats, callbacks)
+    report = replay(args.url, updates, args.concurrency)
+
+    print(
+        'updates: {updates}, accepted: {accepted}, rejected: {rejected}, '
+        'failed: {failed}'.format(**report)
+    )
+    print(
+        'elapsed: {elapsed:.2f}s, {updates_per_second:.1f} updates/s, '
+        'p50: {p50:.4f}s, p95: {p95:.4f}s, p99: {p99:.4f}s'.format(**report)
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+from collections import deque
+from typing import Callable
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def get_update_chat_id(update):
+    if update.callback_query is not None:
+        return update.callback_query.message.chat_id
+    if update.message is not None:
+        return update.message.chat_id
+    return None
+
+
+def get_update_callback_data(update):
+    if update.callback_query is not None:
+        return update.callback_query.data
+    return None
+
+
+class Shard:
+    def __init__(self, number: int):
+        self.number = number
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        # Chat id and callback data of the update which is being handled.
+        self.current = None
+
+
+class ChatScheduler:
+    """
+    Runs update handlers on a pool of shards, each shard is served by one thread.
+    Updates of one chat always go to the same shard, so they are handled
+    strictly in order, while updates of different chats run in parallel.
+
+    Every shard has a bounded queue, overflow_policy decides which update
+    is dropped when it is full. With merge_duplicate_callbacks a callback
+    press is dropped while the same press of the same chat is still queued
+    or being handled, e.g. a double click on a keyboard button.
+    """
+
+    POLICY_DROP_NEWEST = 'drop_newest'
+    POLICY_DROP_OLDEST = 'drop_oldest'
+
+    def __init__(
+            self,
+            handler: Callable,
+            shards: int = 8,
+            shard_queue_size: int = 100,
+            overflow_policy: str = POLICY_DROP_NEWEST,
+            merge_duplicate_callbacks: bool = True,
+    ):
+        if overflow_policy not in (
+                ChatScheduler.POLICY_DROP_NEWEST,
+                ChatScheduler.POLICY_DROP_OLDEST,
+        ):
+            raise ValueError('Unknown overflow policy: {}'.format(overflow_policy))
+        self.handler = handler
+        self.shard_queue_size = shard_queue_size
+        self.overflow_policy = overflow_policy
+        self.merge_duplicate_callbacks = merge_duplicate_callbacks
+        self.shards = [Shard(number) for number in range(shards)]
+        self._stopped = False
+
+    def start(self):
+        for shard in self.shards:
+            shard.thread = threading.Thread(
+                target=self._run,
+                args=(shard,),
+                name='chat-shard-{}'.format(shard.number),
+                daemon=True,
+            )
+            shard.thread.start()
+
+    def stop(self):
+        self._stopped = True
+        for shard in self.shards:
+            with shard.condition:
+                shard.condition.notify()
+        for shard in self.shards:
+            if shard.thread is not None:
+                shard.thread.join()
+
+    def get_shard(self, chat_id) -> Shard:
+        return self.shards[hash(chat_id) % len(self.shards)]
+
+    def submit(self, bot, update) -> bool:
+        """
+        Queue the update, returns False if it has been dropped.
+        """
+        chat_id = get_update_chat_id(update)
+        callback_data = get_update_callback_data(update)
+        shard = self.get_shard(chat_id)
+
+        with shard.condition:
+            if self.merge_duplicate_callbacks and callback_data is not None:
+                pending = [(item[0], item[1]) for item in shard.queue]
+                if shard.current is not None:
+                    pending.append(shard.current)
+                if (chat_id, callback_data) in pending:
+                    logger.debug(
+                        'Duplicate callback {} of chat {} merged'.format(
+                            callback_data, chat_id
+                        )
+                    )
+                    return False
+
+            if len(shard.queue) >= self.shard_queue_size:
+                if self.overflow_policy == ChatScheduler.POLICY_DROP_NEWEST:
+                    logger.warning(
+                        'Shard {} is full, update of chat {} dropped'.format(
+                            shard.number, chat_id
+                        )
+                    )
+                    return False
+                dropped_chat_id, _, _, _ = shard.queue.popleft()
+                logger.warning(
+                    'Shard {} is full, oldest update of chat {} dropped'.format(
+                        shard.number, dropped_chat_id
+                    )
+                )
+
+            shard.queue.append((chat_id, callback_data, bot, update))
+            shard.condition.notify()
+        return True
+
+    def _run(self, shard: Shard):
+        while True:
+            with shard.condition:
+                while not shard.queue and not self._stopped:
+                    shard.condition.wait()
+                if not shard.queue:
+                    return
+                chat_id, callback_data, bot, update = shard.queue.popleft()
+                shard.current = (chat_id, callback_data)
+
+            try:
+                self.handler(bot, update)
+            except Exception as e:
+                logger.error(
+                    'Update of chat {} has not been handled: {}'.format(chat_id, str(e))
+                )
+            finally:
+                with shard.condition:
+                    shard.current = None
@@ -0,0 +1,281 @@
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from functools import wraps
+from typing import Callable, List, Tuple
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from application.ecommerce_api.moltin_api.ratelimit import TokenBucket
+from application.metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SendQueueFull(Exception):
+    pass
+
+
+def call_method(bot, method: str, *args, **kwargs):
+    """Job which makes a single call of the bot."""
+    return getattr(bot, method)(*args, **kwargs)
+
+
+class Chat:
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.jobs = deque()
+        # A job of the chat is being run or the chat waits in the ready heap.
+        self.busy = False
+        self.scheduled = False
+        # Token for the next job is taken, the chat waits until it is refilled.
+        self.token_reserved = False
+
+
+class PacedBot:
+    """
+    Bot given to a job: every call waits for the global limit and is retried
+    after flood control. The first call of the job uses the token of the chat
+    taken when the job was scheduled, every further call, e.g. send after
+    delete, takes one more token of the chat and waits for it.
+    """
+
+    def __init__(self, send_queue: 'SendQueue', chat: Chat):
+        self._send_queue = send_queue
+        self._chat = chat
+        self._calls = 0
+
+    def __getattr__(self, name):
+        method = getattr(self._send_queue.bot, name)
+        if not callable(method):
+            return method
+
+        @wraps(method)
+        def call(*args, **kwargs):
+            if self._calls:
+                self._chat.bucket.acquire(float('inf'))
+            self._calls += 1
+            return self._send_queue.call(method, *args, **kwargs)
+
+        return call
+
+
+class SendQueue:
+    """
+    Talks to Telegram from a pool of worker threads, so update handlers
+    return without waiting for Telegram.
+
+    A job is a function which gets the bot and makes one or several calls,
+    e.g. edits a message or deletes it and sends a new one. Jobs of one chat
+    are run strictly in order, at most chat_rate calls of the bot per second
+    with bursts of chat_burst. Every call of the bot also waits for a token
+    of the global bucket of global_rate calls per second.
+
+    When Telegram answers with RetryAfter (flood control) all workers pause
+    for the given time and the call is retried up to max_retries times.
+    """
+
+    def __init__(
+            self,
+            bot,
+            global_rate: float = 30.0,
+            global_burst: float = 30.0,
+            chat_rate: float = 1.0,
+            chat_burst: float = 3.0,
+            workers: int = 4,
+            max_retries: int = 3,
+            max_size: int = 10000,
+            max_chats: int = 10000,
+            stop_timeout: float = None,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = max(chat_burst, 1)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.max_size = max_size
+        self.max_chats = max_chats
+        self.stop_timeout = stop_timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.global_bucket = TokenBucket(
+            global_rate, max(global_burst, 1), clock=clock, sleep=sleep
+        )
+        self.size = 0
+        self.paused_until = 0.0
+        self._chats = OrderedDict()
+        self._ready = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopped = False
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name='send-queue-{}'.format(number), daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """
+        Deliver queued jobs and stop the workers. Waits at most stop_timeout
+        seconds, jobs still queued then are lost.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        deadline = None
+        if self.stop_timeout is not None:
+            deadline = time.monotonic() + self.stop_timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        if any(thread.is_alive() for thread in self._threads):
+            logger.error('Send queue stopped, {} jobs lost'.format(self.size))
+        self._threads = []
+
+    def submit(self, chat_id, job: Callable, *args, **kwargs) -> Future:
+        """
+        Queue job(bot, *args, **kwargs) for the chat, return a Future
+        of its result. The future fails with SendQueueFull if the queue is full.
+        """
+        future = Future()
+        with self._condition:
+            if self.size >= self.max_size:
+                logger.warning(
+                    'Send queue is full, job of chat {} dropped'.format(chat_id)
+                )
+                metrics.increment('telegram_send_dropped_total')
+                future.set_exception(SendQueueFull())
+                return future
+
+            chat = self._get_chat(chat_id)
+            chat.jobs.append((future, self.clock(), job, args, kwargs))
+            self.size += 1
+            if not chat.busy and not chat.scheduled:
+                self._schedule(chat_id, chat, self.clock())
+        return future
+
+    def call(self, method: Callable, *args, **kwargs):
+        """Call the bot method within the global limit, retry after flood control."""
+        for attempt in itertools.count():
+            self._wait_for_pause()
+            self.global_bucket.acquire(float('inf'))
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                # telegram.error.RetryAfter, the call has not been made.
+                retry_after = getattr(e, 'retry_after', None)
+                if retry_after is None or attempt >= self.max_retries:
+                    raise
+                logger.warning(
+                    'Flood control of Telegram, retry in {}s'.format(retry_after)
+                )
+                metrics.increment('telegram_send_retries_total')
+                with self._condition:
+                    self.paused_until = max(
+                        self.paused_until, self.clock() + retry_after
+                    )
+
+    def collect_metrics(self) -> List[Tuple]:
+        """Samples of the queue state for the metrics registry."""
+        with self._condition:
+            return [
+                ('telegram_send_queue_size', 'gauge', {}, self.size),
+                ('telegram_send_queue_chats', 'gauge', {}, len(self._chats)),
+            ]
+
+    def _get_chat(self, chat_id) -> Chat:
+        chat = self._chats.get(chat_id)
+        if chat is not None:
+            self._chats.move_to_end(chat_id)
+            return chat
+
+        if len(self._chats) >= self.max_chats:
+            # Forget the limits of the chats which have not sent anything lately.
+            for idle_chat_id in list(self._chats):
+                if len(self._chats) < self.max_chats:
+                    break
+                idle_chat = self._chats[idle_chat_id]
+                if not idle_chat.jobs and not idle_chat.busy and not idle_chat.scheduled:
+                    del self._chats[idle_chat_id]
+        bucket = TokenBucket(
+            self.chat_rate, self.chat_burst, clock=self.clock, sleep=self.sleep
+        )
+        chat = self._chats[chat_id] = Chat(bucket)
+        return chat
+
+    def _schedule(self, chat_id, chat: Chat, ready_at: float):
+        chat.scheduled = True
+        heapq.heappush(self._ready, (ready_at, next(self._sequence), chat_id))
+        self._condition.notify()
+
+    def _wait_for_pause(self):
+        with self._condition:
+            wait = self.paused_until - self.clock()
+        if wait > 0:
+            self.sleep(wait)
+
+    def _take_job(self):
+        """Wait for a chat whose next job may be run, None when stopped."""
+        with self._condition:
+            while True:
+                if not self._ready:
+                    if self._stopped and not self.size:
+                        return None
+                    self._condition.wait()
+                    continue
+
+                ready_at, _, chat_id = self._ready[0]
+                now = self.clock()
+                wait = max(ready_at, self.paused_until) - now
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+
+                heapq.heappop(self._ready)
+                chat = self._chats[chat_id]
+                chat.scheduled = False
+                if not chat.token_reserved:
+                    wait = chat.bucket.reserve(float('inf'))
+                    if wait > 0:
+                        chat.token_reserved = True
+                        self._schedule(chat_id, chat, now + wait)
+                        continue
+                chat.token_reserved = False
+                chat.busy = True
+                self.size -= 1
+                return (chat_id, chat) + chat.jobs.popleft()
+
+    def _run(self):
+        while True:
+            taken = self._take_job()
+            if taken is None:
+                return
+            chat_id, chat, future, queued_at, job, args, kwargs = taken
+            metrics.observe('telegram_send_queue_wait_seconds', self.clock() - queued_at)
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    paced_bot = PacedBot(self, chat)
+                    future.set_result(job(paced_bot, *args, **kwargs))
+            except Exception as e:
+                logger.error(
+                    'Message to chat {} has not been sent: {}'.format(chat_id, str(e))
+                )
+                metrics.increment(
+                    'errors_total', source='telegram_send_queue', error=type(e).__name__
+                )
+                future.set_exception(e)
+            finally:
+                with self._condition:
+                    chat.busy = False
+                    if chat.jobs:
+                        self._schedule(chat_id, chat, self.clock())
+                    elif self._stopped and not self.size:
+                        self._condition.notify_all()
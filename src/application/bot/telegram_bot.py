@@ -1,7 +1,9 @@
 import json
 import os
-from functools import wraps
+from functools import partial, wraps
 from logging import getLogger
+import signal
+import time
 import uuid
 
 from telegram.ext import (
@@ -11,37 +13,165 @@ from telegram.ext import (
     Updater,
     Filters,
 )
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputMediaPhoto,
+    Update,
+)
+from telegram.error import BadRequest
 from jinja2 import Environment, FileSystemLoader
 
+from application.metrics import registry as metrics
 from application.models import User
 from application.ecommerce_api.moltin_api.exceptions import MoltinApiError, MoltinError
 from application.ecommerce_api.moltin_api.moltin import MoltinApi
 from application.bot.utils import chunks
+from application.bot.keyboards import KeyboardCache
+from application.bot.file_ids import TelegramFileIdCache, get_photo_file_id
+from application.bot.webhook import WebhookServer
+from application.bot.scheduler import ChatScheduler
+from application.bot.send_queue import SendQueue, SendQueueFull, call_method
 
 logger = getLogger(__name__)
 
+telegram_methods = (
+    'send_message',
+    'send_photo',
+    'delete_message',
+    'edit_message_text',
+    'edit_message_reply_markup',
+    'edit_message_media',
+    'answer_callback_query',
+)
+
+
+def log_delivery_failure(chat_id, job_name, future):
+    """Done callback of a queued job, the handler which queued it has returned."""
+    error = None if future.cancelled() else future.exception()
+    if error is None:
+        return
+    if isinstance(error, SendQueueFull):
+        logger.error('Message {} to chat {} is dropped'.format(job_name, chat_id))
+    else:
+        logger.error(
+            'Message {} to chat {} has failed: {}'.format(job_name, chat_id, str(error))
+        )
+
+
+def instrument_bot(bot):
+    """Time outgoing Telegram calls of the bot."""
+    for name in telegram_methods:
+        setattr(bot, name, metrics.timed('telegram_call_seconds')(getattr(bot, name)))
+
 
 class TelegramBot:
-    def __init__(self, token: str, moltin_api: MoltinApi):
-        self.updater = Updater(token=token)
+    def __init__(
+            self,
+            token: str,
+            moltin_api: MoltinApi,
+            webhook_settings=None,
+            scheduler_settings=None,
+            edit_messages=True,
+            send_queue_settings=None,
+    ):
+        self.token = token
+        self.webhook_settings = webhook_settings
+        self.webhook_server = None
+        self._stop_signal = None
+        request_kwargs = None
+        if webhook_settings is not None:
+            # Every webhook worker may talk to Telegram at the same time.
+            request_kwargs = {'con_pool_size': webhook_settings.get('workers', 4) + 4}
+        self.updater = Updater(token=token, request_kwargs=request_kwargs)
+        instrument_bot(self.updater.bot)
         templates_directory = os.path.join(
             os.path.dirname(os.path.abspath(__file__)), 'templates'
         )
         file_loader = FileSystemLoader(templates_directory)
         env = Environment(loader=file_loader)
-        bot_processor = BotProcessor(moltin_api, env)
+        self.send_queue = None
+        if send_queue_settings is not None:
+            self.send_queue = SendQueue(self.updater.bot, **send_queue_settings)
+            metrics.register_collector(self.send_queue.collect_metrics)
+        bot_processor = BotProcessor(
+            moltin_api, env, edit_messages=edit_messages, send_queue=self.send_queue
+        )
         dispatcher = self.updater.dispatcher
 
-        dispatcher.add_handler(CallbackQueryHandler(bot_processor.handle_use_reply))
-        dispatcher.add_handler(CommandHandler('start', bot_processor.handle_use_reply))
-        dispatcher.add_handler(
-            MessageHandler(Filters.text, bot_processor.handle_use_reply)
-        )
+        handle_use_reply = bot_processor.handle_use_reply
+        self.scheduler = None
+        if scheduler_settings is not None:
+            # Dispatcher only queues updates, scheduler shards handle them.
+            self.scheduler = ChatScheduler(
+                bot_processor.handle_use_reply, **scheduler_settings
+            )
+            handle_use_reply = self.scheduler.submit
+
+        dispatcher.add_handler(CallbackQueryHandler(handle_use_reply))
+        dispatcher.add_handler(CommandHandler('start', handle_use_reply))
+        dispatcher.add_handler(MessageHandler(Filters.text, handle_use_reply))
 
     def start(self):
-        logger.debug('Bot polling started')
-        self.updater.start_polling()
+        """Run the bot until SIGINT or SIGTERM, then stop it."""
+        if self.send_queue is not None:
+            self.send_queue.start()
+        if self.scheduler is not None:
+            self.scheduler.start()
+        if self.webhook_settings is not None:
+            self.start_webhook(**self.webhook_settings)
+        else:
+            logger.debug('Bot polling started')
+            self.updater.start_polling()
+        self.idle()
+        self.stop()
+
+    def idle(self, stop_signals=(signal.SIGINT, signal.SIGTERM)):
+        for stop_signal in stop_signals:
+            signal.signal(stop_signal, self._handle_stop_signal)
+        while self._stop_signal is None:
+            time.sleep(1)
+        logger.info('Received signal {}, stopping'.format(self._stop_signal))
+
+    def stop(self):
+        """
+        Stop receiving updates, handle the received ones
+        and deliver the queued messages.
+        """
+        if self.webhook_server is not None:
+            self.webhook_server.stop()
+        else:
+            self.updater.stop()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        if self.send_queue is not None:
+            self.send_queue.stop()
+        logger.debug('Bot stopped')
+
+    def start_webhook(
+            self, url, listen='0.0.0.0', port=8443, queue_size=1000, workers=4
+    ):
+        server = self.webhook_server = WebhookServer(
+            self.process_update,
+            listen=listen,
+            port=port,
+            url_path=self.token,
+            queue_size=queue_size,
+            workers=workers,
+        )
+        metrics.register_collector(
+            lambda: [('webhook_queue_size', 'gauge', {}, server.update_queue.qsize())]
+        )
+        server.start()
+        self.updater.bot.set_webhook(url='{}/{}'.format(url.rstrip('/'), self.token))
+        logger.debug('Bot webhook started')
+
+    def _handle_stop_signal(self, signum, frame):
+        self._stop_signal = signum
+
+    def process_update(self, data):
+        dispatcher = self.updater.dispatcher
+        dispatcher.process_update(Update.de_json(data, self.updater.bot))
 
 
 def check_callback_query_exists(func):
@@ -55,7 +185,14 @@ def check_callback_query_exists(func):
         query = update.callback_query
         if query is None:
             user_id = update.message.chat_id
-            bot.delete_message(chat_id=user_id, message_id=update.message.message_id)
+            self.deliver(
+                bot,
+                user_id,
+                call_method,
+                'delete_message',
+                user_id,
+                update.message.message_id,
+            )
             user = User(user_id)
             user_state = user.get_state_from_db()
             return user_state
@@ -68,8 +205,10 @@ class BotProcessor:
     CALLBACK_MENU = 'menu'
     CALLBACK_CART = 'cart'
     CALLBACK_START_CHECKOUT = 'begin_checkout'
+    CALLBACK_MENU_PAGE = 'menu_page:'
 
     available_quantity_options = ['1 pc', '2 pcs', '5 pcs']
+    menu_page_size = 10
 
     @staticmethod
     def get_button_cart():
@@ -83,15 +222,83 @@ class BotProcessor:
             'Go to menu', callback_data=BotProcessor.CALLBACK_MENU
         )
 
+    @staticmethod
+    def get_button_menu_page(text, page):
+        return InlineKeyboardButton(
+            text, callback_data='{}{}'.format(BotProcessor.CALLBACK_MENU_PAGE, page)
+        )
+
     @staticmethod
     def get_button_begin_checkout():
         return InlineKeyboardButton(
             'Go to checkout', callback_data=BotProcessor.CALLBACK_START_CHECKOUT
         )
 
-    def __init__(self, moltin_api: MoltinApi, jinja_env: Environment):
+    def __init__(
+            self,
+            moltin_api: MoltinApi,
+            jinja_env: Environment,
+            edit_messages=True,
+            send_queue: SendQueue = None,
+    ):
         self.moltin_api = moltin_api
         self.jinja_env = jinja_env
+        self.edit_messages = edit_messages
+        self.send_queue = send_queue
+        self.keyboards = KeyboardCache()
+        self.photo_file_ids = TelegramFileIdCache()
+        catalog = getattr(moltin_api, 'catalog', None)
+        if catalog is not None:
+            catalog.add_refresh_listener(self.invalidate_keyboards)
+
+    def deliver(self, bot, chat_id, job, *args, **kwargs):
+        """
+        Run job(bot, *args, **kwargs) which talks to Telegram. With a send queue
+        the job is queued and a Future of its result is returned.
+        Pass chat_id of the job positionally, it is the name of an argument here.
+        """
+        if self.send_queue is None:
+            return job(bot, *args, **kwargs)
+        future = self.send_queue.submit(chat_id, job, *args, **kwargs)
+        job_name = args[0] if job is call_method else getattr(job, '__name__', job)
+        future.add_done_callback(partial(log_delivery_failure, chat_id, job_name))
+        return future
+
+    def invalidate_keyboards(self, version):
+        """Drop markups built from the products changed in the catalog."""
+        changes = self.moltin_api.catalog.changes
+        if changes is None:
+            self.keyboards.invalidate(version)
+            return
+
+        page_size = BotProcessor.menu_page_size
+        outdated_products = set(changes.changed + changes.removed)
+        outdated_pages = {index // page_size for index in changes.changed_indexes}
+
+        def is_outdated(key):
+            kind, value = key
+            if kind == 'product':
+                return value in outdated_products
+            if kind == 'menu':
+                # Pages from the first moved product on show other products.
+                return value in outdated_pages or (
+                    changes.moved_from is not None
+                    and (value + 1) * page_size >= changes.moved_from
+                )
+            return True
+
+        self.keyboards.keep_valid(version, is_outdated)
+
+    def get_catalog_version(self):
+        """Version of the cached catalog or None if the catalog is not cached."""
+        catalog = getattr(self.moltin_api, 'catalog', None)
+        return None if catalog is None else catalog.version
+
+    def sync_cart(self, chat_id):
+        """Wait until the changes of a shadowed cart reach Moltin."""
+        sync_cart = getattr(self.moltin_api, 'sync_cart', None)
+        if sync_cart is not None:
+            sync_cart(chat_id)
 
     def handle_use_reply(self, bot, update):
         if update.message:
@@ -120,9 +327,16 @@ class BotProcessor:
         state_handler = states_functions[user_state]
 
         try:
-            next_state = state_handler(bot, update)
+            with metrics.measure('bot_state_handler_seconds', state=user_state):
+                next_state = state_handler(bot, update)
             user.save_state_to_db(next_state)
         except (MoltinApiError, MoltinError, Exception) as e:
+            metrics.increment(
+                'errors_total',
+                source='bot_state_handler',
+                state=user_state,
+                error=type(e).__name__,
+            )
             logger.error('An general exception occurred: {}'.format(str(e)))
 
     def handle_start(self, bot, update):
@@ -136,38 +350,67 @@ class BotProcessor:
 
         return 'HANDLE_MENU'
 
-    @check_callback_query_exists
     def handle_menu(self, bot, update):
+        if update.callback_query is None:
+            return self.handle_search(bot, update)
+
         query = update.callback_query
         chat_id = query.message.chat_id
+        message = query.message
 
-        bot.delete_message(
-            chat_id=query.message.chat_id, message_id=query.message.message_id
-        )
-
-        if query.data == BotProcessor.CALLBACK_CART:
-            self.view_cart(bot, chat_id)
+        if query.data == BotProcessor.CALLBACK_MENU:
+            self.view_menu(bot, chat_id, message=message)
+            return 'HANDLE_MENU'
+        elif query.data == BotProcessor.CALLBACK_CART:
+            self.view_cart(bot, chat_id, message)
             return 'HANDLE_CART'
+        elif query.data.startswith(BotProcessor.CALLBACK_MENU_PAGE):
+            page = int(query.data[len(BotProcessor.CALLBACK_MENU_PAGE):])
+            self.view_menu(bot, chat_id, page=page, message=message)
+            return 'HANDLE_MENU'
 
         product_id = query.data
-        self.view_product(bot, chat_id, product_id)
+        self.view_product(bot, chat_id, product_id, message)
 
         return 'HANDLE_PRODUCT'
 
+    def handle_search(self, bot, update):
+        """Text typed in the menu is a query, found products are shown as a menu."""
+        chat_id = update.message.chat_id
+        self.deliver(
+            bot,
+            chat_id,
+            call_method,
+            'delete_message',
+            chat_id,
+            update.message.message_id,
+        )
+        search_products = getattr(self.moltin_api, 'search_products', None)
+        if search_products is None:
+            return 'HANDLE_MENU'
+
+        search_query = update.message.text
+        products = search_products(search_query, limit=BotProcessor.menu_page_size)
+        if products:
+            text = 'Found for "{}":'.format(search_query)
+        else:
+            text = 'Nothing found for "{}". Make your choice.'.format(search_query)
+        reply_markup = BotProcessor.build_search_markup(products)
+        self.deliver(bot, chat_id, self.render, chat_id, text, reply_markup)
+        return 'HANDLE_MENU'
+
     @check_callback_query_exists
     def handle_product(self, bot, update):
 
         query = update.callback_query
         chat_id = query.message.chat_id
-        message_id = query.message.message_id
-
-        bot.delete_message(chat_id=chat_id, message_id=message_id)
+        message = query.message
 
         if query.data == BotProcessor.CALLBACK_MENU:
-            self.view_menu(bot, chat_id)
+            self.view_menu(bot, chat_id, message=message)
             return 'HANDLE_MENU'
         elif query.data == BotProcessor.CALLBACK_CART:
-            self.view_cart(bot, chat_id)
+            self.view_cart(bot, chat_id, message)
             return 'HANDLE_CART'
 
         product_id = query.data
@@ -185,16 +428,16 @@ class BotProcessor:
                 str(e.title), str(e.detail)
             )
             logger.error(str(e))
-            self.view_menu(bot, chat_id, error_text)
+            self.view_menu(bot, chat_id, error_text, message=message)
             return 'HANDLE_MENU'
         except MoltinError as e:
             error_text = 'An error occurred, please try again later.'
             logger.error(str(e))
-            self.view_menu(bot, chat_id, error_text)
+            self.view_menu(bot, chat_id, error_text, message=message)
             return 'HANDLE_MENU'
 
         text = 'Item has been successfully added to cart. Please, continue:'
-        self.view_menu(bot, chat_id, text)
+        self.view_menu(bot, chat_id, text, message=message)
 
         return 'HANDLE_MENU'
 
@@ -202,20 +445,19 @@ class BotProcessor:
     def handle_cart(self, bot, update):
         query = update.callback_query
         chat_id = query.message.chat_id
-        message_id = query.message.message_id
-
-        bot.delete_message(chat_id=chat_id, message_id=message_id)
+        message = query.message
 
         if query.data == BotProcessor.CALLBACK_MENU:
-            self.view_menu(bot, chat_id)
+            self.view_menu(bot, chat_id, message=message)
             return 'HANDLE_MENU'
         elif query.data == BotProcessor.CALLBACK_START_CHECKOUT:
-            self.view_begin_checkout(bot, chat_id)
+            self.sync_cart(chat_id)
+            self.view_begin_checkout(bot, chat_id, message)
             return 'HANDLE_BEGIN_CHECKOUT'
 
         item_id = query.data
         self.moltin_api.remove_item_from_cart(chat_id, item_id)
-        self.view_cart(bot, chat_id)
+        self.view_cart(bot, chat_id, message)
         return 'HANDLE_CART'
 
     def handle_begin_checkout(self, bot, update):
@@ -239,24 +481,52 @@ class BotProcessor:
                 }
             )
         except (MoltinApiError, MoltinError) as e:
-            update.message.reply_text(
-                'Cannot process request now, please try again later.'
+            self.deliver(
+                bot,
+                chat_id,
+                call_method,
+                'send_message',
+                chat_id,
+                'Cannot process request now, please try again later.',
             )
             logger.error(str(e))
             return 'HANDLE_START'
 
-        update.message.reply_text(
+        self.deliver(
+            bot,
+            chat_id,
+            call_method,
+            'send_message',
+            chat_id,
             'You sent us this number: {}. Our team will contact you soon!'.format(
                 users_reply
-            )
+            ),
         )
 
         return 'HANDLE_START'
 
-    def view_menu(self, bot, chat_id, text=None):
+    def view_menu(self, bot, chat_id, text=None, page=0, message=None):
+        # Version is read before the page, so a markup is never stored
+        # under a version newer than the products it is built from.
+        version = self.get_catalog_version()
+        products, total = self.moltin_api.get_products_page(
+            offset=page * BotProcessor.menu_page_size,
+            limit=BotProcessor.menu_page_size,
+        )
+        reply_markup = self.keyboards.get(
+            ('menu', page),
+            version,
+            lambda: BotProcessor.build_menu_markup(products, total, page),
+        )
+        if text is None:
+            text = 'Make your choice.'
+        self.deliver(
+            bot, chat_id, self.render, chat_id, text, reply_markup, message=message
+        )
 
+    @staticmethod
+    def build_menu_markup(products, total, page):
         keyboard_row_buttons_width = 2
-        products = self.moltin_api.get_products()
         products_chunks = chunks(products, keyboard_row_buttons_width)
 
         products_options = [
@@ -267,21 +537,110 @@ class BotProcessor:
             for product_chunk in products_chunks
         ]
 
-        keyboard = [*products_options, [BotProcessor.get_button_cart()]]
+        pagination_buttons = []
+        if page > 0:
+            pagination_buttons.append(BotProcessor.get_button_menu_page('<', page - 1))
+        if total is not None and (page + 1) * BotProcessor.menu_page_size < total:
+            pagination_buttons.append(BotProcessor.get_button_menu_page('>', page + 1))
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        if text is None:
-            text = 'Make your choice.'
-        bot.send_message(chat_id, text, reply_markup=reply_markup)
+        keyboard = [*products_options]
+        if pagination_buttons:
+            keyboard.append(pagination_buttons)
+        keyboard.append([BotProcessor.get_button_cart()])
+        return InlineKeyboardMarkup(keyboard)
 
-    def view_product(self, bot, chat_id, product_id):
+    @staticmethod
+    def build_search_markup(products):
+        keyboard_row_buttons_width = 2
+        keyboard = [
+            [
+                InlineKeyboardButton(product.name, callback_data=product.id)
+                for product in product_chunk
+            ]
+            for product_chunk in chunks(products, keyboard_row_buttons_width)
+        ]
+        keyboard.append([BotProcessor.get_button_cart(), BotProcessor.get_button_menu()])
+        return InlineKeyboardMarkup(keyboard)
 
+    def view_product(self, bot, chat_id, product_id, message=None):
+        version = self.get_catalog_version()
         product = self.moltin_api.get_product_by_id(product_id)
 
         text = '{}\n{}\n{}'.format(
             product.name, product.formatted_price_with_tax, product.description
         )
+        reply_markup = self.keyboards.get(
+            ('product', product.id),
+            version,
+            lambda: BotProcessor.build_product_markup(product),
+        )
+
+        if product.main_image_id is None:
+            self.deliver(
+                bot, chat_id, self.render, chat_id, text, reply_markup, message=message
+            )
+            return
+        file_id = self.photo_file_ids.get(product.main_image_id)
+        link = None
+        if file_id is None:
+            # Moltin is asked here, the queued job only talks to Telegram.
+            # The file is not fetched together with the product: its id is
+            # known only from the product, which the catalog serves from memory.
+            link = self.moltin_api.get_file_by_id(product.main_image_id).link
+        self.deliver(
+            bot,
+            chat_id,
+            self.send_product_photo,
+            chat_id,
+            product.main_image_id,
+            file_id,
+            link,
+            text,
+            reply_markup,
+            message,
+        )
+
+    def send_product_photo(
+            self,
+            bot,
+            chat_id,
+            main_image_id,
+            file_id,
+            link,
+            caption,
+            reply_markup,
+            message=None,
+    ):
+        """
+        Send the photo by the file_id Telegram assigned to it on the first
+        upload, or by the link of the Moltin file if there is no file_id yet.
+        """
+        if file_id is not None:
+            try:
+                self.render(
+                    bot, chat_id, caption, reply_markup, photo=file_id, message=message
+                )
+                return
+            except BadRequest as e:
+                logger.warning(
+                    'Cached file id of {} is rejected: {}'.format(main_image_id, str(e))
+                )
+                self.photo_file_ids.delete(main_image_id)
+                # Only sending could fail, the previous message is deleted by now.
+                message = None
+            if link is None:
+                # Rare: Telegram has forgotten the file, its link is needed now.
+                link = self.moltin_api.get_file_by_id(main_image_id).link
+
+        sent_message = self.render(
+            bot, chat_id, caption, reply_markup, photo=link, message=message
+        )
+        file_id = get_photo_file_id(sent_message)
+        if file_id is not None:
+            self.photo_file_ids.set(main_image_id, file_id)
 
+    @staticmethod
+    def build_product_markup(product):
         products_quantity_options = [
             InlineKeyboardButton(
                 quantity_option,
@@ -294,20 +653,11 @@ class BotProcessor:
             products_quantity_options,
             [BotProcessor.get_button_cart(), BotProcessor.get_button_menu()],
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        return InlineKeyboardMarkup(keyboard)
 
-        if product.main_image_id is None:
-            bot.send_message(chat_id, text, reply_markup=reply_markup)
-        else:
-            file = self.moltin_api.get_file_by_id(product.main_image_id)
-            bot.send_photo(
-                chat_id, photo=file.link, caption=text, reply_markup=reply_markup
-            )
-
-    def view_cart(self, bot, chat_id):
+    def view_cart(self, bot, chat_id, message=None):
         template = self.jinja_env.get_template('cart_content.jinja2')
-        cart_header = self.moltin_api.get_cart(chat_id)
-        cart_content = self.moltin_api.get_cart_products(chat_id)
+        cart_header, cart_content = self.moltin_api.get_cart_with_items(chat_id)
         output = template.render(
             cart_content=cart_content, total=cart_header.formatted_price_with_tax
         )
@@ -324,13 +674,75 @@ class BotProcessor:
         ]
 
         reply_markup = InlineKeyboardMarkup(keyboard)
-        bot.send_message(chat_id, output, reply_markup=reply_markup)
+        self.deliver(
+            bot, chat_id, self.render, chat_id, output, reply_markup, message=message
+        )
 
-    def view_begin_checkout(self, bot, chat_id):
+    def view_begin_checkout(self, bot, chat_id, message=None):
         text = (
             'Please, provide us your mobile number and we call you back in short time!'
         )
-        bot.send_message(chat_id, text)
+        self.deliver(bot, chat_id, self.render, chat_id, text, message=message)
+
+    def render(self, bot, chat_id, text, reply_markup=None, photo=None, message=None):
+        """
+        Show a text or a photo with caption in place of the previous message.
+        The previous message is edited if its type allows it, otherwise
+        it is deleted and a new message is sent.
+        Return the edited or sent message.
+        """
+        if message is not None and self.edit_messages:
+            try:
+                edited_message = BotProcessor.edit_message(
+                    bot, message, text, reply_markup, photo
+                )
+            except BadRequest as e:
+                if 'not modified' in str(e):
+                    return message
+                # E.g. the message is too old to be edited.
+                logger.debug(
+                    'Cannot edit message {}: {}'.format(message.message_id, str(e))
+                )
+                edited_message = None
+            if edited_message is not None:
+                return edited_message
+
+        if message is not None:
+            bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+        if photo is None:
+            return bot.send_message(chat_id, text, reply_markup=reply_markup)
+        return bot.send_photo(
+            chat_id, photo=photo, caption=text, reply_markup=reply_markup
+        )
+
+    @staticmethod
+    def edit_message(bot, message, text, reply_markup, photo):
+        """
+        Edit the message, return None if a text can not become a photo
+        or the other way round.
+        """
+        has_photo = bool(getattr(message, 'photo', None))
+        if photo is None and not has_photo:
+            if message.text == text:
+                return bot.edit_message_reply_markup(
+                    chat_id=message.chat_id,
+                    message_id=message.message_id,
+                    reply_markup=reply_markup,
+                )
+            return bot.edit_message_text(
+                text,
+                chat_id=message.chat_id,
+                message_id=message.message_id,
+                reply_markup=reply_markup,
+            )
+        if photo is not None and has_photo:
+            return bot.edit_message_media(
+                chat_id=message.chat_id,
+                message_id=message.message_id,
+                media=InputMediaPhoto(photo, caption=text),
+                reply_markup=reply_markup,
+            )
+        return None
 
 
 def serialize_product_presentation(product, quantity_option):
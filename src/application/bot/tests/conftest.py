@@ -0,0 +1,15 @@
+import pytest
+
+
+@pytest.fixture
+def stopped_after_test():
+    """Register a started service, its stop() is called when the test ends."""
+    services = []
+
+    def register(service):
+        services.append(service)
+        return service
+
+    yield register
+    for service in services:
+        service.stop()
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+import redis
+
+from application.bot.file_ids import TelegramFileIdCache, get_photo_file_id
+from application.database import RedisStorage
+
+
+@pytest.fixture
+def file_ids(monkeypatch):
+    monkeypatch.setattr(RedisStorage, 'connection', fakeredis.FakeRedis())
+    return TelegramFileIdCache()
+
+
+def test_file_id_stored_persistently(file_ids):
+    assert file_ids.get('moltin file id') is None
+
+    file_ids.set('moltin file id', 'telegram file id')
+    assert TelegramFileIdCache().get('moltin file id') == 'telegram file id'
+
+    file_ids.delete('moltin file id')
+    assert file_ids.get('moltin file id') is None
+
+
+def test_redis_error_treated_as_miss(file_ids, mocker):
+    mocker.patch.object(RedisStorage, 'get', side_effect=redis.ConnectionError())
+    mocker.patch.object(RedisStorage, 'set', side_effect=redis.ConnectionError())
+
+    file_ids.set('moltin file id', 'telegram file id')
+    assert file_ids.get('moltin file id') is None
+
+
+def test_largest_photo_file_id():
+    message = SimpleNamespace(
+        photo=[SimpleNamespace(file_id='small'), SimpleNamespace(file_id='large')]
+    )
+    assert get_photo_file_id(message) == 'large'
+    assert get_photo_file_id(SimpleNamespace(photo=[])) is None
+    assert get_photo_file_id(SimpleNamespace()) is None
@@ -0,0 +1,68 @@
+from application.bot.keyboards import KeyboardCache
+
+
+class CountingBuilder:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return 'markup {}'.format(self.calls)
+
+
+def test_markup_built_once_per_version():
+    keyboards = KeyboardCache()
+    build = CountingBuilder()
+
+    assert keyboards.get(('menu', 0), 1, build) == 'markup 1'
+    assert keyboards.get(('menu', 0), 1, build) == 'markup 1'
+    assert build.calls == 1
+
+    assert keyboards.get(('menu', 0), 2, build) == 'markup 2'
+    assert keyboards.get(('menu', 0), 2, build) == 'markup 2'
+    assert build.calls == 2
+
+
+def test_markup_of_older_version_not_stored():
+    keyboards = KeyboardCache()
+    build = CountingBuilder()
+    keyboards.get(('menu', 0), 2, build)
+
+    assert keyboards.get(('menu', 1), 1, build) == 'markup 2'
+    assert keyboards.get(('menu', 1), 2, build) == 'markup 3'
+    assert keyboards.get(('menu', 0), 2, build) == 'markup 1'
+
+
+def test_markup_not_cached_without_version():
+    keyboards = KeyboardCache()
+    build = CountingBuilder()
+
+    keyboards.get(('menu', 0), None, build)
+    keyboards.get(('menu', 0), None, build)
+    assert build.calls == 2
+
+
+def test_invalidate_on_catalog_refresh():
+    keyboards = KeyboardCache()
+    build = CountingBuilder()
+    keyboards.get(('product', 'id'), 1, build)
+
+    keyboards.invalidate(2)
+    assert keyboards.get(('product', 'id'), 1, build) == 'markup 2'
+    assert keyboards.get(('product', 'id'), 2, build) == 'markup 3'
+    assert build.calls == 3
+
+
+def test_unchanged_markups_kept_for_next_version():
+    keyboards = KeyboardCache()
+    build = CountingBuilder()
+    keyboards.get(('product', 'changed'), 1, build)
+    keyboards.get(('product', 'kept'), 1, build)
+
+    keyboards.keep_valid(2, lambda key: key == ('product', 'changed'))
+
+    assert keyboards.get(('product', 'kept'), 2, build) == 'markup 2'
+    assert keyboards.get(('product', 'changed'), 2, build) == 'markup 3'
+
+    keyboards.keep_valid(4, lambda key: False)
+    assert keyboards.get(('product', 'kept'), 4, build) == 'markup 4'
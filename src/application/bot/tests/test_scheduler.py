@@ -0,0 +1,103 @@
+from types import SimpleNamespace
+import threading
+import time
+
+import pytest
+
+from application.bot.scheduler import ChatScheduler
+
+
+def make_callback_update(chat_id, data):
+    message = SimpleNamespace(chat_id=chat_id)
+    callback_query = SimpleNamespace(data=data, message=message)
+    return SimpleNamespace(callback_query=callback_query, message=None)
+
+
+class RecordingHandler:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.handled = []
+        self.lock = threading.Lock()
+
+    def __call__(self, bot, update):
+        time.sleep(self.delay)
+        with self.lock:
+            self.handled.append(
+                (update.callback_query.message.chat_id, update.callback_query.data)
+            )
+
+
+@pytest.fixture
+def scheduler_factory(stopped_after_test):
+    def create(handler, **kwargs):
+        return stopped_after_test(ChatScheduler(handler, **kwargs))
+
+    return create
+
+
+def test_updates_of_one_chat_handled_in_order(scheduler_factory):
+    handler = RecordingHandler()
+    scheduler = scheduler_factory(handler, shards=4, merge_duplicate_callbacks=False)
+    scheduler.start()
+
+    for number in range(20):
+        for chat_id in range(5):
+            scheduler.submit(None, make_callback_update(chat_id, str(number)))
+    scheduler.stop()
+
+    for chat_id in range(5):
+        chat_updates = [data for handled_chat_id, data in handler.handled
+                        if handled_chat_id == chat_id]
+        assert chat_updates == [str(number) for number in range(20)]
+
+
+def test_different_chats_handled_in_parallel(scheduler_factory):
+    handler = RecordingHandler(delay=0.1)
+    scheduler = scheduler_factory(handler, shards=4)
+    chat_ids = [
+        chat_id for chat_id in range(100)
+        if scheduler.get_shard(chat_id).number == chat_id % 4
+    ][:4]
+    scheduler.start()
+
+    started_at = time.monotonic()
+    for chat_id in chat_ids:
+        scheduler.submit(None, make_callback_update(chat_id, 'menu'))
+    scheduler.stop()
+
+    assert len(handler.handled) == 4
+    assert time.monotonic() - started_at < 0.3
+
+
+def test_duplicate_callback_merged(scheduler_factory):
+    handler = RecordingHandler()
+    scheduler = scheduler_factory(handler, shards=1)
+
+    assert scheduler.submit(None, make_callback_update(1, 'add'))
+    assert not scheduler.submit(None, make_callback_update(1, 'add'))
+    assert scheduler.submit(None, make_callback_update(2, 'add'))
+    assert scheduler.submit(None, make_callback_update(1, 'cart'))
+
+    scheduler.start()
+    scheduler.stop()
+    assert handler.handled == [(1, 'add'), (2, 'add'), (1, 'cart')]
+
+
+@pytest.mark.parametrize(
+    'overflow_policy, expected',
+    [
+        (ChatScheduler.POLICY_DROP_NEWEST, ['0', '1']),
+        (ChatScheduler.POLICY_DROP_OLDEST, ['1', '2']),
+    ],
+)
+def test_full_shard_queue_drops_updates(scheduler_factory, overflow_policy, expected):
+    handler = RecordingHandler()
+    scheduler = scheduler_factory(
+        handler, shards=1, shard_queue_size=2, overflow_policy=overflow_policy
+    )
+    for number in range(3):
+        scheduler.submit(None, make_callback_update(1, str(number)))
+
+    scheduler.start()
+    scheduler.stop()
+    assert [data for chat_id, data in handler.handled] == expected
@@ -0,0 +1,144 @@
+import threading
+
+import pytest
+
+from application.benchmark.fake_telegram import StubBot
+from application.bot.send_queue import SendQueue, SendQueueFull, call_method
+
+
+class RetryAfter(Exception):
+    """Mimics telegram.error.RetryAfter."""
+
+    def __init__(self, retry_after):
+        super(RetryAfter, self).__init__('Flood control exceeded')
+        self.retry_after = retry_after
+
+
+class FloodedBot(StubBot):
+    def __init__(self, floods: int, retry_after: float):
+        super(FloodedBot, self).__init__()
+        self.floods = floods
+        self.retry_after = retry_after
+
+    def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        if self.floods:
+            self.floods -= 1
+            raise RetryAfter(self.retry_after)
+        return super(FloodedBot, self).send_message(chat_id, text, reply_markup)
+
+
+@pytest.fixture
+def queue_factory(stopped_after_test):
+    def create(bot, **kwargs):
+        queue = SendQueue(bot, **kwargs)
+        queue.start()
+        return stopped_after_test(queue)
+
+    return create
+
+
+def test_jobs_of_one_chat_delivered_in_order(queue_factory):
+    bot = StubBot()
+    queue = queue_factory(bot, workers=4, global_rate=1000, chat_rate=1000)
+
+    futures = [
+        queue.submit(chat_id, call_method, 'send_message', chat_id, str(number))
+        for number in range(10)
+        for chat_id in range(3)
+    ]
+    queue.stop()
+
+    assert all(future.result(timeout=1).chat_id is not None for future in futures)
+    for chat_id in range(3):
+        texts = [kwargs['text'] for method, call_chat_id, kwargs in bot.get_calls()
+                 if call_chat_id == chat_id]
+        assert texts == [str(number) for number in range(10)]
+
+
+def test_chat_rate_does_not_delay_other_chats(queue_factory, clock):
+    bot = StubBot()
+    queue = queue_factory(
+        bot, workers=2, global_rate=1000, chat_rate=10, chat_burst=1,
+        clock=clock, sleep=clock.sleep,
+    )
+
+    slow_chat = [
+        queue.submit(1, call_method, 'send_message', 1, str(number))
+        for number in range(3)
+    ]
+    other_chat = queue.submit(2, call_method, 'send_message', 2, 'hello')
+
+    other_chat.result(timeout=1)
+    slow_chat[0].result(timeout=1)
+    # The next jobs wait for the chat bucket to refill, 0.1s per job.
+    for job in slow_chat[1:]:
+        assert not job.done()
+        clock.now += 0.1
+        job.result(timeout=1)
+
+
+def test_every_call_of_job_takes_chat_token(queue_factory, clock):
+    bot = StubBot()
+    queue = queue_factory(
+        bot, workers=1, global_rate=1000, chat_rate=10, chat_burst=1,
+        clock=clock, sleep=clock.sleep,
+    )
+
+    def delete_and_send(bot):
+        bot.delete_message(1, 10)
+        bot.send_message(1, 'hello')
+
+    started_at = clock()
+    queue.submit(1, delete_and_send).result(timeout=1)
+
+    assert bot.count_calls() == {'delete_message': 1, 'send_message': 1}
+    # The second call has waited for the chat bucket to refill.
+    assert clock() - started_at >= 0.1
+
+
+def test_retry_after_flood_control(queue_factory, clock):
+    bot = FloodedBot(floods=2, retry_after=5)
+    queue = queue_factory(bot, workers=1, max_retries=3, clock=clock, sleep=clock.sleep)
+
+    started_at = clock()
+    message = queue.submit(1, call_method, 'send_message', 1, 'hello').result(timeout=1)
+
+    assert message.chat_id == 1
+    assert clock() - started_at >= 10
+    assert bot.count_calls() == {'send_message': 1}
+
+
+def test_failed_job_sets_exception(queue_factory):
+    bot = FloodedBot(floods=5, retry_after=0.0)
+    queue = queue_factory(bot, workers=1, max_retries=1)
+
+    future = queue.submit(1, call_method, 'send_message', 1, 'hello')
+
+    with pytest.raises(RetryAfter):
+        future.result(timeout=1)
+    assert bot.floods == 3
+
+
+def test_full_queue_rejects_jobs():
+    queue = SendQueue(StubBot(), max_size=2)
+
+    for _ in range(2):
+        queue.submit(1, call_method, 'send_message', 1, 'hello')
+    future = queue.submit(2, call_method, 'send_message', 2, 'hello')
+
+    with pytest.raises(SendQueueFull):
+        future.result(timeout=0)
+    assert queue.collect_metrics()[0] == ('telegram_send_queue_size', 'gauge', {}, 2)
+
+
+def test_stop_gives_up_after_timeout(queue_factory):
+    released = threading.Event()
+    queue = queue_factory(StubBot(), workers=1, stop_timeout=0.05)
+    first = queue.submit(1, lambda bot: released.wait(1))
+    second = queue.submit(2, lambda bot: None)
+
+    queue.stop()
+
+    assert not second.done()
+    released.set()
+    assert first.result(timeout=1)
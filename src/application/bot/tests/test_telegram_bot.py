@@ -0,0 +1,236 @@
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+try:
+    from telegram.error import BadRequest
+except ImportError:
+    # python-telegram-bot 11 imports collections.Mapping, removed in Python 3.10.
+    pytest.skip('python-telegram-bot cannot be imported', allow_module_level=True)
+
+from application.benchmark.fake_telegram import (  # noqa: E402
+    StubBot,
+    make_message_update,
+)
+from application.bot.send_queue import SendQueue  # noqa: E402
+from application.bot.telegram_bot import BotProcessor  # noqa: E402
+from application.database import RedisStorage  # noqa: E402
+from application.models import File, Product, User  # noqa: E402
+
+
+class RejectingBot(StubBot):
+    """Rejects edits of messages like Telegram does."""
+
+    def __init__(self, error: str):
+        super(RejectingBot, self).__init__()
+        self.error = error
+
+    def edit_message_text(self, text, **kwargs):
+        raise BadRequest(self.error)
+
+
+class StaleFileIdBot(StubBot):
+    """Rejects file ids which are not uploaded by this bot."""
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        if photo == 'stale file id':
+            raise BadRequest('Wrong file identifier/http url specified')
+        return super(StaleFileIdBot, self).send_photo(chat_id, photo, **kwargs)
+
+
+def make_sent_message(text=None, photo=None, message_id=10):
+    return SimpleNamespace(
+        chat_id=1,
+        message_id=message_id,
+        text=text,
+        photo=[SimpleNamespace(file_id=photo)] if photo else None,
+    )
+
+
+@pytest.fixture
+def processor():
+    return BotProcessor(None, None)
+
+
+@pytest.fixture
+def moltin_api(mocker, monkeypatch):
+    monkeypatch.setattr(RedisStorage, 'connection', fakeredis.FakeRedis())
+    moltin_api = mocker.Mock(spec=['get_product_by_id', 'get_file_by_id'])
+    moltin_api.get_product_by_id.return_value = Product(
+        id='product-1',
+        type='product',
+        name='Product 1',
+        description='description',
+        slug='product-1',
+        sku='sku-1',
+        formatted_price_with_tax='$1.00',
+        main_image_id='file-1',
+    )
+    moltin_api.get_file_by_id.return_value = File(
+        type='file',
+        id='file-1',
+        link='https://files.example.com/1.png',
+        file_name='1.png',
+    )
+    return moltin_api
+
+
+def test_text_edited_in_place(processor):
+    bot = StubBot()
+    message = make_sent_message(text='Menu')
+
+    processor.render(bot, 1, 'Cart', 'markup', message=message)
+
+    assert bot.get_calls() == [(
+        'edit_message_text',
+        1,
+        {'message_id': 10, 'text': 'Cart', 'reply_markup': 'markup'},
+    )]
+
+
+def test_same_text_edits_only_markup(processor):
+    bot = StubBot()
+    message = make_sent_message(text='Menu')
+
+    processor.render(bot, 1, 'Menu', 'page 2', message=message)
+
+    assert bot.count_calls() == {'edit_message_reply_markup': 1}
+
+
+def test_photo_edited_in_place(processor):
+    bot = StubBot()
+    message = make_sent_message(text=None, photo='old file id')
+
+    edited_message = processor.render(
+        bot, 1, 'Product', 'markup', photo='new file id', message=message
+    )
+
+    assert bot.count_calls() == {'edit_message_media': 1}
+    assert edited_message.photo[-1].file_id == 'new file id'
+
+
+@pytest.mark.parametrize('text, photo, new_photo, sent_method', [
+    ('Menu', None, 'file id', 'send_photo'),
+    (None, 'file id', None, 'send_message'),
+])
+def test_text_and_photo_replaced_by_new_message(
+        processor, text, photo, new_photo, sent_method
+):
+    bot = StubBot()
+    message = make_sent_message(text=text, photo=photo)
+
+    processor.render(bot, 1, 'Product', 'markup', photo=new_photo, message=message)
+
+    assert [call[0] for call in bot.get_calls()] == ['delete_message', sent_method]
+    assert bot.get_calls()[0][2] == {'message_id': 10}
+
+
+def test_rejected_edit_replaced_by_new_message(processor):
+    bot = RejectingBot("Message can't be edited")
+    message = make_sent_message(text='Menu')
+
+    processor.render(bot, 1, 'Cart', 'markup', message=message)
+
+    assert [call[0] for call in bot.get_calls()] == ['delete_message', 'send_message']
+
+
+def test_not_modified_message_kept(processor):
+    bot = RejectingBot('Message is not modified')
+    message = make_sent_message(text='Menu')
+
+    assert processor.render(bot, 1, 'Cart', 'markup', message=message) is message
+    assert bot.get_calls() == []
+
+
+def test_new_message_sent_without_editing(processor):
+    bot = StubBot()
+    processor.edit_messages = False
+
+    processor.render(bot, 1, 'Cart', 'markup', message=make_sent_message(text='Menu'))
+
+    assert [call[0] for call in bot.get_calls()] == ['delete_message', 'send_message']
+
+
+def test_photo_sent_by_stored_file_id(moltin_api):
+    processor = BotProcessor(moltin_api, None)
+    bot = StubBot()
+
+    processor.view_product(bot, 1, 'product-1')
+    processor.view_product(bot, 1, 'product-1')
+
+    assert [call[2]['photo'] for call in bot.get_calls('send_photo')] == [
+        'https://files.example.com/1.png',
+        'uploaded:https://files.example.com/1.png',
+    ]
+    assert moltin_api.get_file_by_id.call_count == 1
+
+
+def test_rejected_file_id_uploaded_again(moltin_api):
+    processor = BotProcessor(moltin_api, None)
+    processor.photo_file_ids.set('file-1', 'stale file id')
+    bot = StaleFileIdBot()
+
+    processor.view_product(bot, 1, 'product-1')
+
+    moltin_api.get_file_by_id.assert_called_once_with('file-1')
+    assert [call[2]['photo'] for call in bot.get_calls('send_photo')] == [
+        'https://files.example.com/1.png'
+    ]
+    assert processor.photo_file_ids.get('file-1') == (
+        'uploaded:https://files.example.com/1.png'
+    )
+
+
+def test_photo_link_resolved_before_job_is_queued(moltin_api):
+    bot = StubBot()
+    send_queue = SendQueue(bot)
+    processor = BotProcessor(moltin_api, None, send_queue=send_queue)
+
+    processor.view_product(bot, 1, 'product-1')
+
+    # The job waits for the send queue, Moltin has been asked by the handler.
+    assert send_queue.size == 1
+    moltin_api.get_file_by_id.assert_called_once_with('file-1')
+    send_queue.start()
+    send_queue.stop()
+    assert bot.get_calls('send_photo')[0][2]['photo'] == (
+        'https://files.example.com/1.png'
+    )
+
+
+def test_typed_text_deleted_through_send_queue(monkeypatch):
+    monkeypatch.setattr(RedisStorage, 'connection', fakeredis.FakeRedis())
+    User(1).save_state_to_db('HANDLE_MENU')
+    bot = StubBot()
+    send_queue = SendQueue(bot)
+    processor = BotProcessor(None, None, send_queue=send_queue)
+    send_queue.start()
+
+    state = processor.handle_menu(bot, make_message_update(bot, 1, 'random text'))
+    send_queue.stop()
+
+    assert state == 'HANDLE_MENU'
+    assert bot.get_calls('delete_message') == [('delete_message', 1, {'message_id': 0})]
+
+
+@pytest.mark.parametrize('query, text, buttons', [
+    ('product', 'Found for "product":', [['Product 1']]),
+    ('coffee', 'Nothing found for "coffee". Make your choice.', []),
+])
+def test_typed_text_searched_in_menu(moltin_api, query, text, buttons):
+    product = moltin_api.get_product_by_id.return_value
+    moltin_api.search_products = lambda query, limit: (
+        [product] if query == 'product' else []
+    )
+    processor = BotProcessor(moltin_api, None)
+    bot = StubBot()
+
+    state = processor.handle_menu(bot, make_message_update(bot, 1, query))
+
+    assert state == 'HANDLE_MENU'
+    assert [call[0] for call in bot.get_calls()] == ['delete_message', 'send_message']
+    sent_message = bot.get_calls('send_message')[0][2]
+    assert sent_message['text'] == text
+    keyboard = sent_message['reply_markup'].inline_keyboard
+    assert [[button.text for button in row] for row in keyboard[:-1]] == buttons
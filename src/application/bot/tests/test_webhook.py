@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+from application.bot.webhook import WebhookServer
+from application.bot.loadgen import make_updates, replay
+
+
+@pytest.fixture
+def webhook_server(stopped_after_test):
+    def create(process_update, **kwargs):
+        server = WebhookServer(
+            process_update, listen='127.0.0.1', port=0, url_path='token', **kwargs
+        )
+        server.start()
+        return stopped_after_test(server)
+
+    return create
+
+
+def test_updates_processed_by_workers(webhook_server):
+    processed = []
+    lock = threading.Lock()
+
+    def process_update(data):
+        with lock:
+            processed.append(data['update_id'])
+
+    server = webhook_server(process_update)
+    updates = make_updates(50, chats=5, callbacks=['menu'])
+    report = replay('http://127.0.0.1:{}/token'.format(server.port), updates)
+    server.stop()
+
+    assert report['accepted'] == 50
+    assert sorted(processed) == sorted(update['update_id'] for update in updates)
+
+
+def test_full_queue_rejects_updates(webhook_server):
+    release = threading.Event()
+    server = webhook_server(lambda data: release.wait(), queue_size=1, workers=1)
+
+    updates = make_updates(10, chats=5, callbacks=['menu'])
+    report = replay(
+        'http://127.0.0.1:{}/token'.format(server.port), updates, concurrency=1
+    )
+    release.set()
+
+    assert report['accepted'] == 2
+    assert report['rejected'] == 8
+
+
+def test_unknown_path_is_not_found(webhook_server):
+    server = webhook_server(lambda data: None)
+    updates = make_updates(1, chats=1, callbacks=['menu'])
+    report = replay('http://127.0.0.1:{}/other'.format(server.port), updates)
+
+    assert report['failed'] == 1
@@ -0,0 +1,123 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict
+import logging
+import queue
+import threading
+
+from application import fastjson
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    # Keep connections alive, Telegram reuses them for subsequent updates.
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        webhook = self.server.webhook
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length)
+
+        if self.path != webhook.url_path:
+            self._send_response(404)
+            return
+
+        if webhook.enqueue(body):
+            self._send_response(200)
+        else:
+            # Telegram delivers the update again later, so a full queue
+            # slows down ingestion instead of dropping updates.
+            self._send_response(503, {'Retry-After': str(webhook.retry_after)})
+
+    def _send_response(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug('Webhook request from {}: {}'.format(
+            self.address_string(), format % args
+        ))
+
+
+class WebhookServer:
+    """
+    Lightweight HTTP server which receives updates pushed by Telegram.
+    Updates are put into a bounded queue and processed by a fixed
+    number of worker threads. When the queue is full the server responds
+    with 503, so Telegram backs off and retries.
+    """
+
+    def __init__(
+            self,
+            process_update: Callable[[Dict], None],
+            listen: str = '0.0.0.0',
+            port: int = 8443,
+            url_path: str = '/',
+            queue_size: int = 1000,
+            workers: int = 4,
+            retry_after: int = 1,
+    ):
+        self.process_update = process_update
+        self.url_path = '/{}'.format(url_path.lstrip('/'))
+        self.workers = workers
+        self.retry_after = retry_after
+        self.update_queue = queue.Queue(maxsize=queue_size)
+        self.httpd = ThreadingHTTPServer((listen, port), WebhookRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.webhook = self
+        self._threads = []
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def enqueue(self, body: bytes) -> bool:
+        try:
+            self.update_queue.put_nowait(body)
+        except queue.Full:
+            logger.warning('Update queue is full, update rejected')
+            return False
+        return True
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(
+                target=self._process_updates,
+                name='webhook-worker-{}'.format(number),
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+        thread = threading.Thread(
+            target=self.httpd.serve_forever, name='webhook-server', daemon=True
+        )
+        thread.start()
+        self._threads.append(thread)
+        logger.debug('Webhook server started on port {}'.format(self.port))
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for _ in range(self.workers):
+            self.update_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _process_updates(self):
+        while True:
+            body = self.update_queue.get()
+            if body is None:
+                return
+            try:
+                self.process_update(fastjson.loads(body))
+            except Exception as e:
+                logger.error('Cannot process update: {}'.format(str(e)))
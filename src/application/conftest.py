@@ -0,0 +1,19 @@
+import pytest
+
+
+class FakeClock:
+    """Monotonic clock moved by tests, sleep() advances it instantly."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
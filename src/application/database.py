@@ -1,31 +1,282 @@
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 import logging
+import threading
+import time
 
 import redis
 
+from application.metrics import registry as metrics
+
 logger = logging.getLogger(__name__)
 
 
+def decode_value(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+
+class RedisPipelineBatcher:
+    """
+    Collects reads and writes issued by concurrent threads
+    and sends them to Redis with one pipeline per tick.
+    Writes are not waited for: set returns a Future which is resolved when
+    the write reaches Redis, a failed write is retried in the next ticks up to
+    max_retries times unless the key has been written again meanwhile.
+    Reads block until the pipeline is executed, at most timeout seconds.
+    Reads of keys with pending writes are served locally.
+    Deletes wait for the running pipeline, so a write sent before
+    the delete never lands after it. Writes still pending when the batcher
+    is stopped are dropped with an error.
+    """
+
+    def __init__(
+            self,
+            connection: redis.Redis,
+            interval: float = 0.005,
+            timeout: float = 5.0,
+            max_retries: int = 3,
+    ):
+        self.connection = connection
+        self.interval = interval
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        # Held while a pipeline is sent to Redis.
+        self._execute_lock = threading.Lock()
+        # Key: (value, ex, futures of the writes, failed attempts).
+        self._pending_writes = OrderedDict()
+        self._pending_reads = {}
+        self._has_work = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name='redis-pipeline', daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._has_work.set()
+        self._thread.join()
+        self._drop_pending()
+
+    def set(self, key, value, ex=None) -> Future:
+        future = Future()
+        with self._lock:
+            pending_write = self._pending_writes.get(key)
+            futures = [] if pending_write is None else pending_write[2]
+            futures.append(future)
+            self._pending_writes[key] = (value, ex, futures, 0)
+        self._has_work.set()
+        return future
+
+    def discard(self, *keys):
+        with self._lock:
+            discarded_writes = [
+                self._pending_writes.pop(key) for key in keys
+                if key in self._pending_writes
+            ]
+        for value, ex, futures, attempts in discarded_writes:
+            for future in futures:
+                future.set_result(False)
+
+    def delete(self, *keys):
+        with self._execute_lock:
+            # Pending and retried writes of the keys are not sent any more.
+            self.discard(*keys)
+            return self.connection.delete(*keys)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._pending_writes:
+                value = self._pending_writes[key][0]
+                return decode_value(value)
+            future = self._pending_reads.get(key)
+            if future is None:
+                future = self._pending_reads[key] = Future()
+        self._has_work.set()
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise redis.TimeoutError(
+                'Redis pipeline has not read {} in {}s'.format(key, self.timeout)
+            )
+
+    def _run(self):
+        while not self._stopped:
+            self._has_work.wait()
+            # Give concurrent threads a moment to join the same pipeline.
+            time.sleep(self.interval)
+            self._has_work.clear()
+            self._execute_safely()
+        self._execute_safely()
+
+    def _execute_safely(self):
+        # The thread must survive any error, reads would wait for it in vain.
+        try:
+            self.execute()
+        except Exception as e:
+            logger.exception('Redis pipeline tick failed: {}'.format(str(e)))
+
+    def execute(self):
+        with self._execute_lock:
+            self._execute()
+
+    def _execute(self):
+        with self._lock:
+            writes, self._pending_writes = self._pending_writes, OrderedDict()
+            reads, self._pending_reads = self._pending_reads, {}
+        if not writes and not reads:
+            return
+
+        try:
+            pipeline = self.connection.pipeline(transaction=False)
+            for key, (value, ex, futures, attempts) in writes.items():
+                pipeline.set(key, value, ex=ex)
+            read_keys = list(reads.keys())
+            for key in read_keys:
+                pipeline.get(key)
+            results = pipeline.execute()
+        except Exception as e:
+            for future in reads.values():
+                future.set_exception(e)
+            self._retry_writes(writes, e)
+            return
+
+        for value, ex, futures, attempts in writes.values():
+            for future in futures:
+                future.set_result(True)
+        for key, value in zip(read_keys, results[len(writes):]):
+            reads[key].set_result(decode_value(value))
+
+    def _retry_writes(self, writes: OrderedDict, error: Exception):
+        lost_futures = []
+        with self._lock:
+            for key, (value, ex, futures, attempts) in writes.items():
+                newer_write = self._pending_writes.get(key)
+                if newer_write is not None:
+                    # The newer value is written instead.
+                    newer_write[2].extend(futures)
+                elif attempts < self.max_retries:
+                    self._pending_writes[key] = (value, ex, futures, attempts + 1)
+                else:
+                    logger.error(
+                        'Redis write of {} lost after {} attempts: {}'.format(
+                            key, attempts + 1, str(error)
+                        )
+                    )
+                    lost_futures.extend(futures)
+            retried = bool(self._pending_writes)
+        logger.error('Redis pipeline failed: {}'.format(str(error)))
+        for future in lost_futures:
+            future.set_exception(error)
+        if retried:
+            self._has_work.set()
+
+    def _drop_pending(self):
+        with self._lock:
+            writes, self._pending_writes = self._pending_writes, OrderedDict()
+            reads, self._pending_reads = self._pending_reads, {}
+        if not writes and not reads:
+            return
+        error = redis.ConnectionError('Redis pipeline is stopped')
+        logger.error(
+            'Redis pipeline stopped, writes of {} dropped'.format(', '.join(writes))
+        )
+        for value, ex, futures, attempts in writes.values():
+            for future in futures:
+                future.set_exception(error)
+        for future in reads.values():
+            future.set_exception(error)
+
+
 class RedisStorage:
     connection = None
+    batcher = None
 
     @staticmethod
-    def initialize(host=None, port=None, url=None):
+    def initialize(
+            host=None, port=None, url=None, max_connections=None, pipeline_interval=None
+    ):
         logger.debug(
-            'Redis instance initialization started, host: {}, port: {}, url: {}'.format(
-                host, port, url
+            'Redis instance initialization started, host: {}, port: {}, url: {}, '
+            'max connections: {}, pipeline interval: {}'.format(
+                host, port, url, max_connections, pipeline_interval
             )
         )
         if url:
-            RedisStorage.connection = redis.Redis.from_url(url)
+            connection_pool = redis.ConnectionPool.from_url(
+                url, max_connections=max_connections
+            )
         else:
-            RedisStorage.connection = redis.Redis(host, port)
+            connection_pool = redis.ConnectionPool(
+                host=host, port=port, max_connections=max_connections
+            )
+        RedisStorage.connection = redis.Redis(connection_pool=connection_pool)
+
+        if pipeline_interval:
+            RedisStorage.batcher = RedisPipelineBatcher(
+                RedisStorage.connection, pipeline_interval
+            )
+            RedisStorage.batcher.start()
+
+    @staticmethod
+    def close():
+        """Write pending values of the pipeline batcher and stop it."""
+        if RedisStorage.batcher is not None:
+            RedisStorage.batcher.stop()
+            RedisStorage.batcher = None
 
     @staticmethod
-    def set(key, value):
-        return RedisStorage.connection.set(key, value)
+    @metrics.timed('redis_operation_seconds')
+    def set(key, value, ex=None):
+        """With the pipeline batcher returns a Future of the write."""
+        if RedisStorage.batcher is not None:
+            return RedisStorage.batcher.set(key, value, ex=ex)
+        return RedisStorage.connection.set(key, value, ex=ex)
 
     @staticmethod
+    @metrics.timed('redis_operation_seconds')
     def get(key):
+        if RedisStorage.batcher is not None:
+            return RedisStorage.batcher.get(key)
         value = RedisStorage.connection.get(key)
         value = value if value is None else value.decode()
         return value
+
+    @staticmethod
+    @metrics.timed('redis_operation_seconds')
+    def get_many(keys):
+        pipeline = RedisStorage.connection.pipeline(transaction=False)
+        for key in keys:
+            pipeline.get(key)
+        return [decode_value(value) for value in pipeline.execute()]
+
+    @staticmethod
+    @metrics.timed('redis_operation_seconds')
+    def set_many(mapping, ex=None):
+        pipeline = RedisStorage.connection.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipeline.set(key, value, ex=ex)
+        return pipeline.execute()
+
+    @staticmethod
+    @metrics.timed('redis_operation_seconds')
+    def publish(channel, message):
+        return RedisStorage.connection.publish(channel, message)
+
+    @staticmethod
+    def pubsub():
+        return RedisStorage.connection.pubsub(ignore_subscribe_messages=True)
+
+    @staticmethod
+    @metrics.timed('redis_operation_seconds')
+    def delete(*keys):
+        if RedisStorage.batcher is not None:
+            return RedisStorage.batcher.delete(*keys)
+        return RedisStorage.connection.delete(*keys)
@@ -0,0 +1,258 @@
+from typing import List, Dict, Tuple
+import asyncio
+import time
+import logging
+from json import JSONDecodeError
+
+import aiohttp
+
+from application import fastjson
+from application.models import (
+    Product,
+    NewProductInCart,
+    File,
+    CartHeader,
+    CartContentProduct,
+)
+from application.ecommerce_api.moltin_api.exceptions import (
+    MoltinApiError,
+    MoltinUnexpectedFormatResponseError,
+    MoltinUnavailable,
+)
+from application.ecommerce_api.moltin_api.moltin import (
+    MoltinApi,
+    MoltinApiSession,
+    log_response,
+)
+from application.ecommerce_api.moltin_api.parse import (
+    parse_products_list_response,
+    parse_product_response,
+    parse_file_response,
+    parse_add_product_to_cart_response,
+    parse_cart_header_response,
+    parse_cart_content_response,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMoltinApiSession:
+    """
+    Asyncio counterpart of MoltinApiSession.
+    All requests share one aiohttp session with a bounded pool of
+    keep-alive connections, pool_size limits the number of requests in flight.
+    """
+
+    oauth_url = MoltinApiSession.oauth_url
+    access_token_expiration_skew = 10
+
+    def __init__(
+            self,
+            root_url: str,
+            client_id: str,
+            client_secret: str,
+            pool_size: int = 100,
+            keepalive_timeout: float = 30,
+            timeout: float = 30,
+    ):
+        self.root_url = root_url.rstrip('/')
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.access_token = None
+        self.access_token_expires_in = None
+        self._session = None
+        self._access_token_lock = None
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return 'client id: {}, access_token_expires_in: {}, pool size: {}'.format(
+            self.client_id, self.access_token_expires_in, self.pool_size
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get(self, url, **kwargs):
+        return await self._make_request('get', url, **kwargs)
+
+    async def post(self, url, data=None, json=None, **kwargs):
+        return await self._make_request('post', url, data=data, json=json, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self._make_request('delete', url, **kwargs)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # aiohttp binds the session to the running loop,
+        # so it can be created only from a coroutine.
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size, keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def _access_token_expired(self) -> bool:
+        return (
+            self.access_token is None
+            or self.access_token_expires_in is None
+            or self.access_token_expires_in - self.access_token_expiration_skew
+            < time.time()
+        )
+
+    async def _ensure_access_token(self):
+        if not self._access_token_expired():
+            return
+        if self._access_token_lock is None:
+            self._access_token_lock = asyncio.Lock()
+        async with self._access_token_lock:
+            # Only the first coroutine refreshes the token, the rest reuse it.
+            if self._access_token_expired():
+                await self._update_access_token()
+
+    async def _make_request(self, method, url, **kwargs):
+        await self._ensure_access_token()
+
+        url = '{}/{}'.format(self.root_url, url.lstrip('/'))
+        headers = {'Authorization': 'Bearer: {}'.format(self.access_token)}
+        request = self._get_session().request
+
+        try:
+            started_at = time.monotonic()
+            async with request(method, url, headers=headers, **kwargs) as response:
+                status = response.status
+                reason = response.reason
+                response_url = str(response.url)
+                content = await response.read()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            raise MoltinUnavailable() from e
+
+        if logger.isEnabledFor(logging.DEBUG):
+            log_response(
+                logger, method, url, status, content, time.monotonic() - started_at
+            )
+
+        if status >= 500:
+            raise MoltinUnavailable('status: {} from {}'.format(status, url))
+
+        if status >= 400:
+            try:
+                error = MoltinApiError.from_response(
+                    response_url, fastjson.loads(content)
+                )
+            except (JSONDecodeError, ValueError, KeyError, IndexError, TypeError):
+                # Not an error of Moltin itself, e.g. a page of a proxy.
+                error = MoltinApiError(response_url, status, reason, None)
+            raise error
+
+        try:
+            return fastjson.loads(content)
+        except (JSONDecodeError, ValueError) as e:
+            raise MoltinUnexpectedFormatResponseError(
+                'error: {}, status: {}, url: {}'.format(str(e), status, url)
+            ) from e
+
+    async def _update_access_token(self):
+        url = '{}/{}'.format(self.root_url, AsyncMoltinApiSession.oauth_url)
+
+        data = {
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'grant_type': 'client_credentials',
+        }
+        session = self._get_session()
+        try:
+            async with session.post(url, data=data) as response:
+                status = response.status
+                response_url = str(response.url)
+                response_dict = await response.json(content_type=None)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            raise MoltinUnavailable() from e
+
+        if status >= 400:
+            raise MoltinApiError.from_response(response_url, response_dict)
+
+        self.access_token_expires_in = response_dict['expires']
+        self.access_token = response_dict['access_token']
+
+
+class AsyncMoltinApi:
+    def __init__(self, session: AsyncMoltinApiSession):
+        self.session = session
+
+    async def get_products(self, limit=100) -> List[Product]:
+        url = MoltinApi.get_products_list_url
+        params = {'page[limit]': limit}
+        data_dct = await self.session.get(url, params=params)
+        products_dct = data_dct['data']
+        return parse_products_list_response(products_dct)
+
+    async def get_product_by_id(self, product_id: str) -> Product:
+        url = MoltinApi.get_product_url.format(product_id)
+        data_dct = await self.session.get(url)
+        product_dct = data_dct['data']
+        return parse_product_response(product_dct)
+
+    async def get_file_by_id(self, file_id: str) -> File:
+        url = MoltinApi.get_file_url.format(file_id)
+        data_dct = await self.session.get(url)
+        file_dct = data_dct['data']
+        return parse_file_response(file_dct)
+
+    async def get_cart(self, cart_reference: str) -> CartHeader:
+        url = MoltinApi.get_cart_url.format(cart_reference)
+        data_dct = await self.session.get(url)
+        cart_header_dct = data_dct['data']
+        return parse_cart_header_response(cart_header_dct)
+
+    async def get_cart_products(self, cart_reference: str) -> List[CartContentProduct]:
+        url = MoltinApi.cart_products_url.format(cart_reference)
+        data_dct = await self.session.get(url)
+        cart_content = data_dct['data']
+        return parse_cart_content_response(cart_content)
+
+    async def get_cart_with_items(
+            self, cart_reference: str
+    ) -> Tuple[CartHeader, List[CartContentProduct]]:
+        cart_header, cart_content = await asyncio.gather(
+            self.get_cart(cart_reference), self.get_cart_products(cart_reference)
+        )
+        return cart_header, cart_content
+
+    async def add_product_to_cart(
+            self, cart_reference: str, product_id: str, quantity: int = 1
+    ) -> NewProductInCart:
+        url = MoltinApi.cart_products_url.format(cart_reference)
+        data_dct = await self.session.post(
+            url,
+            json={
+                'data': {'quantity': quantity, 'type': 'cart_item', 'id': product_id}
+            },
+        )
+        product_in_cart_dct = data_dct['data']
+        return parse_add_product_to_cart_response(product_in_cart_dct[0])
+
+    async def remove_item_from_cart(self, cart_reference: str, item_id: str) -> bool:
+        url = MoltinApi.cart_product_url.format(cart_reference, item_id)
+        await self.session.delete(url)
+        return True
+
+    async def create_flow(self, data: Dict) -> bool:
+        url = MoltinApi.flow_url
+        await self.session.post(url, json={'data': data})
+        return True
@@ -0,0 +1,351 @@
+from typing import Callable, List, Tuple, Union
+from dataclasses import asdict
+import logging
+import threading
+import time
+
+import redis
+
+from application import fastjson
+from application.metrics import registry as metrics
+from application.models import Product, File
+from application.database import RedisStorage
+from application.ecommerce_api.moltin_api.exceptions import (
+    MoltinError,
+    MoltinUnavailable,
+)
+from application.ecommerce_api.moltin_api.moltin import MoltinApi, MoltinApiSession
+from application.ecommerce_api.moltin_api.catalog_sync import (
+    CatalogChanges,
+    IncrementalProductsParser,
+    get_catalog_changes,
+)
+from application.ecommerce_api.moltin_api.search import ProductSearchIndex
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogCache:
+    """
+    In-process cache of the product catalog.
+
+    Fresh data (younger than ttl) is returned as is. Stale data (younger than
+    ttl + stale_ttl) is returned immediately while a single background thread
+    refreshes it. Without usable data callers block, but only one of them
+    talks to Moltin: the rest wait for its result.
+
+    The version is incremented only when a refresh changes products,
+    changes of the last version are kept in changes (None if unknown).
+    """
+
+    def __init__(
+            self,
+            fetch_products: Callable[[], List[Product]],
+            ttl: float = 60,
+            stale_ttl: float = 300,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self.fetch_products = fetch_products
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self.version = 0
+        self.changes = None
+        self._products = None
+        self._products_by_id = {}
+        self._fetched_at = None
+        self._refreshes = 0
+        self._refresh_lock = threading.Lock()
+        self.refresh_listeners = []
+
+    def get_products(self) -> List[Product]:
+        products, fetched_at = self._products, self._fetched_at
+        if products is not None:
+            age = self.clock() - fetched_at
+            if age < self.ttl:
+                metrics.increment('cache_requests_total', cache='catalog', result='hit')
+                return products
+            if age < self.ttl + self.stale_ttl:
+                metrics.increment('cache_requests_total', cache='catalog', result='stale')
+                self._refresh_in_background()
+                return products
+        metrics.increment('cache_requests_total', cache='catalog', result='miss')
+        return self._refresh_blocking()
+
+    def peek_product(self, product_id: str) -> Union[Product, None]:
+        """
+        Look up a product in the catalog which is already loaded,
+        never triggers a fetch.
+        """
+        return self._products_by_id.get(product_id)
+
+    def peek_products(self) -> List[Product]:
+        """
+        Products of the catalog which is already loaded, never triggers a fetch.
+        Refresh listeners read the catalog with it: they are called while
+        the catalog is refreshed, a fetch would wait for that refresh.
+        """
+        return self._products or []
+
+    def load(self, products: List[Product], age: float = 0):
+        """
+        Serve products fetched age seconds ago, e.g. from a snapshot,
+        as if they were fetched by the cache.
+        """
+        with self._refresh_lock:
+            self._set_products(products, self.clock() - age, changes=None)
+
+    def apply_changes(self, products: List[Product], removed_ids: List[str]):
+        """
+        Apply changes found by another process: replace or add products
+        and remove products by ids. The catalog keeps its age, so it is
+        still refreshed from Moltin when it expires.
+        """
+        with self._refresh_lock:
+            if self._products is None:
+                return
+            products_by_id = {product.id: product for product in products}
+            removed_ids = set(removed_ids)
+            new_products = [
+                products_by_id.pop(product.id, product)
+                for product in self._products
+                if product.id not in removed_ids
+            ]
+            new_products.extend(products_by_id.values())
+            changes = get_catalog_changes(self._products, new_products)
+            if changes:
+                changes.remote = True
+                self._set_products(new_products, self._fetched_at, changes)
+
+    def refresh(self) -> List[Product]:
+        """Fetch the catalog now, regardless of its age."""
+        with self._refresh_lock:
+            return self._refresh()
+
+    def invalidate(self):
+        self._products = None
+        self._products_by_id = {}
+        self._fetched_at = None
+
+    def add_refresh_listener(self, listener: Callable[[int], None]):
+        """Listener is called with the new version after every change."""
+        self.refresh_listeners.append(listener)
+
+    def _refresh_blocking(self) -> List[Product]:
+        refreshes = self._refreshes
+        with self._refresh_lock:
+            if self._refreshes != refreshes and self._products is not None:
+                # Somebody refreshed the catalog while we were waiting for the lock.
+                return self._products
+            try:
+                return self._refresh()
+            except MoltinUnavailable:
+                if self._products is None:
+                    raise
+                logger.warning('Moltin is unavailable, expired catalog is served')
+                return self._products
+
+    def _refresh_in_background(self):
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        thread = threading.Thread(target=self._background_refresh, daemon=True)
+        thread.start()
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+        except MoltinError as e:
+            logger.error('Background catalog refresh failed: {}'.format(str(e)))
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self) -> List[Product]:
+        products = self.fetch_products()
+        self._refreshes += 1
+        if self._products is None:
+            self._set_products(products, self.clock(), changes=None)
+            return products
+
+        changes = get_catalog_changes(self._products, products)
+        if not changes:
+            # Products, and everything built from them, stay valid.
+            self._fetched_at = self.clock()
+            logger.debug(
+                'Catalog refreshed, version: {}, no changes'.format(self.version)
+            )
+            return self._products
+        self._set_products(products, self.clock(), changes)
+        return products
+
+    def _set_products(
+            self,
+            products: List[Product],
+            fetched_at: float,
+            changes: Union[CatalogChanges, None],
+    ):
+        self._products = products
+        self._products_by_id = {product.id: product for product in products}
+        self._fetched_at = fetched_at
+        self.changes = changes
+        self.version += 1
+        logger.debug(
+            'Catalog refreshed, version: {}, products: {}, changes: {}'.format(
+                self.version, len(products), changes
+            )
+        )
+        for listener in self.refresh_listeners:
+            try:
+                listener(self.version)
+            except Exception as e:
+                logger.error('Catalog refresh listener failed: {}'.format(str(e)))
+
+
+class RedisObjectCache:
+    """
+    Cache of parsed Moltin objects shared by all bot processes through Redis.
+    Keys contain the schema version, so a change of the dataclasses
+    only requires to bump it instead of flushing Redis.
+    """
+
+    schema_version = 1
+    key_template = 'moltin:cache:v{}:{}:{}'
+
+    def __init__(self, ttl: int = 3600):
+        self.ttl = ttl
+
+    def get_key(self, kind: str, object_id: str) -> str:
+        return RedisObjectCache.key_template.format(
+            RedisObjectCache.schema_version, kind, object_id
+        )
+
+    def get(self, kind: str, object_id: str, cls):
+        key = self.get_key(kind, object_id)
+        try:
+            value = RedisStorage.get(key)
+        except redis.RedisError as e:
+            logger.error('Cannot read {} from cache: {}'.format(key, str(e)))
+            return None
+        if value is None:
+            metrics.increment('cache_requests_total', cache=kind, result='miss')
+            return None
+        metrics.increment('cache_requests_total', cache=kind, result='hit')
+        try:
+            return cls(**fastjson.loads(value))
+        except (ValueError, TypeError) as e:
+            logger.error('Cannot deserialize {} from cache: {}'.format(key, str(e)))
+            return None
+
+    def set(self, kind: str, object_id: str, obj):
+        key = self.get_key(kind, object_id)
+        try:
+            RedisStorage.set(key, fastjson.dumps(asdict(obj)), ex=self.ttl)
+        except redis.RedisError as e:
+            logger.error('Cannot write {} to cache: {}'.format(key, str(e)))
+
+    def delete(self, kind: str, object_id: str):
+        key = self.get_key(kind, object_id)
+        try:
+            RedisStorage.delete(key)
+        except redis.RedisError as e:
+            logger.error('Cannot delete {} from cache: {}'.format(key, str(e)))
+
+
+class CachedMoltinApi(MoltinApi):
+    """
+    MoltinApi which serves the catalog from CatalogCache and
+    single products and files from RedisObjectCache, if it is provided.
+    The catalog is refreshed incrementally: only changed products are parsed,
+    and single products changed in the catalog are dropped from RedisObjectCache.
+    Products are searched in an index updated on every catalog refresh.
+    Images of the catalog products put to catalog_files, see CatalogWarmer,
+    are served from memory.
+    """
+
+    def __init__(
+            self,
+            session: MoltinApiSession,
+            catalog_ttl: float = 60,
+            catalog_stale_ttl: float = 300,
+            object_cache: Union[RedisObjectCache, None] = None,
+    ):
+        super(CachedMoltinApi, self).__init__(session)
+        self.catalog = CatalogCache(
+            self._fetch_catalog, ttl=catalog_ttl, stale_ttl=catalog_stale_ttl
+        )
+        self.object_cache = object_cache
+        self.catalog_files = {}
+        self.products_parser = IncrementalProductsParser()
+        self.search_index = ProductSearchIndex()
+        self.catalog.add_refresh_listener(self._update_search_index)
+        self.catalog.add_refresh_listener(self._drop_changed_products)
+
+    def _fetch_catalog(self) -> List[Product]:
+        return self.products_parser.parse(self.get_all_products_dcts())
+
+    def _drop_changed_products(self, version: int):
+        changes = self.catalog.changes
+        if self.object_cache is None or changes is None or changes.remote:
+            return
+        for product_id in changes.changed + changes.removed:
+            self.object_cache.delete('product', product_id)
+
+    def _update_search_index(self, version: int):
+        changes = self.catalog.changes
+        if changes is None:
+            # The catalog is loaded, not refreshed.
+            self.search_index.update(self.catalog.peek_products())
+            return
+        products = [
+            self.catalog.peek_product(product_id)
+            for product_id in changes.added + changes.changed
+        ]
+        self.search_index.apply_changes(products, changes.removed)
+
+    @metrics.timed('moltin_api_call_seconds', layer='cache')
+    def search_products(self, query: str, limit: int = 10) -> List[Product]:
+        # Loads the catalog, and so the index, on the first call.
+        self.catalog.get_products()
+        return self.search_index.search(query, limit=limit)
+
+    @metrics.timed('moltin_api_call_seconds', layer='cache')
+    def get_products(self, limit=100) -> List[Product]:
+        return self.catalog.get_products()[:limit]
+
+    @metrics.timed('moltin_api_call_seconds', layer='cache')
+    def get_products_page(
+            self, offset: int = 0, limit: int = 100
+    ) -> Tuple[List[Product], Union[int, None]]:
+        products = self.catalog.get_products()
+        return products[offset:offset + limit], len(products)
+
+    @metrics.timed('moltin_api_call_seconds', layer='cache')
+    def get_product_by_id(self, product_id: str) -> Product:
+        product = self.catalog.peek_product(product_id)
+        if product is not None:
+            return product
+
+        if self.object_cache is not None:
+            product = self.object_cache.get('product', product_id, Product)
+            if product is not None:
+                return product
+
+        product = super(CachedMoltinApi, self).get_product_by_id(product_id)
+        if product is not None and self.object_cache is not None:
+            self.object_cache.set('product', product_id, product)
+        return product
+
+    @metrics.timed('moltin_api_call_seconds', layer='cache')
+    def get_file_by_id(self, file_id: str) -> File:
+        file = self.catalog_files.get(file_id)
+        if file is not None:
+            return file
+
+        if self.object_cache is not None:
+            file = self.object_cache.get('file', file_id, File)
+            if file is not None:
+                return file
+
+        file = super(CachedMoltinApi, self).get_file_by_id(file_id)
+        if self.object_cache is not None:
+            self.object_cache.set('file', file_id, file)
+        return file
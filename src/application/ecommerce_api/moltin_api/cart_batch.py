@@ -0,0 +1,238 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, List, Tuple, Union
+import logging
+import threading
+import time
+
+from application.models import slotted
+
+logger = logging.getLogger(__name__)
+
+
+@slotted
+@dataclass
+class CartMutation:
+    """
+    Change of a cart. Removal and quantity change address the item by its
+    id in Moltin or, if it is not known, by the id of the product.
+    Retries counts the attempts of the change which failed transiently.
+    """
+    kind: str
+    product_id: Union[str, None] = None
+    item_id: Union[str, None] = None
+    quantity: int = 0
+    retries: int = 0
+
+    ADD = 'add'
+    REMOVE = 'remove'
+    SET_QUANTITY = 'set_quantity'
+
+    @classmethod
+    def add(cls, product_id: str, quantity: int = 1) -> 'CartMutation':
+        return cls(CartMutation.ADD, product_id=product_id, quantity=quantity)
+
+    @classmethod
+    def remove(cls, item_id: str = None, product_id: str = None) -> 'CartMutation':
+        return cls(CartMutation.REMOVE, product_id=product_id, item_id=item_id)
+
+    @classmethod
+    def set_quantity(
+            cls, quantity: int, item_id: str = None, product_id: str = None
+    ) -> 'CartMutation':
+        return cls(
+            CartMutation.SET_QUANTITY,
+            product_id=product_id,
+            item_id=item_id,
+            quantity=quantity,
+        )
+
+
+def coalesce_mutations(
+        mutations: List[CartMutation]
+) -> List[Tuple[CartMutation, List[int]]]:
+    """
+    Merge mutations into the minimal list of Moltin calls, each returned
+    mutation comes with the indexes of the mutations merged into it.
+
+    Mutations are split into runs of adds and runs of changes of items, runs
+    keep their order. In a run of adds the quantities of a product are summed
+    up, in a run of item changes the last change of an item wins.
+    A quantity set to zero removes the item.
+    """
+    coalesced = []
+    run_kind = None
+    run_positions = {}
+    for index, mutation in enumerate(mutations):
+        kind = CartMutation.ADD if mutation.kind == CartMutation.ADD else 'item'
+        if kind != run_kind:
+            run_kind = kind
+            run_positions = {}
+
+        if mutation.kind == CartMutation.ADD:
+            key = mutation.product_id
+            position = run_positions.get(key)
+            if position is not None:
+                merged, indexes = coalesced[position]
+                merged.quantity += mutation.quantity
+                indexes.append(index)
+                continue
+            mutation = replace(mutation)
+        else:
+            key = mutation.item_id or ('product', mutation.product_id)
+            if mutation.kind == CartMutation.SET_QUANTITY and mutation.quantity <= 0:
+                mutation = CartMutation.remove(mutation.item_id, mutation.product_id)
+            position = run_positions.get(key)
+            if position is not None:
+                indexes = coalesced[position][1]
+                indexes.append(index)
+                coalesced[position] = (mutation, indexes)
+                continue
+
+        run_positions[key] = len(coalesced)
+        coalesced.append((mutation, [index]))
+    return coalesced
+
+
+class CartMutationBatcher:
+    """
+    Collects mutations of every cart for window seconds and applies them
+    at once with apply(cart_reference, mutations), which returns a result
+    per mutation. Batches of one cart are applied one after another,
+    batches of different carts in parallel by workers threads.
+    """
+
+    def __init__(
+            self,
+            apply: Callable[[str, List[CartMutation]], List],
+            window: float = 0.05,
+            workers: int = 4,
+    ):
+        self.apply = apply
+        self.window = window
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='cart-batch'
+        )
+        # Cart reference: (time to apply, [(mutation, future)]).
+        self._pending = {}
+        self._applying = set()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name='cart-batcher', daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Apply pending mutations and stop."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+        self.executor.shutdown(wait=True)
+
+    def submit(self, cart_reference: str, mutation: CartMutation) -> Future:
+        future = Future()
+        with self._condition:
+            batch = self._pending.get(cart_reference)
+            if batch is None:
+                batch = self._pending[cart_reference] = (
+                    time.monotonic() + self.window, []
+                )
+            batch[1].append((mutation, future))
+            self._condition.notify_all()
+        return future
+
+    def requeue(self, cart_reference: str, mutations: List[CartMutation], delay: float):
+        """
+        Apply mutations which failed again in delay seconds, before the
+        mutations of the cart queued meanwhile. Results are not reported.
+        """
+        batch = [(mutation, Future()) for mutation in mutations]
+        with self._condition:
+            pending_batch = self._pending.get(cart_reference)
+            if pending_batch is None:
+                self._pending[cart_reference] = (time.monotonic() + delay, batch)
+            else:
+                apply_at, pending_mutations = pending_batch
+                self._pending[cart_reference] = (
+                    max(apply_at, time.monotonic() + delay),
+                    batch + pending_mutations,
+                )
+            self._condition.notify_all()
+
+    def flush(self, cart_reference: str):
+        """Apply pending mutations of the cart now and wait until they are applied."""
+        with self._condition:
+            batch = self._pending.get(cart_reference)
+            if batch is not None:
+                self._pending[cart_reference] = (0.0, batch[1])
+                self._condition.notify_all()
+            while cart_reference in self._pending or cart_reference in self._applying:
+                self._condition.wait()
+
+    def _run(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                ready = [
+                    cart_reference
+                    for cart_reference, (apply_at, _) in self._pending.items()
+                    if cart_reference not in self._applying
+                    and (apply_at <= now or self._stopped)
+                ]
+                for cart_reference in ready:
+                    _, batch = self._pending.pop(cart_reference)
+                    self._applying.add(cart_reference)
+                    self.executor.submit(self._apply_batch, cart_reference, batch)
+
+                if self._stopped and not self._pending and not self._applying:
+                    return
+                waiting = [
+                    apply_at
+                    for cart_reference, (apply_at, _) in self._pending.items()
+                    if cart_reference not in self._applying
+                ]
+                self._condition.wait(
+                    max(min(waiting) - now, 0.0) if waiting else None
+                )
+
+    def _apply_batch(self, cart_reference: str, batch: List):
+        mutations = [mutation for mutation, future in batch]
+        try:
+            results = self.apply(cart_reference, mutations)
+        except Exception as e:
+            logger.error(
+                'Changes of cart {} have not been applied: {}'.format(
+                    cart_reference, str(e)
+                )
+            )
+            results = [e] * len(batch)
+
+        for (mutation, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        with self._condition:
+            self._applying.discard(cart_reference)
+            self._condition.notify_all()
+
+
+def get_batch_results(
+        coalesced: List[Tuple[CartMutation, List[int]]],
+        coalesced_results: List,
+        size: int,
+) -> List:
+    """Spread results of coalesced mutations over the mutations merged into them."""
+    results = [None] * size
+    for (mutation, indexes), result in zip(coalesced, coalesced_results):
+        for index in indexes:
+            results[index] = result
+    return results
+
+
+def index_items_by_product(items_dcts: List[Dict]) -> Dict[str, str]:
+    return {dct['product_id']: dct['id'] for dct in items_dcts if 'product_id' in dct}
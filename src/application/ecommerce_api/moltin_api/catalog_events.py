@@ -0,0 +1,104 @@
+from dataclasses import astuple
+import logging
+import threading
+import uuid
+
+import redis
+
+from application import fastjson
+from application.database import RedisStorage
+from application.metrics import registry as metrics
+from application.models import Product
+from application.ecommerce_api.moltin_api.cache import CatalogCache
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogEvents:
+    """
+    Publishes changes of the catalog found by this process to a Redis channel
+    and applies changes published by other processes, so the catalogs of all
+    bot processes are updated together. Applied changes keep the age of the
+    catalog: every process still refreshes it from Moltin when it expires,
+    which also catches up on events missed while the subscription was lost.
+    Products are published as lists of field values, the channel contains
+    the schema version like the keys of RedisObjectCache.
+    """
+
+    schema_version = 1
+    channel_template = 'moltin:catalog_events:v{}'
+
+    def __init__(self, catalog: CatalogCache, poll_timeout: float = 1.0):
+        self.catalog = catalog
+        self.poll_timeout = poll_timeout
+        self.source = uuid.uuid4().hex
+        self.channel = CatalogEvents.channel_template.format(
+            CatalogEvents.schema_version
+        )
+        self._stopped = threading.Event()
+        self._subscribed = threading.Event()
+        self._thread = None
+        catalog.add_refresh_listener(self.publish)
+
+    def publish(self, version: int):
+        changes = self.catalog.changes
+        if changes is None or changes.remote:
+            return
+        products = [
+            self.catalog.peek_product(product_id)
+            for product_id in changes.added + changes.changed
+        ]
+        message = fastjson.dumps({
+            'source': self.source,
+            'products': [astuple(product) for product in products if product],
+            'removed': changes.removed,
+        })
+        try:
+            RedisStorage.publish(self.channel, message)
+        except redis.RedisError as e:
+            logger.error('Cannot publish catalog changes: {}'.format(str(e)))
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='catalog-events', daemon=True
+        )
+        self._thread.start()
+
+    def wait_subscribed(self, timeout: float = None) -> bool:
+        return self._subscribed.wait(timeout)
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            pubsub = RedisStorage.pubsub()
+            try:
+                pubsub.subscribe(self.channel)
+                self._subscribed.set()
+                while not self._stopped.is_set():
+                    message = pubsub.get_message(timeout=self.poll_timeout)
+                    if message is not None:
+                        self._handle(message['data'])
+            except redis.RedisError as e:
+                logger.error('Catalog events subscription failed: {}'.format(str(e)))
+                self._subscribed.clear()
+                self._stopped.wait(self.poll_timeout)
+            finally:
+                pubsub.close()
+
+    def _handle(self, data):
+        try:
+            event = fastjson.loads(data)
+            if event['source'] == self.source:
+                return
+            products = [Product(*values) for values in event['products']]
+            removed_ids = event['removed']
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error('Cannot deserialize catalog event: {}'.format(str(e)))
+            return
+        metrics.increment('catalog_events_total')
+        self.catalog.apply_changes(products, removed_ids)
@@ -0,0 +1,115 @@
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Union
+
+from application.metrics import registry as metrics
+from application.models import Product, slotted
+from application.ecommerce_api.moltin_api.parse import parse_product_response
+
+
+@slotted
+@dataclass
+class CatalogChanges:
+    """
+    Ids of the products changed by a catalog refresh and, for menus,
+    positions of the changed products in the new catalog and the first
+    position from which products have moved, None if no product has moved.
+    Remote changes are published by another bot process, see CatalogEvents.
+    """
+    added: List[str]
+    changed: List[str]
+    removed: List[str]
+    changed_indexes: List[int]
+    moved_from: Union[int, None]
+    remote: bool = False
+
+    def __bool__(self):
+        return bool(
+            self.added or self.changed or self.removed or self.moved_from is not None
+        )
+
+
+def get_catalog_changes(
+        old_products: List[Product], new_products: List[Product]
+) -> CatalogChanges:
+    old_products_by_id = {product.id: product for product in old_products}
+    new_ids = set()
+    added = []
+    changed = []
+    changed_indexes = []
+    for index, product in enumerate(new_products):
+        new_ids.add(product.id)
+        old_product = old_products_by_id.get(product.id)
+        if old_product is None:
+            added.append(product.id)
+        elif old_product is not product and old_product != product:
+            changed.append(product.id)
+            changed_indexes.append(index)
+    removed = [product.id for product in old_products if product.id not in new_ids]
+
+    moved_from = None
+    for index, (old_product, new_product) in enumerate(zip(old_products, new_products)):
+        if old_product.id != new_product.id:
+            moved_from = index
+            break
+    else:
+        if len(old_products) != len(new_products):
+            moved_from = min(len(old_products), len(new_products))
+    return CatalogChanges(added, changed, removed, changed_indexes, moved_from)
+
+
+def get_product_fingerprint(dct: Dict) -> Union[Hashable, None]:
+    """
+    What tells a changed product: the time of its last update and the parts
+    which may change without an update, e.g. the price of a price book.
+    None if Moltin does not report the time.
+    """
+    meta = dct.get('meta') or {}
+    updated_at = (meta.get('timestamps') or {}).get('updated_at')
+    if updated_at is None:
+        return None
+    try:
+        formatted_price = meta['display_price']['with_tax']['formatted']
+    except (KeyError, TypeError):
+        formatted_price = None
+    try:
+        main_image_id = dct['relationships']['main_image']['data']['id']
+    except (KeyError, TypeError):
+        main_image_id = None
+    return updated_at, dct.get('status'), formatted_price, main_image_id
+
+
+class IncrementalProductsParser:
+    """
+    Parses products of the refreshed catalog, products with the fingerprint
+    they had at the previous call are not parsed again, the same Product
+    objects are returned for them. Not thread-safe, the catalog is refreshed
+    by one thread at a time.
+    """
+
+    def __init__(self):
+        # Product id: (fingerprint, product or None if it is not live).
+        self._products = {}
+
+    def parse(self, products_dcts: List[Dict]) -> List[Product]:
+        parsed_products = {}
+        products = []
+        parsed = 0
+        for dct in products_dcts:
+            fingerprint = get_product_fingerprint(dct)
+            known_product = self._products.get(dct['id'])
+            if (
+                    fingerprint is not None
+                    and known_product is not None
+                    and known_product[0] == fingerprint
+            ):
+                product = known_product[1]
+            else:
+                product = parse_product_response(dct)
+                parsed += 1
+            parsed_products[dct['id']] = (fingerprint, product)
+            if product is not None:
+                products.append(product)
+
+        self._products = parsed_products
+        metrics.increment('catalog_products_parsed_total', parsed)
+        return products
@@ -6,6 +6,14 @@ class MoltinUnavailable(MoltinError):
     pass
 
 
+class MoltinCircuitOpen(MoltinUnavailable):
+    pass
+
+
+class MoltinRateLimited(MoltinUnavailable):
+    pass
+
+
 class MoltinUnexpectedFormatResponseError(MoltinError):
     pass
 
@@ -17,7 +25,18 @@ class MoltinApiError(MoltinError):
         self.title = title
         self.detail = detail
 
+    @classmethod
+    def from_response(cls, url, response_dict):
+        error = response_dict['errors'][0]
+        return cls(
+            url, error.get('status'), error.get('title'), error.get('detail')
+        )
+
     def __str__(self):
         return 'status: {}, title: {}, detail: {} from {}'.format(
             self.code, self.title, self.detail, self.url
         )
+
+
+class MoltinUnauthorized(MoltinApiError):
+    pass
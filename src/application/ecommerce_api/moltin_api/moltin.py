@@ -1,12 +1,17 @@
-from typing import List, Dict
+from typing import List, Dict, Iterator, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
 import functools
+import random
+import threading
 import time
 import logging
-from json import JSONDecodeError
 
 import requests
 from requests import Session
+from requests.adapters import HTTPAdapter
 
+from application import fastjson
+from application.metrics import registry as metrics
 from application.models import (
     Product,
     NewProductInCart,
@@ -15,9 +20,20 @@ from application.models import (
     CartContentProduct,
 )
 from application.ecommerce_api.moltin_api.exceptions import (
+    MoltinError,
     MoltinApiError,
+    MoltinUnauthorized,
     MoltinUnexpectedFormatResponseError,
     MoltinUnavailable,
+    MoltinRateLimited,
+)
+from application.ecommerce_api.moltin_api.policy import RetryPolicy, CircuitBreaker
+from application.ecommerce_api.moltin_api.ratelimit import MoltinRateLimiter
+from application.ecommerce_api.moltin_api.cart_batch import (
+    CartMutation,
+    coalesce_mutations,
+    get_batch_results,
+    index_items_by_product,
 )
 from application.ecommerce_api.moltin_api.parse import (
     parse_products_list_response,
@@ -31,28 +47,113 @@ from application.ecommerce_api.moltin_api.parse import (
 logger = logging.getLogger(__name__)
 
 
+def log_response(
+        log: logging.Logger,
+        method: str,
+        url: str,
+        status: int,
+        content: bytes,
+        elapsed: float,
+):
+    """
+    Log a summary of the request and, for sampled requests, the beginning
+    of the response body. Callers check that DEBUG is enabled for log
+    beforehand, so nothing is formatted otherwise.
+    """
+    summary = {
+        'method': method,
+        'url': url,
+        'status': status,
+        'bytes': len(content),
+        'elapsed': elapsed,
+    }
+    log.debug(
+        '{method} {url} status: {status}, bytes: {bytes}, '
+        'elapsed: {elapsed:.3f}s'.format(**summary),
+        extra={'moltin_request': summary},
+    )
+
+    limit = MoltinApiSession.response_log_limit
+    if not limit or random.random() >= MoltinApiSession.response_log_sample_rate:
+        return
+    # Cut the body before decoding, a character takes at most 4 bytes in utf-8.
+    body = content[:limit * 4].decode('utf-8', 'replace')[:limit]
+    if len(content) > len(body):
+        body = '{}... ({} bytes in total)'.format(body, len(content))
+    log.debug('Response from {}: {}'.format(url, body))
+
+
+class FastJSONResponse(requests.Response):
+    """Response whose body is decoded by the fastest available JSON backend."""
+
+    def json(self, **kwargs):
+        if kwargs:
+            return super(FastJSONResponse, self).json(**kwargs)
+        return fastjson.loads(self.content)
+
+
+class FastJSONAdapter(HTTPAdapter):
+    def build_response(self, req, resp):
+        response = super(FastJSONAdapter, self).build_response(req, resp)
+        response.__class__ = FastJSONResponse
+        return response
+
+
 def access_token_required(func):
+    """
+    Make sure a valid access token is set before the request.
+    If Moltin rejects the token anyway, e.g. it was revoked,
+    the token is refreshed and the request is repeated once.
+    """
+
     @functools.wraps(func)
     def wrapped(self, *args, **kwargs):
-        if (self.access_token is None
-                or self.access_token_expires_in is None
-                or self.access_token_expires_in < time.time() - 10):
-            self._update_access_token()
-        return func(self, *args, **kwargs)
+        self._ensure_access_token()
+        access_token = self.access_token
+        try:
+            return func(self, *args, **kwargs)
+        except MoltinUnauthorized:
+            logger.debug('Access token has been rejected, refresh it and retry')
+            self._refresh_rejected_access_token(access_token)
+            return func(self, *args, **kwargs)
 
     return wrapped
 
 
 class MoltinApiSession(Session):
     oauth_url = 'oauth/access_token'
-
-    def __init__(self, root_url: str, client_id: str, client_secret: str):
+    # Token is treated as expired this amount of seconds before its expiration.
+    access_token_expiration_skew = 10
+    # Token is refreshed in background this amount of seconds before its expiration.
+    access_token_refresh_ahead = 60
+    # Logged response bodies are cut to this amount of characters, 0 disables them.
+    response_log_limit = 1000
+    # Share of requests whose response body is logged, summaries are always logged.
+    response_log_sample_rate = 1.0
+
+    def __init__(
+            self,
+            root_url: str,
+            client_id: str,
+            client_secret: str,
+            timeout=(3.05, 10),
+            retry_policy: Union[RetryPolicy, None] = None,
+            circuit_breaker: Union[CircuitBreaker, None] = None,
+            rate_limiter: Union[MoltinRateLimiter, None] = None,
+    ):
         super(MoltinApiSession, self).__init__()
         self.root_url = root_url.rstrip('/')
         self.client_id = client_id
         self.client_secret = client_secret
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy(max_retries=0)
+        self.circuit_breaker = circuit_breaker
+        self.rate_limiter = rate_limiter
         self.access_token = None
         self.access_token_expires_in = None
+        self._access_token_lock = threading.Lock()
+        self.mount('https://', FastJSONAdapter())
+        self.mount('http://', FastJSONAdapter())
 
     def __repr__(self):
         return self.__str__()
@@ -76,51 +177,152 @@ class MoltinApiSession(Session):
     def post(self, url, data=None, json=None, **kwargs):
         return self._make_request('post', url, data=data, json=json, **kwargs)
 
+    def put(self, url, data=None, json=None, **kwargs):
+        return self._make_request('put', url, data=data, json=json, **kwargs)
+
     def delete(self, url, **kwargs):
         return self._make_request('delete', url, **kwargs)
 
     @access_token_required
     def _make_request(self, method, url, **kwargs):
-        method = getattr(super(MoltinApiSession, self), method)
-
         url = '{}/{}'.format(self.root_url, url.lstrip('/'))
+        kwargs.setdefault('timeout', self.timeout)
 
-        try:
-            response = method(url, **kwargs)
-            response.raise_for_status()
-        except (requests.ConnectionError, requests.Timeout) as e:
-            raise MoltinUnavailable() from e
-        except requests.HTTPError as e:
-            response_dict = response.json()
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.before_request()
 
-            error = response_dict['errors'][0]
-            error_status = error.get('status', None)
-            error_title = error.get('title', None)
-            error_detail = error.get('detail', None)
+        try:
+            response = self._send_with_retries(method, url, **kwargs)
+        except MoltinRateLimited:
+            # Throttled on our side, Moltin itself is fine.
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.cancel_trial()
+            raise
+        except Exception:
+            # Any failure ends the trial request of a half open circuit,
+            # otherwise the circuit would never close again.
+            self._record_request_result(success=False)
+            raise
+        self._record_request_result(success=response.status_code < 500)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            log_response(
+                logger,
+                method,
+                url,
+                response.status_code,
+                response.content,
+                response.elapsed.total_seconds(),
+            )
 
-            logger.debug(
-                'json response from {} with status code {} : {}'.format(
-                    url, response.status_code, response_dict
-                )
+        if response.status_code >= 500:
+            raise MoltinUnavailable(
+                'status: {} from {}'.format(response.status_code, url)
             )
 
-            raise MoltinApiError(
-                response.url, error_status, error_title, error_detail
-            ) from e
+        if response.status_code >= 400:
+            if response.status_code == 401:
+                error_cls = MoltinUnauthorized
+            else:
+                error_cls = MoltinApiError
+            try:
+                error = error_cls.from_response(response.url, response.json())
+            except (ValueError, KeyError, IndexError, TypeError):
+                # Not an error of Moltin itself, e.g. a page of a proxy.
+                error = error_cls(
+                    response.url, response.status_code, response.reason, None
+                )
+            raise error
 
         try:
-            response_dict = response.json()
-            logger.debug(
-                'json response from {} with status code {} : {}'.format(
-                    url, response.status_code, response_dict
-                )
-            )
-            return response_dict
-        except (JSONDecodeError, KeyError) as e:
+            return response.json()
+        except ValueError as e:
             raise MoltinUnexpectedFormatResponseError(
                 'error: {}, data: {}'.format(str(e), response)
             ) from e
 
+    def _send_with_retries(self, method, url, **kwargs):
+        send = getattr(super(MoltinApiSession, self), method)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(url)
+            try:
+                with metrics.measure('moltin_http_request_seconds', method=method):
+                    response = send(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.increment(
+                    'moltin_http_responses_total', method=method, status='error'
+                )
+                if not self.retry_policy.should_retry(method, attempt, None):
+                    raise MoltinUnavailable() from e
+                backoff = self.retry_policy.get_backoff(attempt)
+                logger.debug('Request to {} failed: {}, retry'.format(url, str(e)))
+            else:
+                status = response.status_code
+                metrics.increment(
+                    'moltin_http_responses_total', method=method, status=status
+                )
+                if not self.retry_policy.should_retry(method, attempt, status):
+                    return response
+                backoff = self.retry_policy.get_backoff(
+                    attempt, response.headers.get('Retry-After')
+                )
+                if backoff is None:
+                    return response
+                logger.debug('Status {} from {}, retry'.format(status, url))
+
+            metrics.increment('moltin_http_retries_total', method=method)
+            time.sleep(backoff)
+            attempt += 1
+
+    def _record_request_result(self, success: bool):
+        if self.circuit_breaker is None:
+            return
+        if success:
+            self.circuit_breaker.record_success()
+        else:
+            self.circuit_breaker.record_failure()
+
+    def _access_token_expires_within(self, seconds) -> bool:
+        return (
+            self.access_token is None
+            or self.access_token_expires_in is None
+            or self.access_token_expires_in - seconds < time.time()
+        )
+
+    def _ensure_access_token(self):
+        if self._access_token_expires_within(self.access_token_expiration_skew):
+            with self._access_token_lock:
+                # Concurrent callers wait for the refresh which is already in flight.
+                if self._access_token_expires_within(
+                        self.access_token_expiration_skew
+                ):
+                    self._update_access_token()
+        elif self._access_token_expires_within(self.access_token_refresh_ahead):
+            self._update_access_token_in_background()
+
+    def _refresh_rejected_access_token(self, rejected_access_token):
+        with self._access_token_lock:
+            if self.access_token == rejected_access_token:
+                self._update_access_token()
+
+    def _update_access_token_in_background(self):
+        if not self._access_token_lock.acquire(blocking=False):
+            return
+        thread = threading.Thread(
+            target=self._background_access_token_update, daemon=True
+        )
+        thread.start()
+
+    def _background_access_token_update(self):
+        try:
+            self._update_access_token()
+        except MoltinError as e:
+            logger.error('Background access token update failed: {}'.format(str(e)))
+        finally:
+            self._access_token_lock.release()
+
     def _update_access_token(self):
 
         url = '{}/{}'.format(self.root_url, MoltinApiSession.oauth_url)
@@ -131,21 +333,14 @@ class MoltinApiSession(Session):
             'grant_type': 'client_credentials',
         }
         try:
-            response = requests.post(url, data=data)
+            response = super(MoltinApiSession, self).post(
+                url, data=data, headers={'Authorization': None}, timeout=self.timeout
+            )
             response.raise_for_status()
         except (requests.ConnectionError, requests.Timeout) as e:
             raise MoltinUnavailable() from e
         except requests.HTTPError as e:
-            response_dict = response.json()
-
-            error = response_dict['errors'][0]
-            error_status = error['status']
-            error_title = error['title']
-            error_detail = error['detail'] if 'detail' in error.keys() else None
-
-            raise MoltinApiError(
-                response.url, error_status, error_title, error_detail
-            ) from e
+            raise MoltinApiError.from_response(response.url, response.json()) from e
 
         response_dict = response.json()
         self.access_token_expires_in = response_dict['expires']
@@ -162,42 +357,204 @@ class MoltinApi:
     cart_product_url = 'v2/carts/{}/items/{}'
     flow_url = '/v2/flows'
 
-    def __init__(self, session: MoltinApiSession):
+    def __init__(self, session: MoltinApiSession, max_workers: int = 4):
         self.session = session
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='moltin-api'
+        )
 
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
     def get_products(self, limit=100) -> List[Product]:
         params = {'page[limit]': limit}
         data_dct = self.session.get(MoltinApi.get_products_list_url, params=params)
         products_dct = data_dct['data']
         return parse_products_list_response(products_dct)
 
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
+    def get_products_page(
+            self, offset: int = 0, limit: int = 100
+    ) -> Tuple[List[Product], Union[int, None]]:
+        """
+        Return live products of one catalog page and
+        the total number of products reported by Moltin.
+        """
+        data_dct = self._get_products_page_dct(offset, limit)
+        products = parse_products_list_response(data_dct['data'])
+        return products, _get_products_total(data_dct)
+
+    def iter_products(self, page_size: int = 100, offset: int = 0) -> Iterator[Product]:
+        """
+        Stream the whole catalog page by page,
+        the next page is requested only when the previous one is consumed.
+        """
+        while True:
+            data_dct = self._get_products_page_dct(offset, page_size)
+            products_dcts = data_dct['data']
+            yield from parse_products_list_response(products_dcts)
+
+            offset += page_size
+            total = _get_products_total(data_dct)
+            if len(products_dcts) < page_size or (total is not None and offset >= total):
+                return
+
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
+    def get_all_products(self, page_size: int = 100) -> List[Product]:
+        """
+        Fetch the whole catalog, pages after the first one are requested in parallel.
+        """
+        return parse_products_list_response(self.get_all_products_dcts(page_size))
+
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
+    def get_all_products_dcts(self, page_size: int = 100) -> List[Dict]:
+        """Unparsed products of the whole catalog, see get_all_products."""
+        data_dct = self._get_products_page_dct(0, page_size)
+        products_dcts = list(data_dct['data'])
+        total = _get_products_total(data_dct)
+        if total is None:
+            offset = page_size
+            page_dcts = data_dct['data']
+            while len(page_dcts) == page_size:
+                page_dcts = self._get_products_page_dct(offset, page_size)['data']
+                products_dcts.extend(page_dcts)
+                offset += page_size
+            return products_dcts
+
+        offsets = range(page_size, total, page_size)
+        pages = self.executor.map(
+            lambda offset: self._get_products_page_dct(offset, page_size), offsets
+        )
+        for page_dct in pages:
+            products_dcts.extend(page_dct['data'])
+        return products_dcts
+
+    def _get_products_page_dct(self, offset: int, limit: int) -> Dict:
+        params = {'page[limit]': limit, 'page[offset]': offset}
+        return self.session.get(MoltinApi.get_products_list_url, params=params)
+
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
     def get_product_by_id(self, product_id: str) -> Product:
         url = MoltinApi.get_product_url.format(product_id)
         data_dct = self.session.get(url)
         product_dct = data_dct['data']
         return parse_product_response(product_dct)
 
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
     def get_file_by_id(self, file_id: str) -> File:
         url = MoltinApi.get_file_url.format(file_id)
         data_dct = self.session.get(url)
         file_dct = data_dct['data']
         return parse_file_response(file_dct)
 
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
     def get_cart(self, cart_reference: str) -> CartHeader:
         url = MoltinApi.get_cart_url.format(cart_reference)
         data_dct = self.session.get(url)
         cart_header_dct = data_dct['data']
         return parse_cart_header_response(cart_header_dct)
 
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
     def get_cart_products(self, cart_reference: str) -> List[CartContentProduct]:
         url = MoltinApi.cart_products_url.format(cart_reference)
         data_dct = self.session.get(url)
         cart_content = data_dct['data']
         return parse_cart_content_response(cart_content)
 
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
+    def get_cart_with_items(
+            self, cart_reference: str
+    ) -> Tuple[CartHeader, List[CartContentProduct]]:
+        cart_header_future = self.executor.submit(self.get_cart, cart_reference)
+        cart_content = self.get_cart_products(cart_reference)
+        return cart_header_future.result(), cart_content
+
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
     def add_product_to_cart(
             self, cart_reference: str, product_id: str, quantity: int = 1
     ) -> NewProductInCart:
+        items_dcts = self._post_cart_item(cart_reference, product_id, quantity)
+        return parse_add_product_to_cart_response(
+            _find_item_dct(items_dcts, 'product_id', product_id)
+        )
+
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
+    def update_cart_item_quantity(
+            self, cart_reference: str, item_id: str, quantity: int
+    ) -> NewProductInCart:
+        items_dcts = self._put_cart_item(cart_reference, item_id, quantity)
+        return parse_add_product_to_cart_response(
+            _find_item_dct(items_dcts, 'id', item_id)
+        )
+
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
+    def remove_item_from_cart(self, cart_reference: str, item_id: str) -> bool:
+        url = MoltinApi.cart_product_url.format(cart_reference, item_id)
+        self.session.delete(url)
+        return True
+
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
+    def apply_cart_mutations(
+            self, cart_reference: str, mutations: List[CartMutation]
+    ) -> List:
+        """
+        Apply changes of a cart with as few calls as possible, see
+        coalesce_mutations. Items addressed by product are looked up in the
+        cart once, a quantity set for a product which is not in the cart adds it.
+
+        Return a result per mutation: NewProductInCart of the item for adds and
+        quantity changes, True for removals or the MoltinError of a failed call.
+        A failed call does not stop the rest of the changes.
+        """
+        coalesced = coalesce_mutations(mutations)
+        metrics.increment('moltin_cart_mutations_total', len(mutations))
+        metrics.increment('moltin_cart_mutation_calls_total', len(coalesced))
+
+        # Product id to item id, as of the last response listing the cart.
+        item_ids = None
+        coalesced_results = []
+        for mutation, _ in coalesced:
+            try:
+                item_id = mutation.item_id
+                if mutation.kind != CartMutation.ADD and item_id is None:
+                    if item_ids is None:
+                        item_ids = {
+                            item.product_id: item.id
+                            for item in self.get_cart_products(cart_reference)
+                        }
+                    item_id = item_ids.get(mutation.product_id)
+
+                if mutation.kind == CartMutation.REMOVE:
+                    if item_id is not None:
+                        url = MoltinApi.cart_product_url.format(cart_reference, item_id)
+                        self.session.delete(url)
+                        if item_ids is not None:
+                            item_ids.pop(mutation.product_id, None)
+                    coalesced_results.append(True)
+                    continue
+
+                if item_id is None:
+                    items_dcts = self._post_cart_item(
+                        cart_reference, mutation.product_id, mutation.quantity
+                    )
+                    item_dct = _find_item_dct(
+                        items_dcts, 'product_id', mutation.product_id
+                    )
+                else:
+                    items_dcts = self._put_cart_item(
+                        cart_reference, item_id, mutation.quantity
+                    )
+                    item_dct = _find_item_dct(items_dcts, 'id', item_id)
+                item_ids = index_items_by_product(items_dcts)
+                coalesced_results.append(parse_add_product_to_cart_response(item_dct))
+            except MoltinError as e:
+                logger.error(
+                    'Change of cart {} failed: {}'.format(cart_reference, str(e))
+                )
+                coalesced_results.append(e)
+        return get_batch_results(coalesced, coalesced_results, len(mutations))
+
+    def _post_cart_item(
+            self, cart_reference: str, product_id: str, quantity: int
+    ) -> List[Dict]:
         url = MoltinApi.cart_products_url.format(cart_reference)
         data_dct = self.session.post(
             url,
@@ -205,15 +562,37 @@ class MoltinApi:
                 'data': {'quantity': quantity, 'type': 'cart_item', 'id': product_id}
             },
         )
-        product_in_cart_dct = data_dct['data']
-        return parse_add_product_to_cart_response(product_in_cart_dct[0])
+        return data_dct['data']
 
-    def remove_item_from_cart(self, cart_reference: str, item_id: str) -> bool:
+    def _put_cart_item(
+            self, cart_reference: str, item_id: str, quantity: int
+    ) -> List[Dict]:
         url = MoltinApi.cart_product_url.format(cart_reference, item_id)
-        self.session.delete(url)
-        return True
+        data_dct = self.session.put(
+            url,
+            json={'data': {'quantity': quantity, 'type': 'cart_item', 'id': item_id}},
+        )
+        return data_dct['data']
 
+    @metrics.timed('moltin_api_call_seconds', layer='moltin')
     def create_flow(self, data: Dict) -> bool:
         url = MoltinApi.flow_url
         self.session.post(url, json={'data': data})
         return True
+
+
+def _find_item_dct(items_dcts: List[Dict], key: str, value: str) -> Dict:
+    """Item of a cart listed in the response."""
+    for item_dct in items_dcts:
+        if item_dct.get(key) == value:
+            return item_dct
+    raise MoltinUnexpectedFormatResponseError(
+        'item with {} {} is not in the cart: {}'.format(key, value, items_dcts)
+    )
+
+
+def _get_products_total(data_dct: Dict) -> Union[int, None]:
+    try:
+        return data_dct['meta']['results']['total']
+    except (KeyError, TypeError):
+        return None
@@ -0,0 +1,120 @@
+from typing import Callable, Union
+import logging
+import threading
+import time
+
+from application.ecommerce_api.moltin_api.exceptions import MoltinCircuitOpen
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """
+    Decides whether a failed request is repeated and how long to wait before.
+    Requests which may have been processed by Moltin, e.g. a POST which timed out
+    or got 5xx, are repeated only if the method is idempotent.
+    429 means that the request has not been processed, so it is always repeated.
+    """
+
+    idempotent_methods = ('get', 'head', 'options')
+    retry_statuses = (429, 500, 502, 503, 504)
+    too_many_requests_status = 429
+
+    def __init__(
+            self,
+            max_retries: int = 2,
+            backoff_factor: float = 0.2,
+            max_backoff: float = 5,
+    ):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+    def should_retry(self, method: str, attempt: int, status: Union[int, None]) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if status == RetryPolicy.too_many_requests_status:
+            return True
+        if status is not None and status not in RetryPolicy.retry_statuses:
+            return False
+        return method.lower() in RetryPolicy.idempotent_methods
+
+    def get_backoff(self, attempt: int, retry_after: Union[str, None] = None) -> float:
+        """
+        Return seconds to wait before the next attempt or None
+        if the server asks to wait longer than max_backoff.
+        """
+        if retry_after is not None:
+            try:
+                retry_after = float(retry_after)
+            except ValueError:
+                retry_after = None
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_backoff else None
+        return min(self.backoff_factor * (2 ** attempt), self.max_backoff)
+
+
+class CircuitBreaker:
+    """
+    After failure_threshold consecutive failures the circuit opens and
+    requests fail fast with MoltinCircuitOpen. After reset_timeout one trial
+    request is let through: its success closes the circuit, its failure opens
+    it again, a cancelled trial lets the next request through.
+    """
+
+    STATE_CLOSED = 'closed'
+    STATE_OPEN = 'open'
+    STATE_HALF_OPEN = 'half_open'
+
+    def __init__(
+            self,
+            failure_threshold: int = 5,
+            reset_timeout: float = 30,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CircuitBreaker.STATE_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        with self._lock:
+            if self.state == CircuitBreaker.STATE_CLOSED:
+                return
+            if (self.state == CircuitBreaker.STATE_OPEN
+                    and self.clock() - self.opened_at >= self.reset_timeout):
+                self.state = CircuitBreaker.STATE_HALF_OPEN
+                logger.info('Circuit is half open, trying Moltin again')
+                return
+            raise MoltinCircuitOpen()
+
+    def cancel_trial(self):
+        """
+        The trial request has not reached Moltin, e.g. it was throttled
+        on our side: let the next request try instead.
+        """
+        with self._lock:
+            if self.state == CircuitBreaker.STATE_HALF_OPEN:
+                self.state = CircuitBreaker.STATE_OPEN
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CircuitBreaker.STATE_CLOSED:
+                logger.info('Circuit is closed, Moltin is available again')
+            self.state = CircuitBreaker.STATE_CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if (self.state == CircuitBreaker.STATE_HALF_OPEN
+                    or self.failures >= self.failure_threshold):
+                if self.state != CircuitBreaker.STATE_OPEN:
+                    logger.warning(
+                        'Circuit is open after {} failures'.format(self.failures)
+                    )
+                self.state = CircuitBreaker.STATE_OPEN
+                self.opened_at = self.clock()
@@ -0,0 +1,222 @@
+from typing import Callable, Dict, List, Tuple
+import logging
+import threading
+import time
+
+import redis
+
+from application.database import RedisStorage
+from application.ecommerce_api.moltin_api.exceptions import MoltinRateLimited
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    In-process token bucket. A caller which finds the bucket empty reserves
+    the next token and sleeps until it is refilled, so waiting callers are
+    served in order. If the wait would exceed max_wait the call fails instead.
+    """
+
+    def __init__(
+            self,
+            rate: float,
+            capacity: float,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated_at = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> float:
+        """
+        Take a token and return seconds to wait before using it,
+        returns None without taking a token if the wait exceeds max_wait.
+        """
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+    def acquire(self, max_wait: float) -> float:
+        wait = self.reserve(max_wait)
+        if wait is None:
+            raise MoltinRateLimited()
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+
+class RedisTokenBucket(TokenBucket):
+    """
+    Token bucket stored in Redis, so the limit holds for all bot processes.
+    Refill and reservation are done atomically by a Lua script.
+    """
+
+    script = """
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local max_wait = tonumber(ARGV[4])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated_at = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    local wait = 0
+    if tokens < 1 then
+        wait = (1 - tokens) / rate
+    end
+    if wait > max_wait then
+        return '-1'
+    end
+    redis.call('HMSET', KEYS[1], 'tokens', tokens - 1, 'updated_at', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(
+            self,
+            key: str,
+            rate: float,
+            capacity: float,
+            sleep: Callable[[float], None] = time.sleep,
+    ):
+        super(RedisTokenBucket, self).__init__(
+            rate, capacity, clock=time.time, sleep=sleep
+        )
+        self.key = key
+        self._script = None
+
+    def reserve(self, max_wait: float) -> float:
+        if self._script is None:
+            self._script = RedisStorage.connection.register_script(
+                RedisTokenBucket.script
+            )
+        try:
+            wait = float(
+                self._script(
+                    keys=[self.key],
+                    args=[self.rate, self.capacity, self.clock(), max_wait],
+                )
+            )
+        except redis.RedisError as e:
+            # Do not stop talking to Moltin because Redis is unavailable.
+            logger.error('Cannot reserve token of {}: {}'.format(self.key, str(e)))
+            return 0.0
+        return None if wait < 0 else wait
+
+
+class MoltinRateLimiter:
+    """
+    Limits requests to Moltin with a token bucket per endpoint class,
+    requests which do not belong to any class are not limited.
+    Time spent waiting for tokens is collected per class.
+    """
+
+    endpoint_classes = (
+        ('v2/products', 'catalog'),
+        ('v2/files', 'catalog'),
+        ('v2/carts', 'cart'),
+        ('v2/flows', 'flows'),
+    )
+
+    def __init__(self, buckets: Dict[str, TokenBucket], max_wait: float = 2.0):
+        self.buckets = buckets
+        self.max_wait = max_wait
+        self.stats = {
+            endpoint_class: {
+                'requests': 0,
+                'rejected': 0,
+                'wait_total': 0.0,
+                'wait_max': 0.0,
+            }
+            for endpoint_class in buckets
+        }
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def get_endpoint_class(url: str):
+        for path, endpoint_class in MoltinRateLimiter.endpoint_classes:
+            if '/{}'.format(path) in url:
+                return endpoint_class
+        return None
+
+    def acquire(self, url: str) -> float:
+        endpoint_class = MoltinRateLimiter.get_endpoint_class(url)
+        bucket = self.buckets.get(endpoint_class)
+        if bucket is None:
+            return 0.0
+
+        try:
+            wait = bucket.acquire(self.max_wait)
+        except MoltinRateLimited:
+            with self._stats_lock:
+                self.stats[endpoint_class]['rejected'] += 1
+            logger.warning('Rate limit of {} requests exceeded'.format(endpoint_class))
+            raise
+
+        with self._stats_lock:
+            stats = self.stats[endpoint_class]
+            stats['requests'] += 1
+            stats['wait_total'] += wait
+            stats['wait_max'] = max(stats['wait_max'], wait)
+        if wait > 0:
+            logger.debug(
+                'Request to {} waited {:.3f}s for rate limiter'.format(url, wait)
+            )
+        return wait
+
+    def get_stats(self) -> Dict[str, Dict]:
+        with self._stats_lock:
+            return {
+                endpoint_class: dict(stats)
+                for endpoint_class, stats in self.stats.items()
+            }
+
+    def collect_metrics(self) -> List[Tuple]:
+        """Samples of the statistics for the metrics registry."""
+        samples = []
+        for endpoint_class, stats in self.get_stats().items():
+            labels = {'endpoint_class': endpoint_class}
+            for name, value in (
+                    ('moltin_rate_limit_requests_total', stats['requests']),
+                    ('moltin_rate_limit_rejected_total', stats['rejected']),
+                    ('moltin_rate_limit_wait_seconds_total', stats['wait_total']),
+            ):
+                samples.append((name, 'counter', labels, value))
+        return samples
+
+
+def create_rate_limiter(
+        rates: Dict[str, float],
+        burst: float,
+        max_wait: float,
+        redis_key_prefix: str = None,
+) -> MoltinRateLimiter:
+    """
+    Build a limiter with a bucket per endpoint class which has a positive rate,
+    buckets are kept in Redis if redis_key_prefix is given.
+    """
+    buckets = {}
+    for endpoint_class, rate in rates.items():
+        if not rate:
+            continue
+        capacity = max(burst, 1)
+        if redis_key_prefix is None:
+            buckets[endpoint_class] = TokenBucket(rate, capacity)
+        else:
+            key = '{}:{}'.format(redis_key_prefix, endpoint_class)
+            buckets[endpoint_class] = RedisTokenBucket(key, rate, capacity)
+    return MoltinRateLimiter(buckets, max_wait=max_wait)
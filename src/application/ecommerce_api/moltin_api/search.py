@@ -0,0 +1,172 @@
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Tuple
+import logging
+import re
+import threading
+
+from application.models import Product
+
+logger = logging.getLogger(__name__)
+
+token_pattern = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    if not text:
+        return []
+    return token_pattern.findall(text.lower())
+
+
+class ProductSearchIndex:
+    """
+    In-memory inverted index of products by the words of their name,
+    description, sku and slug. Every word of a query has to match a word of
+    the product or, for the last word which may be typed partially, its prefix.
+    Products are ranked by the weights of the fields the words were found in.
+
+    apply_changes reindexes the products changed by a catalog refresh,
+    update takes the whole catalog, e.g. when it is loaded, and compares it
+    with the indexed products.
+    """
+
+    field_weights = (
+        ('name', 4),
+        ('sku', 3),
+        ('slug', 2),
+        ('description', 1),
+    )
+
+    def __init__(self):
+        # Word: {product id: weight}.
+        self._postings = {}
+        # Sorted words, for prefix lookups.
+        self._words = []
+        self._products = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._products)
+
+    def update(self, products: Iterable[Product]) -> Tuple[int, int, int]:
+        """Reindex the changes of the catalog, return (added, changed, removed)."""
+        products_by_id = {product.id: product for product in products}
+        with self._lock:
+            removed_ids = [
+                product_id
+                for product_id in self._products
+                if product_id not in products_by_id
+            ]
+            changed_products = [
+                product
+                for product_id, product in products_by_id.items()
+                if self._products.get(product_id) != product
+            ]
+            return self._apply_changes(changed_products, removed_ids)
+
+    def apply_changes(
+            self, products: Iterable[Product], removed_ids: Iterable[str]
+    ) -> Tuple[int, int, int]:
+        """
+        Reindex added or changed products and remove products by ids,
+        return (added, changed, removed).
+        """
+        with self._lock:
+            return self._apply_changes(products, removed_ids)
+
+    def _apply_changes(
+            self, products: Iterable[Product], removed_ids: Iterable[str]
+    ) -> Tuple[int, int, int]:
+        added = changed = removed = 0
+        for product_id in removed_ids:
+            indexed_product = self._products.pop(product_id, None)
+            if indexed_product is not None:
+                self._remove(indexed_product)
+                removed += 1
+
+        for product in products:
+            indexed_product = self._products.get(product.id)
+            if indexed_product is None:
+                added += 1
+            else:
+                changed += 1
+                self._remove(indexed_product)
+            self._add(product)
+            self._products[product.id] = product
+
+        logger.debug(
+            'Search index updated, added: {}, changed: {}, removed: {}'.format(
+                added, changed, removed
+            )
+        )
+        return added, changed, removed
+
+    def search(self, query: str, limit: int = 10) -> List[Product]:
+        words = tokenize(query)
+        if not words:
+            return []
+
+        with self._lock:
+            scores = None
+            for number, word in enumerate(words):
+                is_last = number == len(words) - 1
+                word_scores = self._match(word, prefix=is_last)
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {
+                        product_id: score + word_scores[product_id]
+                        for product_id, score in scores.items()
+                        if product_id in word_scores
+                    }
+                if not scores:
+                    return []
+            ranked = sorted(
+                scores.items(),
+                key=lambda item: (-item[1], self._products[item[0]].name),
+            )
+            return [self._products[product_id] for product_id, _ in ranked[:limit]]
+
+    def _match(self, word: str, prefix: bool) -> Dict[str, int]:
+        # A partial word ranks lower than a complete one.
+        if not prefix:
+            return {
+                product_id: weight * 2
+                for product_id, weight in self._postings.get(word, {}).items()
+            }
+
+        scores = {}
+        position = bisect_left(self._words, word)
+        while position < len(self._words) and self._words[position].startswith(word):
+            matched_word = self._words[position]
+            weight_factor = 2 if matched_word == word else 1
+            for product_id, weight in self._postings[matched_word].items():
+                scores[product_id] = max(
+                    scores.get(product_id, 0), weight * weight_factor
+                )
+            position += 1
+        return scores
+
+    def _get_weights(self, product: Product) -> Dict[str, int]:
+        weights = {}
+        for field, weight in ProductSearchIndex.field_weights:
+            for word in tokenize(getattr(product, field)):
+                weights[word] = max(weights.get(word, 0), weight)
+        return weights
+
+    def _add(self, product: Product):
+        for word, weight in self._get_weights(product).items():
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = {}
+                insort(self._words, word)
+            postings[product.id] = weight
+
+    def _remove(self, product: Product):
+        for word in self._get_weights(product):
+            postings = self._postings.get(word)
+            if postings is None:
+                continue
+            postings.pop(product.id, None)
+            if not postings:
+                del self._postings[word]
+                del self._words[bisect_left(self._words, word)]
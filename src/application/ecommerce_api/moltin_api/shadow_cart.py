@@ -0,0 +1,400 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, replace
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, List, Tuple, Union
+import logging
+import re
+import time
+
+import redis
+
+from application import fastjson
+from application.database import RedisStorage
+from application.metrics import registry as metrics
+from application.models import CartContentProduct, CartHeader, NewProductInCart
+from application.ecommerce_api.moltin_api.cache import CachedMoltinApi, RedisObjectCache
+from application.ecommerce_api.moltin_api.cart_batch import (
+    CartMutation,
+    CartMutationBatcher,
+)
+from application.ecommerce_api.moltin_api.exceptions import (
+    MoltinApiError,
+    MoltinUnavailable,
+)
+from application.ecommerce_api.moltin_api.moltin import MoltinApiSession
+
+logger = logging.getLogger(__name__)
+
+amount_pattern = re.compile(r'[\d.,]+')
+
+
+def format_amount(formatted_example: Union[str, None], amount: Decimal) -> str:
+    """Format the amount like an other price of the cart, e.g. '$1,475.00'."""
+    formatted_amount = '{:,.2f}'.format(amount)
+    if not formatted_example or not amount_pattern.search(formatted_example):
+        return formatted_amount
+    return amount_pattern.sub(formatted_amount, formatted_example, count=1)
+
+
+def dump_shadow(shadow: Dict) -> str:
+    header = shadow['header']
+    if header is not None:
+        header = asdict(header)
+        if header['created_at'] is not None:
+            header['created_at'] = header['created_at'].isoformat()
+    items = []
+    for item in shadow['items']:
+        item = asdict(item)
+        item['value'] = str(item['value'])
+        items.append(item)
+    return fastjson.dumps({
+        'revision': shadow['revision'],
+        'synced_at': shadow['synced_at'],
+        'header': header,
+        'items': items,
+    })
+
+
+def load_shadow(value: str) -> Dict:
+    shadow = fastjson.loads(value)
+    header = shadow['header']
+    if header is not None:
+        if header['created_at'] is not None:
+            header['created_at'] = datetime.fromisoformat(header['created_at'])
+        shadow['header'] = CartHeader(**header)
+    items = []
+    for item in shadow['items']:
+        item['value'] = Decimal(item['value'])
+        items.append(CartContentProduct(**item))
+    shadow['items'] = items
+    return shadow
+
+
+class ShadowCartMoltinApi(CachedMoltinApi):
+    """
+    CachedMoltinApi which keeps a shadow of every cart in Redis.
+
+    Adding and removing items changes the shadow at once and the change is
+    sent to Moltin in background, carts are shown from the shadow. Changes of
+    one cart made within batch_window seconds are sent together, see
+    apply_cart_mutations.
+
+    The shadow is reconciled with Moltin, i.e. replaced by the cart read from
+    Moltin after all queued changes are sent: when the cart is shown and the
+    shadow is older than reconcile_interval (in background), before checkout
+    (sync_cart) and when the shadow is missing. A change rejected by Moltin
+    drops the shadow, so the next view shows the real cart. A change which
+    failed because Moltin is unavailable is retried sync_retries times first.
+
+    The shadow is changed with an optimistic transaction on its key, so
+    threads and processes changing the same cart do not lose changes and
+    changes of different carts do not wait for each other.
+    """
+
+    key_template = 'moltin:shadow_cart:{}'
+    sync_retries = 3
+    sync_retry_backoff = 0.5
+
+    def __init__(
+            self,
+            session: MoltinApiSession,
+            catalog_ttl: float = 60,
+            catalog_stale_ttl: float = 300,
+            object_cache: Union[RedisObjectCache, None] = None,
+            shadow_ttl: int = 86400,
+            reconcile_interval: float = 300,
+            sync_workers: int = 4,
+            batch_window: float = 0.05,
+            clock: Callable[[], float] = time.time,
+    ):
+        super(ShadowCartMoltinApi, self).__init__(
+            session,
+            catalog_ttl=catalog_ttl,
+            catalog_stale_ttl=catalog_stale_ttl,
+            object_cache=object_cache,
+        )
+        self.shadow_ttl = shadow_ttl
+        self.reconcile_interval = reconcile_interval
+        self.clock = clock
+        self.sync_executors = [
+            ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='cart-sync-{}'.format(number)
+            )
+            for number in range(sync_workers)
+        ]
+        self.cart_batcher = CartMutationBatcher(
+            self._apply_mutations, window=batch_window, workers=sync_workers
+        )
+        self.cart_batcher.start()
+
+    def add_product_to_cart(
+            self, cart_reference: str, product_id: str, quantity: int = 1
+    ) -> NewProductInCart:
+        product = self.get_product_by_id(product_id)
+        if product is None or product.formatted_price_with_tax is None:
+            # Not live or without a price: the shadow cannot show the item,
+            # Moltin adds it or rejects it and the next view reads the cart.
+            self.cart_batcher.flush(cart_reference)
+            new_product = super(ShadowCartMoltinApi, self).add_product_to_cart(
+                cart_reference, product_id, quantity
+            )
+            self._delete_shadow(cart_reference)
+            return new_product
+
+        def add_item(shadow):
+            shadow = shadow or self._new_shadow()
+            item = next(
+                (item for item in shadow['items'] if item.product_id == product_id),
+                None,
+            )
+            if item is None:
+                item = CartContentProduct(
+                    id=product_id,
+                    product_id=product_id,
+                    sku=product.sku,
+                    name=product.name,
+                    description=product.description,
+                    quantity=0,
+                    value=Decimal(0),
+                    formatted_price_with_tax=product.formatted_price_with_tax,
+                    formatted_value_with_tax='',
+                    currency=product.currency,
+                )
+                shadow['items'].append(item)
+            item.quantity += quantity
+            item.value = product.price * item.quantity
+            item.formatted_value_with_tax = format_amount(
+                item.formatted_price_with_tax, item.value
+            )
+            shadow['revision'] += 1
+            return shadow
+
+        shadow = self._update_shadow(cart_reference, add_item)
+        self.cart_batcher.submit(cart_reference, CartMutation.add(product_id, quantity))
+        item_quantity = quantity
+        if shadow is not None:
+            item_quantity = next(
+                item.quantity for item in shadow['items'] if item.product_id == product_id
+            )
+        return NewProductInCart(
+            cart_id=cart_reference, product_id=product_id, quantity=item_quantity
+        )
+
+    def remove_item_from_cart(self, cart_reference: str, item_id: str) -> bool:
+        """
+        Item id is the id of the item in Moltin or, until the cart
+        is reconciled, the id of the product added to the shadow.
+        """
+        removed = {'item_id': item_id, 'product_id': None}
+
+        def remove_item(shadow):
+            removed.update(item_id=item_id, product_id=None)
+            if shadow is None:
+                return None
+            for item in shadow['items']:
+                if item_id in (item.id, item.product_id):
+                    removed['product_id'] = item.product_id
+                    removed['item_id'] = None if item.id == item.product_id else item.id
+                    shadow['items'].remove(item)
+                    shadow['revision'] += 1
+                    return shadow
+            return None
+
+        self._update_shadow(cart_reference, remove_item)
+        self.cart_batcher.submit(cart_reference, CartMutation.remove(**removed))
+        return True
+
+    def get_cart_with_items(
+            self, cart_reference: str
+    ) -> Tuple[CartHeader, List[CartContentProduct]]:
+        shadow = self._load_shadow(cart_reference)
+        if shadow is None or shadow['synced_at'] is None:
+            metrics.increment('cache_requests_total', cache='shadow_cart', result='miss')
+            return self.sync_cart(cart_reference)
+
+        metrics.increment('cache_requests_total', cache='shadow_cart', result='hit')
+        if self.clock() - shadow['synced_at'] > self.reconcile_interval:
+            self.submit_sync(
+                cart_reference, self._reconcile, cart_reference, shadow['revision']
+            )
+        return self._get_shadow_header(cart_reference, shadow), shadow['items']
+
+    def sync_cart(
+            self, cart_reference: str
+    ) -> Tuple[CartHeader, List[CartContentProduct]]:
+        """Wait for the queued changes of the cart and reconcile its shadow."""
+        shadow = self._load_shadow(cart_reference)
+        revision = None if shadow is None else shadow['revision']
+        return self.submit_sync(
+            cart_reference, self._reconcile, cart_reference, revision
+        ).result()
+
+    def shutdown(self):
+        """Send the queued changes and stop the sync threads."""
+        self.cart_batcher.stop()
+        for executor in self.sync_executors:
+            executor.shutdown(wait=True)
+
+    def submit_sync(self, cart_reference: str, func: Callable, *args) -> Future:
+        executor = self.sync_executors[hash(cart_reference) % len(self.sync_executors)]
+        return executor.submit(func, *args)
+
+    def _apply_mutations(self, cart_reference: str, mutations: List[CartMutation]):
+        results = self.apply_cart_mutations(cart_reference, mutations)
+        rejections = [
+            result for result in results if isinstance(result, MoltinApiError)
+        ]
+        if rejections:
+            self._drop_shadow(cart_reference, rejections[0])
+            return results
+
+        failed_mutations = [
+            mutation
+            for mutation, result in zip(mutations, results)
+            if isinstance(result, MoltinUnavailable)
+        ]
+        if failed_mutations:
+            self._retry_mutations(cart_reference, failed_mutations, results)
+        return results
+
+    def _retry_mutations(
+            self, cart_reference: str, mutations: List[CartMutation], results: List
+    ):
+        """Queue changes which failed on a transient error again, with a backoff."""
+        error = next(result for result in results if isinstance(result, Exception))
+        retries = max(mutation.retries for mutation in mutations)
+        if retries >= ShadowCartMoltinApi.sync_retries:
+            self._drop_shadow(cart_reference, error)
+            return
+
+        logger.warning(
+            'Changes of cart {} failed, retry {}: {}'.format(
+                cart_reference, retries + 1, str(error)
+            )
+        )
+        metrics.increment('shadow_cart_retries_total', len(mutations))
+        self.cart_batcher.requeue(
+            cart_reference,
+            [replace(mutation, retries=mutation.retries + 1) for mutation in mutations],
+            delay=ShadowCartMoltinApi.sync_retry_backoff * 2 ** retries,
+        )
+
+    def _reconcile(
+            self, cart_reference: str, revision: Union[int, None]
+    ) -> Tuple[CartHeader, List[CartContentProduct]]:
+        """
+        Replace the shadow by the cart read from Moltin, revision is the one
+        of the shadow when the reconciliation was queued. If the shadow has been
+        changed since then, the change may be not sent yet and the shadow is kept.
+        """
+        self.cart_batcher.flush(cart_reference)
+        header, items = super(ShadowCartMoltinApi, self).get_cart_with_items(
+            cart_reference
+        )
+
+        def replace_shadow(shadow):
+            current_revision = None if shadow is None else shadow['revision']
+            if current_revision != revision:
+                return None
+            return {
+                'revision': revision or 0,
+                'synced_at': self.clock(),
+                'header': header,
+                'items': items,
+            }
+
+        self._update_shadow(cart_reference, replace_shadow)
+        return header, items
+
+    def _new_shadow(self) -> Dict:
+        return {'revision': 0, 'synced_at': None, 'header': None, 'items': []}
+
+    def _get_shadow_header(self, cart_reference: str, shadow: Dict) -> CartHeader:
+        """Header of the last reconciliation with the total of the shadow items."""
+        header = shadow['header']
+        items = shadow['items']
+        if header is None:
+            example = items[0] if items else None
+            header = CartHeader(
+                id=cart_reference,
+                formatted_price_with_tax=getattr(
+                    example, 'formatted_price_with_tax', None
+                ),
+                currency=getattr(example, 'currency', None),
+            )
+        total = sum((item.value for item in items), Decimal(0))
+        return CartHeader(
+            id=header.id,
+            formatted_price_with_tax=format_amount(
+                header.formatted_price_with_tax, total
+            ),
+            currency=header.currency,
+            created_at=header.created_at,
+        )
+
+    def _get_key(self, cart_reference: str) -> str:
+        return ShadowCartMoltinApi.key_template.format(cart_reference)
+
+    def _load_shadow(self, cart_reference: str) -> Union[Dict, None]:
+        key = self._get_key(cart_reference)
+        try:
+            value = RedisStorage.get(key)
+        except redis.RedisError as e:
+            logger.error('Cannot read {} from cache: {}'.format(key, str(e)))
+            return None
+        return self._parse_shadow(key, value)
+
+    def _parse_shadow(self, key: str, value) -> Union[Dict, None]:
+        if value is None:
+            return None
+        try:
+            return load_shadow(value)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error('Cannot deserialize {} from cache: {}'.format(key, str(e)))
+            return None
+
+    def _update_shadow(
+            self, cart_reference: str, update: Callable[[Union[Dict, None]], Dict]
+    ) -> Union[Dict, None]:
+        """
+        Save update(shadow) unless it returns None. The shadow key is watched,
+        update is called again if the shadow has been changed concurrently.
+        """
+        key = self._get_key(cart_reference)
+        try:
+            with RedisStorage.connection.pipeline() as pipeline:
+                while True:
+                    try:
+                        pipeline.watch(key)
+                        shadow = update(self._parse_shadow(key, pipeline.get(key)))
+                        if shadow is None:
+                            pipeline.unwatch()
+                            return None
+                        pipeline.multi()
+                        pipeline.set(key, dump_shadow(shadow), ex=self.shadow_ttl)
+                        pipeline.execute()
+                        return shadow
+                    except redis.WatchError:
+                        metrics.increment('shadow_cart_conflicts_total')
+        except redis.RedisError as e:
+            logger.error('Cannot write {} to cache: {}'.format(key, str(e)))
+            return None
+
+    def _drop_shadow(self, cart_reference: str, error: Exception):
+        logger.error(
+            'Change of cart {} has failed, shadow is dropped: {}'.format(
+                cart_reference, str(error)
+            )
+        )
+        metrics.increment(
+            'errors_total', source='shadow_cart', error=type(error).__name__
+        )
+        self._delete_shadow(cart_reference)
+
+    def _delete_shadow(self, cart_reference: str):
+        key = self._get_key(cart_reference)
+        try:
+            RedisStorage.delete(key)
+        except redis.RedisError as e:
+            logger.error('Cannot delete {} from cache: {}'.format(key, str(e)))
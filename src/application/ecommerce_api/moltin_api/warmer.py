@@ -0,0 +1,208 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import astuple
+from typing import Callable, Dict, List, Tuple, Union
+import logging
+import os
+import threading
+import time
+
+import redis
+
+from application import fastjson
+from application.database import RedisStorage
+from application.metrics import registry as metrics
+from application.models import File, Product
+from application.ecommerce_api.moltin_api.cache import CachedMoltinApi
+from application.ecommerce_api.moltin_api.exceptions import MoltinError
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogSnapshot:
+    """
+    Catalog with the images of its products saved to a file, if path is given,
+    or to Redis. Objects are saved as lists of field values, the key and the
+    file name contain the schema version like those of RedisObjectCache.
+    """
+
+    schema_version = 1
+    key_template = 'moltin:catalog_snapshot:v{}'
+
+    def __init__(
+            self,
+            path: Union[str, None] = None,
+            clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.clock = clock
+
+    def __str__(self):
+        if self.path is not None:
+            return self.get_path()
+        return self.get_key()
+
+    def get_key(self) -> str:
+        return CatalogSnapshot.key_template.format(CatalogSnapshot.schema_version)
+
+    def get_path(self) -> str:
+        return '{}.v{}'.format(self.path, CatalogSnapshot.schema_version)
+
+    def save(self, products: List[Product], files: Dict[str, File]):
+        value = fastjson.dumps({
+            'saved_at': self.clock(),
+            'products': [astuple(product) for product in products],
+            'files': [astuple(file) for file in files.values()],
+        })
+        try:
+            self._write(value)
+        except (OSError, redis.RedisError) as e:
+            logger.error('Cannot save catalog snapshot {}: {}'.format(self, str(e)))
+
+    def load(self) -> Union[Tuple[List[Product], Dict[str, File], float], None]:
+        """Return products, files by id and the age of the snapshot in seconds."""
+        try:
+            value = self._read()
+        except (OSError, redis.RedisError) as e:
+            logger.error('Cannot read catalog snapshot {}: {}'.format(self, str(e)))
+            return None
+        if value is None:
+            return None
+        try:
+            snapshot = fastjson.loads(value)
+            products = [Product(*values) for values in snapshot['products']]
+            files = [File(*values) for values in snapshot['files']]
+            age = max(self.clock() - snapshot['saved_at'], 0)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error(
+                'Cannot deserialize catalog snapshot {}: {}'.format(self, str(e))
+            )
+            return None
+        return products, {file.id: file for file in files}, age
+
+    def _read(self) -> Union[str, None]:
+        if self.path is None:
+            return RedisStorage.get(self.get_key())
+        try:
+            with open(self.get_path(), encoding='utf-8') as snapshot_file:
+                return snapshot_file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, value: str):
+        if self.path is None:
+            RedisStorage.set(self.get_key(), value)
+            return
+        path = self.get_path()
+        # Processes starting meanwhile never read a partly written file.
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary_path, 'w', encoding='utf-8') as snapshot_file:
+            snapshot_file.write(value)
+        os.replace(temporary_path, path)
+
+
+class CatalogWarmer:
+    """
+    Keeps the catalog of CachedMoltinApi warm: every interval seconds fetches
+    the catalog and, with workers threads, the images of its products which are
+    not known yet, then saves both to the snapshot.
+
+    A new process loads the snapshot before it starts to serve users,
+    the catalog from the snapshot is as old as the snapshot, so an outdated
+    one is served as stale and refreshed.
+    """
+
+    def __init__(
+            self,
+            moltin_api: CachedMoltinApi,
+            snapshot: CatalogSnapshot,
+            interval: float = 60,
+            workers: int = 8,
+    ):
+        self.moltin_api = moltin_api
+        self.snapshot = snapshot
+        self.interval = interval
+        self.workers = workers
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def load_snapshot(self) -> bool:
+        started_at = time.perf_counter()
+        snapshot = self.snapshot.load()
+        if snapshot is None:
+            logger.info('Catalog snapshot {} is not found'.format(self.snapshot))
+            return False
+
+        products, files, age = snapshot
+        self.moltin_api.catalog_files = files
+        self.moltin_api.catalog.load(products, age=age)
+        logger.info(
+            'Catalog snapshot loaded in {:.3f}s, products: {}, files: {}, '
+            'age: {:.0f}s'.format(
+                time.perf_counter() - started_at, len(products), len(files), age
+            )
+        )
+        return True
+
+    def warm(self):
+        with metrics.measure('catalog_warm_seconds'):
+            products = self.moltin_api.catalog.refresh()
+            files = self._prefetch_files(products)
+            self.moltin_api.catalog_files = files
+            self.snapshot.save(products, files)
+        logger.debug(
+            'Catalog warmed, products: {}, files: {}'.format(len(products), len(files))
+        )
+
+    def start(self):
+        """Warm the catalog now and then every interval seconds in background."""
+        self._thread = threading.Thread(
+            target=self._run, name='catalog-warmer', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.warm()
+            except MoltinError as e:
+                logger.error('Catalog warming failed: {}'.format(str(e)))
+                metrics.increment(
+                    'errors_total', source='catalog_warmer', error=type(e).__name__
+                )
+            if self._stopped.wait(self.interval):
+                return
+
+    def _prefetch_files(self, products: List[Product]) -> Dict[str, File]:
+        """Images of the products, only new ones are fetched."""
+        known_files = self.moltin_api.catalog_files
+        files = {}
+        missing_file_ids = []
+        for product in products:
+            file_id = product.main_image_id
+            if file_id is None or file_id in files:
+                continue
+            file = known_files.get(file_id)
+            if file is None:
+                missing_file_ids.append(file_id)
+            files[file_id] = file
+
+        with ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='catalog-warmer'
+        ) as executor:
+            fetched_files = executor.map(self._fetch_file, missing_file_ids)
+            for file_id, file in zip(missing_file_ids, fetched_files):
+                files[file_id] = file
+        return {file_id: file for file_id, file in files.items() if file is not None}
+
+    def _fetch_file(self, file_id: str) -> Union[File, None]:
+        try:
+            return self.moltin_api.get_file_by_id(file_id)
+        except MoltinError as e:
+            logger.error('Cannot prefetch file {}: {}'.format(file_id, str(e)))
+            return None
@@ -0,0 +1,15 @@
+import fakeredis
+import pytest
+
+from application.benchmark.fake_moltin import FakeMoltinServer
+from application.database import RedisStorage
+
+
+@pytest.fixture
+def fake_moltin(monkeypatch):
+    """Moltin served over HTTP by FakeMoltinServer, Redis by fakeredis."""
+    monkeypatch.setattr(RedisStorage, 'connection', fakeredis.FakeRedis())
+    server = FakeMoltinServer(catalog_size=5)
+    server.start()
+    yield server
+    server.stop()
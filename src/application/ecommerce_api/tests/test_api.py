@@ -108,3 +108,87 @@ def test_add_product_to_cart_insufficient_stock(
     quantity = 1
     with pytest.raises(MoltinApiError):
         moltin_api.add_product_to_cart(cart_id, product_id, quantity)
+
+
+def test_get_cart_with_items_fetches_in_parallel(mocker, moltin_api_session):
+    def slow_response(value):
+        def wrapped(*args, **kwargs):
+            time.sleep(0.2)
+            return value
+
+        return wrapped
+
+    moltin_api = MoltinApi(moltin_api_session)
+    mocker.patch.object(moltin_api, 'get_cart', side_effect=slow_response('header'))
+    mocker.patch.object(
+        moltin_api, 'get_cart_products', side_effect=slow_response(['item'])
+    )
+
+    started_at = time.monotonic()
+    cart_header, cart_content = moltin_api.get_cart_with_items('cart id')
+    elapsed = time.monotonic() - started_at
+
+    assert cart_header == 'header'
+    assert cart_content == ['item']
+    assert elapsed < 0.35
+
+
+def _make_products_page(data, offset, limit, total):
+    product_dct = data['data'][0]
+    products_dcts = [
+        dict(product_dct, id='product-{}'.format(index))
+        for index in range(offset, min(offset + limit, total))
+    ]
+    return {'data': products_dcts, 'meta': {'results': {'total': total}}}
+
+
+@pytest.fixture
+def products_list_data():
+    filepath = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        'data',
+        'products_list_response.json',
+    )
+    with open(filepath, 'r') as f:
+        return json.loads(f.read())
+
+
+def test_iter_products_streams_pages_lazily(
+    mocker, moltin_api_session, products_list_data
+):
+    def mock_get(url, params):
+        return _make_products_page(
+            products_list_data, params['page[offset]'], params['page[limit]'], 5
+        )
+
+    session_get = mocker.patch.object(
+        moltin_api_session, 'get', side_effect=mock_get
+    )
+    moltin_api = MoltinApi(moltin_api_session)
+
+    products = moltin_api.iter_products(page_size=2)
+    assert next(products).id == 'product-0'
+    assert session_get.call_count == 1
+
+    assert [product.id for product in products] == [
+        'product-1', 'product-2', 'product-3', 'product-4'
+    ]
+    assert session_get.call_count == 3
+
+
+def test_get_all_products_keeps_catalog_order(
+    mocker, moltin_api_session, products_list_data
+):
+    def mock_get(url, params):
+        time.sleep(0.01 * (10 - params['page[offset]']))
+        return _make_products_page(
+            products_list_data, params['page[offset]'], params['page[limit]'], 7
+        )
+
+    mocker.patch.object(moltin_api_session, 'get', side_effect=mock_get)
+    moltin_api = MoltinApi(moltin_api_session)
+
+    products = moltin_api.get_all_products(page_size=2)
+    assert [product.id for product in products] == [
+        'product-{}'.format(index) for index in range(7)
+    ]
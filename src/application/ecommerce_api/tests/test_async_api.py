@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+from aiohttp import web
+
+from application.ecommerce_api.moltin_api.async_moltin import (
+    AsyncMoltinApiSession,
+    AsyncMoltinApi,
+)
+from application.ecommerce_api.moltin_api.parse import parse_products_list_response
+from application.ecommerce_api.moltin_api.exceptions import (
+    MoltinApiError,
+    MoltinUnavailable,
+)
+
+
+def _load_data(filename):
+    filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', filename)
+    with open(filepath, 'r') as f:
+        return json.loads(f.read())
+
+
+class FakeMoltinServer:
+    def __init__(self):
+        self.oauth_calls = 0
+        self.products_calls = 0
+        self.products_data = _load_data('products_list_response.json')
+        self.insufficient_stock_data = _load_data(
+            'add_product_to_cart_insufficient_stock.json'
+        )
+        self.runner = None
+        self.root_url = None
+
+    async def oauth(self, request):
+        self.oauth_calls += 1
+        await asyncio.sleep(0.01)
+        return web.json_response(
+            {'expires': time.time() + 3600, 'access_token': 'fake token'}
+        )
+
+    async def products(self, request):
+        assert request.headers['Authorization'] == 'Bearer: fake token'
+        self.products_calls += 1
+        await asyncio.sleep(0.01)
+        return web.json_response(self.products_data)
+
+    async def add_product_to_cart(self, request):
+        return web.json_response(self.insufficient_stock_data, status=400)
+
+    async def file(self, request):
+        status = int(request.match_info['file_id'])
+        return web.Response(status=status, text='<html>Error</html>')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/oauth/access_token', self.oauth)
+        app.router.add_get('/v2/products', self.products)
+        app.router.add_post('/v2/carts/{cart_id}/items', self.add_product_to_cart)
+        app.router.add_get('/v2/files/{file_id}', self.file)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.root_url = 'http://127.0.0.1:{}'.format(port)
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def _run_with_fake_server(scenario):
+    async def run():
+        server = FakeMoltinServer()
+        await server.start()
+        try:
+            session = AsyncMoltinApiSession(
+                server.root_url, 'fake client id', 'fake client secret', pool_size=10
+            )
+            async with session:
+                return await scenario(server, AsyncMoltinApi(session))
+        finally:
+            await server.stop()
+
+    return asyncio.run(run())
+
+
+def test_get_products_return_products():
+    async def scenario(server, moltin_api):
+        products = await moltin_api.get_products()
+        expected = parse_products_list_response(server.products_data['data'])
+        assert products == expected
+
+    _run_with_fake_server(scenario)
+
+
+def test_concurrent_requests_share_one_access_token_refresh():
+    async def scenario(server, moltin_api):
+        results = await asyncio.gather(
+            *[moltin_api.get_products() for _ in range(50)]
+        )
+        assert len(results) == 50
+        assert server.oauth_calls == 1
+        assert server.products_calls == 50
+
+    _run_with_fake_server(scenario)
+
+
+def test_negative_response_raises_api_error():
+    async def scenario(server, moltin_api):
+        with pytest.raises(MoltinApiError):
+            await moltin_api.add_product_to_cart('cart id', 'product id', 1)
+
+    _run_with_fake_server(scenario)
+
+
+@pytest.mark.parametrize('status, error_cls', [
+    (502, MoltinUnavailable),
+    (404, MoltinApiError),
+])
+def test_non_json_error_response(status, error_cls):
+    async def scenario(server, moltin_api):
+        with pytest.raises(error_cls):
+            await moltin_api.get_file_by_id(str(status))
+
+    _run_with_fake_server(scenario)
+
+
+def test_connection_error_raises_moltin_unavailable():
+    async def scenario():
+        session = AsyncMoltinApiSession('http://127.0.0.1:1', 'id', 'secret')
+        async with session:
+            with pytest.raises(MoltinUnavailable):
+                await AsyncMoltinApi(session).get_products()
+
+    asyncio.run(scenario())
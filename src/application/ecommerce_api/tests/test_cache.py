@@ -0,0 +1,206 @@
+from dataclasses import replace
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from application.models import Product, File
+from application.database import RedisStorage
+from application.ecommerce_api.moltin_api.moltin import MoltinApi, MoltinApiSession
+from application.ecommerce_api.moltin_api.cache import (
+    CatalogCache,
+    CachedMoltinApi,
+    RedisObjectCache,
+)
+
+
+class CountingFetcher:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        time.sleep(self.delay)
+        return [_make_product(str(calls))]
+
+
+def _make_product(product_id):
+    return Product(
+        id=product_id,
+        type='product',
+        name='Product {}'.format(product_id),
+        description='description',
+        slug='product-{}'.format(product_id),
+        sku='sku-{}'.format(product_id),
+        formatted_price_with_tax='$1.00',
+    )
+
+
+@pytest.fixture
+def redis_storage(monkeypatch):
+    monkeypatch.setattr(RedisStorage, 'connection', fakeredis.FakeRedis())
+    return RedisStorage
+
+
+@pytest.fixture
+def moltin_api_session():
+    return MoltinApiSession('http://fakeapi.com', 'client id', 'client secret')
+
+
+def test_fresh_catalog_served_from_cache(clock):
+    fetcher = CountingFetcher()
+    cache = CatalogCache(fetcher, ttl=60, stale_ttl=300, clock=clock)
+
+    first = cache.get_products()
+    clock.now += 30
+    second = cache.get_products()
+
+    assert first == second
+    assert fetcher.calls == 1
+
+
+def test_stale_catalog_served_while_refreshed_in_background(clock):
+    fetcher = CountingFetcher(delay=0.05)
+    cache = CatalogCache(fetcher, ttl=60, stale_ttl=300, clock=clock)
+    stale = cache.get_products()
+
+    clock.now += 120
+    assert cache.get_products() == stale
+    assert cache.get_products() == stale
+
+    with cache._refresh_lock:
+        pass
+    assert fetcher.calls == 2
+    assert cache.get_products()[0].id == '2'
+
+
+def test_expired_catalog_fetched_once_for_concurrent_callers(clock):
+    fetcher = CountingFetcher(delay=0.05)
+    cache = CatalogCache(fetcher, ttl=60, stale_ttl=0, clock=clock)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_products()))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fetcher.calls == 1
+    assert len(results) == 10
+    assert all(result == results[0] for result in results)
+
+
+def test_refresh_listeners_notified(clock):
+    cache = CatalogCache(CountingFetcher(), ttl=60, stale_ttl=0, clock=clock)
+    versions = []
+
+    def failing_listener(version):
+        raise ValueError()
+
+    cache.add_refresh_listener(failing_listener)
+    cache.add_refresh_listener(versions.append)
+    cache.get_products()
+    clock.now += 60
+    cache.get_products()
+
+    assert versions == [1, 2]
+
+
+def test_objects_shared_between_workers_through_redis(
+    mocker, redis_storage, moltin_api_session
+):
+    product = _make_product('1')
+    file = File(type='file', id='f1', link='http://cdn/f1.png', file_name='f1.png')
+    get_product = mocker.patch.object(
+        MoltinApi, 'get_product_by_id', return_value=product
+    )
+    get_file = mocker.patch.object(MoltinApi, 'get_file_by_id', return_value=file)
+
+    first_worker = CachedMoltinApi(moltin_api_session, object_cache=RedisObjectCache())
+    second_worker = CachedMoltinApi(
+        moltin_api_session, object_cache=RedisObjectCache()
+    )
+
+    assert first_worker.get_product_by_id('1') == product
+    assert first_worker.get_file_by_id('f1') == file
+    assert second_worker.get_product_by_id('1') == product
+    assert second_worker.get_file_by_id('f1') == file
+    assert get_product.call_count == 1
+    assert get_file.call_count == 1
+
+
+def test_search_index_follows_catalog_refresh(mocker, moltin_api_session):
+    fetch_catalog = mocker.patch.object(
+        CachedMoltinApi,
+        '_fetch_catalog',
+        side_effect=[[_make_product('1'), _make_product('2')], [_make_product('3')]],
+    )
+    moltin_api = CachedMoltinApi(moltin_api_session)
+
+    assert [product.id for product in moltin_api.search_products('product 2')] == ['2']
+    moltin_api.catalog.invalidate()
+    assert [product.id for product in moltin_api.search_products('product')] == ['3']
+    assert fetch_catalog.call_count == 2
+
+
+def test_search_index_reindexes_changed_products(mocker, moltin_api_session):
+    mocker.patch.object(
+        CachedMoltinApi,
+        '_fetch_catalog',
+        side_effect=[
+            [_make_product('1'), _make_product('2')],
+            [
+                _make_product('1'),
+                replace(_make_product('2'), name='Renamed'),
+                _make_product('3'),
+            ],
+        ],
+    )
+    moltin_api = CachedMoltinApi(moltin_api_session)
+    moltin_api.catalog.refresh()
+    apply_changes = mocker.spy(moltin_api.search_index, 'apply_changes')
+
+    moltin_api.catalog.refresh()
+
+    apply_changes.assert_called_once_with(
+        [_make_product('3'), replace(_make_product('2'), name='Renamed')], []
+    )
+    assert [product.id for product in moltin_api.search_products('renamed')] == ['2']
+
+
+def test_listeners_run_on_expired_catalog(moltin_api_session):
+    moltin_api = CachedMoltinApi(moltin_api_session)
+    # Listeners run under the refresh lock, a listener reading the expired
+    # catalog with get_products would wait for the lock forever.
+    thread = threading.Thread(
+        target=moltin_api.catalog.load,
+        args=([_make_product('1')],),
+        kwargs={'age': 3600},
+        daemon=True,
+    )
+    thread.start()
+    thread.join(timeout=1)
+
+    assert not thread.is_alive()
+    assert moltin_api.search_index.search('product 1') == [_make_product('1')]
+
+
+def test_object_cache_key_is_versioned(redis_storage):
+    cache = RedisObjectCache(ttl=60)
+    file = File(type='file', id='f1', link='http://cdn/f1.png', file_name='f1.png')
+    cache.set('file', 'f1', file)
+
+    key = cache.get_key('file', 'f1')
+    assert key == 'moltin:cache:v{}:file:f1'.format(RedisObjectCache.schema_version)
+    assert 0 < redis_storage.connection.ttl(key) <= 60
+
+    redis_storage.connection.set(key, '{"unknown": "field"}')
+    assert cache.get('file', 'f1', File) is None
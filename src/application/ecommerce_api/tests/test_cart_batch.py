@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+from application.ecommerce_api.moltin_api.cart_batch import (
+    CartMutation,
+    CartMutationBatcher,
+    coalesce_mutations,
+)
+from application.ecommerce_api.moltin_api.exceptions import (
+    MoltinApiError,
+    MoltinUnexpectedFormatResponseError,
+)
+from application.ecommerce_api.moltin_api.moltin import MoltinApi, MoltinApiSession
+
+
+@pytest.fixture
+def moltin_api(fake_moltin):
+    session = MoltinApiSession(fake_moltin.url, 'client id', 'client secret')
+    return MoltinApi(session)
+
+
+def test_coalesce_mutations():
+    coalesced = coalesce_mutations([
+        CartMutation.add('p1', 5),
+        CartMutation.add('p2', 1),
+        CartMutation.add('p1', 5),
+        CartMutation.set_quantity(3, item_id='i1'),
+        CartMutation.remove(item_id='i2'),
+        CartMutation.set_quantity(0, item_id='i1'),
+        CartMutation.add('p1', 1),
+    ])
+
+    assert coalesced == [
+        (CartMutation.add('p1', 10), [0, 2]),
+        (CartMutation.add('p2', 1), [1]),
+        (CartMutation.remove(item_id='i1'), [3, 5]),
+        (CartMutation.remove(item_id='i2'), [4]),
+        (CartMutation.add('p1', 1), [6]),
+    ]
+
+
+def test_apply_cart_mutations(moltin_api, fake_moltin):
+    product_ids = [product['id'] for product in fake_moltin.products[:3]]
+    moltin_api.add_product_to_cart('cart', product_ids[2])
+    requests = fake_moltin.requests
+
+    results = moltin_api.apply_cart_mutations('cart', [
+        CartMutation.add(product_ids[0], 5),
+        CartMutation.add(product_ids[0], 5),
+        CartMutation.add(product_ids[1]),
+        CartMutation.set_quantity(2, product_id=product_ids[1]),
+        CartMutation.remove(product_id=product_ids[2]),
+    ])
+
+    assert fake_moltin.requests == requests + 4
+    assert [result.quantity for result in results[:4]] == [10, 10, 1, 2]
+    assert results[4] is True
+    cart = fake_moltin.carts['cart']
+    assert sorted(
+        (item['product_id'], item['quantity']) for item in cart.values()
+    ) == sorted([(product_ids[0], 10), (product_ids[1], 2)])
+
+
+def test_failed_mutation_does_not_stop_batch(moltin_api, fake_moltin):
+    product_id = fake_moltin.products[0]['id']
+
+    results = moltin_api.apply_cart_mutations('cart', [
+        CartMutation.add('unknown product'),
+        CartMutation.add(product_id),
+    ])
+
+    assert isinstance(results[0], MoltinApiError)
+    assert results[1].product_id == product_id
+
+
+def test_item_missing_in_response_does_not_stop_batch(moltin_api, fake_moltin, mocker):
+    product_ids = [product['id'] for product in fake_moltin.products[:2]]
+    post = moltin_api.session.post
+    responses = [{'data': []}]
+
+    def post_without_item(*args, **kwargs):
+        if responses:
+            return responses.pop(0)
+        return post(*args, **kwargs)
+
+    mocker.patch.object(moltin_api.session, 'post', side_effect=post_without_item)
+
+    results = moltin_api.apply_cart_mutations('cart', [
+        CartMutation.add(product_ids[0]),
+        CartMutation.add(product_ids[1]),
+    ])
+
+    assert isinstance(results[0], MoltinUnexpectedFormatResponseError)
+    assert results[1].product_id == product_ids[1]
+
+
+def test_batcher_applies_mutations_of_window_at_once():
+    batches = []
+    lock = threading.Lock()
+
+    def apply(cart_reference, mutations):
+        with lock:
+            batches.append((cart_reference, len(mutations)))
+        return [mutation.quantity for mutation in mutations]
+
+    batcher = CartMutationBatcher(apply, window=0.05)
+    batcher.start()
+    futures = [batcher.submit('cart', CartMutation.add('p1', number))
+               for number in range(3)]
+    other_cart = batcher.submit('other cart', CartMutation.add('p1'))
+    batcher.flush('cart')
+
+    assert [future.result(timeout=0) for future in futures] == [0, 1, 2]
+    batcher.stop()
+    assert other_cart.result(timeout=0) == 1
+    assert sorted(batches) == [('cart', 3), ('other cart', 1)]
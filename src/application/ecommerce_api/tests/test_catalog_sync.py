@@ -0,0 +1,129 @@
+from dataclasses import replace
+import threading
+import time
+
+from application.models import Product
+from application.ecommerce_api.moltin_api.cache import CachedMoltinApi
+from application.ecommerce_api.moltin_api.catalog_events import CatalogEvents
+from application.ecommerce_api.moltin_api.catalog_sync import get_catalog_changes
+from application.ecommerce_api.moltin_api.moltin import MoltinApiSession
+
+
+def _make_product(product_id, name=None):
+    return Product(
+        id=product_id,
+        type='product',
+        name=name or 'Product {}'.format(product_id),
+        description='description',
+        slug='product-{}'.format(product_id),
+        sku='sku-{}'.format(product_id),
+        formatted_price_with_tax='$1.00',
+    )
+
+
+def create_moltin_api(fake_moltin) -> CachedMoltinApi:
+    session = MoltinApiSession(fake_moltin.url, 'client id', 'client secret')
+    return CachedMoltinApi(session)
+
+
+def test_catalog_changes():
+    old_products = [_make_product(str(number)) for number in range(4)]
+    new_products = [
+        old_products[0],
+        _make_product('1', name='Renamed'),
+        old_products[3],
+        _make_product('4'),
+    ]
+
+    changes = get_catalog_changes(old_products, new_products)
+
+    assert changes.added == ['4']
+    assert changes.changed == ['1']
+    assert changes.changed_indexes == [1]
+    assert changes.removed == ['2']
+    assert changes.moved_from == 2
+    assert not get_catalog_changes(old_products, list(old_products))
+
+
+def test_refresh_parses_only_changed_products(fake_moltin):
+    moltin_api = create_moltin_api(fake_moltin)
+    products = moltin_api.catalog.refresh()
+    version = moltin_api.catalog.version
+
+    assert moltin_api.catalog.refresh() is products
+    assert moltin_api.catalog.version == version
+
+    fake_moltin.update_product('product-1', name='Renamed')
+    new_products = moltin_api.catalog.refresh()
+
+    assert moltin_api.catalog.version == version + 1
+    assert moltin_api.catalog.changes.changed == ['product-1']
+    assert new_products[1].name == 'Renamed'
+    assert all(
+        new_product is product
+        for new_product, product in zip(new_products, products)
+        if product.id != 'product-1'
+    )
+
+
+def test_changes_published_to_other_processes(fake_moltin):
+    first_api = create_moltin_api(fake_moltin)
+    second_api = create_moltin_api(fake_moltin)
+    first_api.catalog.refresh()
+    second_api.catalog.refresh()
+    first_events = CatalogEvents(first_api.catalog, poll_timeout=0.05)
+    second_events = CatalogEvents(second_api.catalog, poll_timeout=0.05)
+    second_events.start()
+    assert second_events.wait_subscribed(timeout=1)
+    requests = fake_moltin.requests
+    version = second_api.catalog.version
+
+    fake_moltin.update_product('product-2', name='Renamed')
+    first_api.catalog.refresh()
+    deadline = time.monotonic() + 1
+    while second_api.catalog.version == version and time.monotonic() < deadline:
+        time.sleep(0.01)
+    second_events.stop()
+
+    assert second_api.catalog.peek_product('product-2').name == 'Renamed'
+    assert second_api.catalog.changes.remote
+    assert [product.id for product in second_api.get_products()] == [
+        product.id for product in first_api.get_products()
+    ]
+    # Only the first process has read the catalog.
+    assert fake_moltin.requests == requests + 1
+    assert first_events.source != second_events.source
+
+
+def test_remote_changes_keep_catalog_age(fake_moltin):
+    moltin_api = create_moltin_api(fake_moltin)
+    products = moltin_api.catalog.refresh()
+    fetched_at = moltin_api.catalog._fetched_at
+
+    moltin_api.catalog.apply_changes(
+        [replace(products[0], name='Renamed'), _make_product('new')], ['product-4']
+    )
+
+    assert [product.id for product in moltin_api.get_products()] == [
+        'product-0', 'product-1', 'product-2', 'product-3', 'new'
+    ]
+    assert moltin_api.catalog.changes.moved_from == 4
+    assert moltin_api.catalog._fetched_at == fetched_at
+
+
+def test_remote_changes_applied_to_expired_catalog(fake_moltin, monkeypatch):
+    moltin_api = create_moltin_api(fake_moltin)
+    products = moltin_api.catalog.refresh()
+    now = moltin_api.catalog.clock()
+    monkeypatch.setattr(moltin_api.catalog, 'clock', lambda: now + 400)
+
+    thread = threading.Thread(
+        target=moltin_api.catalog.apply_changes,
+        args=([replace(products[0], name='Renamed')], []),
+        daemon=True,
+    )
+    thread.start()
+    thread.join(timeout=1)
+
+    assert not thread.is_alive()
+    assert moltin_api.catalog.peek_product('product-0').name == 'Renamed'
@@ -0,0 +1,154 @@
+from types import SimpleNamespace
+import time
+
+import pytest
+import requests
+import requests_mock
+
+from application.ecommerce_api.moltin_api.moltin import MoltinApiSession
+from application.ecommerce_api.moltin_api.cache import CatalogCache
+from application.ecommerce_api.moltin_api.policy import RetryPolicy, CircuitBreaker
+from application.ecommerce_api.moltin_api.exceptions import (
+    MoltinApiError,
+    MoltinCircuitOpen,
+    MoltinUnavailable,
+)
+
+root_url = 'http://fakeapi.com'
+products_url = '{}/v2/products'.format(root_url)
+carts_url = '{}/v2/carts/1/items'.format(root_url)
+
+
+@pytest.fixture
+def sleep(mocker):
+    return mocker.patch('time.sleep')
+
+
+@pytest.fixture
+def circuit_breaker(clock):
+    return CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+
+
+@pytest.fixture
+def moltin_api_session(circuit_breaker):
+    session = MoltinApiSession(
+        root_url,
+        'fake client id',
+        'fake client secret',
+        retry_policy=RetryPolicy(max_retries=2),
+        circuit_breaker=circuit_breaker,
+    )
+    session.access_token = 'access_token'
+    session.access_token_expires_in = time.time() + 1000
+    return session
+
+
+def test_get_retried_on_server_error(moltin_api_session, sleep):
+    with requests_mock.Mocker() as m:
+        m.get(
+            products_url,
+            [{'status_code': 503}, {'status_code': 200, 'json': {'data': []}}],
+        )
+        assert moltin_api_session.get('v2/products') == {'data': []}
+        assert m.call_count == 2
+        assert m.request_history[0].timeout == moltin_api_session.timeout
+
+
+def test_retry_after_respected(moltin_api_session, sleep):
+    with requests_mock.Mocker() as m:
+        m.post(
+            carts_url,
+            [
+                {'status_code': 429, 'headers': {'Retry-After': '2'}},
+                {'status_code': 201, 'json': {'data': []}},
+            ],
+        )
+        assert moltin_api_session.post('v2/carts/1/items', json={}) == {'data': []}
+        sleep.assert_called_once_with(2.0)
+
+
+def test_post_not_retried_on_server_error(moltin_api_session, sleep):
+    with requests_mock.Mocker() as m:
+        m.post(carts_url, status_code=500)
+        with pytest.raises(MoltinUnavailable):
+            moltin_api_session.post('v2/carts/1/items', json={})
+        assert m.call_count == 1
+
+
+def test_client_error_not_retried(moltin_api_session, sleep):
+    with requests_mock.Mocker() as m:
+        m.get(
+            products_url,
+            status_code=404,
+            json={'errors': [{'status': 404, 'title': 'Not found'}]},
+        )
+        with pytest.raises(MoltinApiError):
+            moltin_api_session.get('v2/products')
+        assert m.call_count == 1
+        assert moltin_api_session.circuit_breaker.failures == 0
+
+
+def test_circuit_opens_and_fails_fast(moltin_api_session, circuit_breaker, sleep):
+    with requests_mock.Mocker() as m:
+        m.get(products_url, exc=requests.ConnectTimeout)
+        for _ in range(2):
+            with pytest.raises(MoltinUnavailable):
+                moltin_api_session.get('v2/products')
+        calls = m.call_count
+
+        with pytest.raises(MoltinCircuitOpen):
+            moltin_api_session.get('v2/products')
+        assert m.call_count == calls
+
+        circuit_breaker.clock.now += 30
+        m.get(products_url, status_code=200, json={'data': []})
+        assert moltin_api_session.get('v2/products') == {'data': []}
+        assert circuit_breaker.state == CircuitBreaker.STATE_CLOSED
+
+
+def test_failed_trial_request_opens_circuit_again(circuit_breaker):
+    for _ in range(2):
+        circuit_breaker.record_failure()
+    circuit_breaker.clock.now += 30
+
+    circuit_breaker.before_request()
+    circuit_breaker.record_failure()
+
+    with pytest.raises(MoltinCircuitOpen):
+        circuit_breaker.before_request()
+
+
+def test_unexpected_error_ends_trial_request(
+        moltin_api_session, circuit_breaker, sleep
+):
+    for _ in range(2):
+        circuit_breaker.record_failure()
+    circuit_breaker.clock.now += 30
+
+    with requests_mock.Mocker() as m:
+        m.get(products_url, exc=requests.TooManyRedirects)
+        with pytest.raises(requests.TooManyRedirects):
+            moltin_api_session.get('v2/products')
+        assert circuit_breaker.state == CircuitBreaker.STATE_OPEN
+
+        circuit_breaker.clock.now += 30
+        m.get(products_url, status_code=200, json={'data': []})
+        assert moltin_api_session.get('v2/products') == {'data': []}
+        assert circuit_breaker.state == CircuitBreaker.STATE_CLOSED
+
+
+def test_expired_catalog_served_while_moltin_unavailable(clock):
+    product = SimpleNamespace(id='product id')
+    responses = [[product], MoltinCircuitOpen()]
+
+    def fetch_products():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    cache = CatalogCache(fetch_products, ttl=60, stale_ttl=0, clock=clock)
+    assert cache.get_products() == [product]
+
+    clock.now += 120
+    assert cache.get_products() == [product]
@@ -0,0 +1,100 @@
+import time
+
+import pytest
+import requests_mock
+
+from application.ecommerce_api.moltin_api.moltin import MoltinApiSession
+from application.ecommerce_api.moltin_api.ratelimit import (
+    TokenBucket,
+    MoltinRateLimiter,
+)
+from application.ecommerce_api.moltin_api.policy import CircuitBreaker
+from application.ecommerce_api.moltin_api.exceptions import MoltinRateLimited
+
+
+def test_token_bucket_queues_callers_when_empty(clock):
+    bucket = TokenBucket(rate=10, capacity=2, clock=clock, sleep=clock.sleep)
+
+    waits = [bucket.acquire(max_wait=1) for _ in range(4)]
+
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.1)
+    assert waits[3] == pytest.approx(0.1)
+    assert clock.now == pytest.approx(1000.2)
+
+
+def test_token_bucket_fails_when_wait_too_long(clock):
+    bucket = TokenBucket(rate=1, capacity=1, clock=clock, sleep=clock.sleep)
+    bucket.acquire(max_wait=0.5)
+
+    with pytest.raises(MoltinRateLimited):
+        bucket.acquire(max_wait=0.5)
+
+    clock.now += 1
+    assert bucket.acquire(max_wait=0.5) == 0.0
+
+
+def test_limiter_buckets_per_endpoint_class(clock):
+    limiter = MoltinRateLimiter(
+        {'cart': TokenBucket(rate=1, capacity=1, clock=clock, sleep=clock.sleep)},
+        max_wait=0,
+    )
+
+    limiter.acquire('http://fakeapi.com/v2/carts/1/items')
+    with pytest.raises(MoltinRateLimited):
+        limiter.acquire('http://fakeapi.com/v2/carts/1')
+    assert limiter.acquire('http://fakeapi.com/v2/products') == 0.0
+
+    stats = limiter.get_stats()
+    assert stats['cart']['requests'] == 1
+    assert stats['cart']['rejected'] == 1
+
+
+def test_session_waits_for_rate_limiter(clock):
+    limiter = MoltinRateLimiter(
+        {'catalog': TokenBucket(rate=10, capacity=1, clock=clock, sleep=clock.sleep)}
+    )
+    session = MoltinApiSession(
+        'http://fakeapi.com', 'client id', 'client secret', rate_limiter=limiter
+    )
+    session.access_token = 'access_token'
+    session.access_token_expires_in = time.time() + 1000
+
+    with requests_mock.Mocker() as m:
+        m.get('http://fakeapi.com/v2/products', json={'data': []})
+        for _ in range(3):
+            session.get('v2/products')
+
+    stats = limiter.get_stats()['catalog']
+    assert stats['requests'] == 3
+    assert stats['wait_total'] == pytest.approx(0.2)
+
+
+def test_throttled_trial_request_keeps_circuit_usable(clock):
+    limiter = MoltinRateLimiter(
+        {'catalog': TokenBucket(rate=1, capacity=1, clock=clock, sleep=clock.sleep)},
+        max_wait=0.5,
+    )
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    session = MoltinApiSession(
+        'http://fakeapi.com',
+        'client id',
+        'client secret',
+        rate_limiter=limiter,
+        circuit_breaker=circuit_breaker,
+    )
+    session.access_token = 'access_token'
+    session.access_token_expires_in = time.time() + 1000
+    circuit_breaker.record_failure()
+    clock.now += 30
+
+    with requests_mock.Mocker() as m:
+        m.get('http://fakeapi.com/v2/products', json={'data': []})
+        limiter.acquire('http://fakeapi.com/v2/products')
+        with pytest.raises(MoltinRateLimited):
+            session.get('v2/products')
+        assert circuit_breaker.state == CircuitBreaker.STATE_OPEN
+
+        clock.now += 1
+        assert session.get('v2/products') == {'data': []}
+    assert circuit_breaker.state == CircuitBreaker.STATE_CLOSED
@@ -0,0 +1,73 @@
+from dataclasses import replace
+
+from application.models import Product
+from application.ecommerce_api.moltin_api.search import ProductSearchIndex
+
+
+def make_product(product_id, name, description='', sku='', slug=''):
+    return Product(
+        id=product_id,
+        type='product',
+        name=name,
+        description=description,
+        slug=slug or product_id,
+        sku=sku or product_id.upper(),
+    )
+
+
+def make_index():
+    index = ProductSearchIndex()
+    index.update([
+        make_product('1', 'Green tea', 'Loose leaf tea from China'),
+        make_product('2', 'Black tea', 'Strong breakfast tea', sku='BT-200'),
+        make_product('3', 'Teapot', 'Glass pot for green tea'),
+        make_product('4', 'Coffee', 'Arabica beans'),
+    ])
+    return index
+
+
+def test_search_ranks_name_matches_first():
+    index = make_index()
+
+    names = [product.name for product in index.search('green tea')]
+
+    assert names == ['Green tea', 'Teapot']
+
+
+def test_last_word_matches_prefix():
+    index = make_index()
+
+    assert [product.id for product in index.search('tea')] == ['2', '1', '3']
+    assert [product.id for product in index.search('te')] == ['2', '1', '3']
+    assert [product.id for product in index.search('bt 20')] == ['2']
+    assert index.search('tea coff') == []
+
+
+def test_update_reindexes_changes_only():
+    index = make_index()
+    products = [
+        make_product('1', 'Green tea', 'Loose leaf tea from China'),
+        replace(make_product('2', 'Black tea', sku='BT-200'), name='Earl Grey'),
+        make_product('5', 'Matcha', 'Powdered green tea'),
+    ]
+
+    assert index.update(products) == (1, 1, 2)
+
+    assert len(index) == 3
+    assert [product.id for product in index.search('green')] == ['1', '5']
+    assert index.search('black') == []
+    assert index.search('teapot') == []
+    assert [product.name for product in index.search('earl')] == ['Earl Grey']
+
+
+def test_apply_changes_keeps_words_sorted():
+    index = make_index()
+
+    changes = index.apply_changes(
+        [make_product('5', 'Matcha', 'Powdered green tea')], ['4', 'unknown']
+    )
+
+    assert changes == (1, 0, 1)
+    assert index._words == sorted(index._postings)
+    assert [product.id for product in index.search('matc')] == ['5']
+    assert index.search('coff') == []
@@ -1,3 +1,5 @@
+import logging
+import threading
 import time
 import pytest
 
@@ -8,6 +10,7 @@ from application.ecommerce_api.moltin_api.moltin import MoltinApiSession
 from application.ecommerce_api.moltin_api.exceptions import (
     MoltinApiError,
     MoltinUnavailable,
+    MoltinUnexpectedFormatResponseError,
 )
 
 
@@ -63,3 +66,156 @@ def test_requests_exception_raises_motlin_unavailable_error(moltin_api_session):
         m.post(oath_url, exc=requests.ConnectionError)
         with pytest.raises(MoltinUnavailable):
             moltin_api_session._update_access_token()
+
+
+def test_expired_access_token_refreshed_once_for_concurrent_requests(
+    moltin_api_session
+):
+    root_url = 'http://fakeapi.com'
+    oath_url = '{}/{}'.format(root_url, MoltinApiSession.oauth_url)
+    products_url = '{}/v2/products'.format(root_url)
+
+    with requests_mock.Mocker() as m:
+        m.post(
+            oath_url,
+            status_code=200,
+            json={'expires': time.time() + 3600, 'access_token': 'fake token'},
+        )
+        m.get(products_url, status_code=200, json={'data': []})
+
+        threads = [
+            threading.Thread(target=moltin_api_session.get, args=('v2/products',))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        oauth_requests = [r for r in m.request_history if r.url == oath_url]
+        assert len(oauth_requests) == 1
+        assert m.call_count == 11
+
+
+def test_access_token_about_to_expire_is_refreshed_before_request(
+    moltin_api_session
+):
+    root_url = 'http://fakeapi.com'
+    oath_url = '{}/{}'.format(root_url, MoltinApiSession.oauth_url)
+    moltin_api_session.access_token = 'old token'
+    moltin_api_session.access_token_expires_in = time.time() + 5
+
+    with requests_mock.Mocker() as m:
+        m.post(
+            oath_url,
+            status_code=200,
+            json={'expires': time.time() + 3600, 'access_token': 'new token'},
+        )
+        m.get('{}/v2/products'.format(root_url), status_code=200, json={'data': []})
+
+        moltin_api_session.get('v2/products')
+
+        assert m.request_history[0].url == oath_url
+        assert m.request_history[1].headers['Authorization'] == 'Bearer: new token'
+
+
+def test_rejected_access_token_refreshed_and_request_retried(moltin_api_session):
+    root_url = 'http://fakeapi.com'
+    oath_url = '{}/{}'.format(root_url, MoltinApiSession.oauth_url)
+    moltin_api_session.access_token = 'revoked token'
+    moltin_api_session.access_token_expires_in = time.time() + 3600
+
+    with requests_mock.Mocker() as m:
+        m.post(
+            oath_url,
+            status_code=200,
+            json={'expires': time.time() + 3600, 'access_token': 'new token'},
+        )
+        m.get(
+            '{}/v2/products'.format(root_url),
+            [
+                {
+                    'status_code': 401,
+                    'json': {'errors': [{'status': 401, 'title': 'Unauthorized'}]},
+                },
+                {'status_code': 200, 'json': {'data': []}},
+            ],
+        )
+
+        assert moltin_api_session.get('v2/products') == {'data': []}
+        assert moltin_api_session.access_token == 'new token'
+        assert m.call_count == 3
+
+
+@pytest.fixture
+def authorized_session(moltin_api_session):
+    moltin_api_session.access_token = 'access_token'
+    moltin_api_session.access_token_expires_in = time.time() + 1000
+    return moltin_api_session
+
+
+def test_response_logged_truncated(authorized_session, caplog, monkeypatch):
+    monkeypatch.setattr(MoltinApiSession, 'response_log_limit', 20)
+    caplog.set_level(logging.DEBUG, logger='application.ecommerce_api.moltin_api')
+
+    with requests_mock.Mocker() as m:
+        m.get('http://fakeapi.com/v2/products', json={'data': ['product'] * 100})
+        authorized_session.get('v2/products')
+
+    summary, body = caplog.records
+    assert summary.moltin_request['status'] == 200
+    assert summary.moltin_request['bytes'] > 20
+    assert body.getMessage() == (
+        'Response from http://fakeapi.com/v2/products: '
+        '{"data": ["product",... (1110 bytes in total)'
+    )
+
+
+def test_response_body_not_logged_when_not_sampled(
+        authorized_session, caplog, monkeypatch
+):
+    monkeypatch.setattr(MoltinApiSession, 'response_log_sample_rate', 0)
+    caplog.set_level(logging.DEBUG, logger='application.ecommerce_api.moltin_api')
+
+    with requests_mock.Mocker() as m:
+        m.get('http://fakeapi.com/v2/products', json={'data': []})
+        authorized_session.get('v2/products')
+
+    assert [record.getMessage() for record in caplog.records] == [
+        'get http://fakeapi.com/v2/products status: 200, bytes: 12, elapsed: 0.000s'
+    ]
+
+
+def test_response_not_formatted_without_debug(authorized_session, caplog, mocker):
+    caplog.set_level(logging.INFO)
+    log_response = mocker.patch(
+        'application.ecommerce_api.moltin_api.moltin.log_response'
+    )
+
+    with requests_mock.Mocker() as m:
+        m.get('http://fakeapi.com/v2/products', json={'data': []})
+        assert authorized_session.get('v2/products') == {'data': []}
+
+    log_response.assert_not_called()
+    assert caplog.records == []
+
+
+def test_non_json_error_response(authorized_session):
+    with requests_mock.Mocker() as m:
+        m.get(
+            'http://fakeapi.com/v2/products',
+            status_code=404,
+            reason='Not Found',
+            text='<html>Not found</html>',
+        )
+        with pytest.raises(MoltinApiError) as error_info:
+            authorized_session.get('v2/products')
+
+    assert (error_info.value.code, error_info.value.title) == (404, 'Not Found')
+
+
+def test_non_json_success_response(authorized_session):
+    with requests_mock.Mocker() as m:
+        m.get('http://fakeapi.com/v2/products', status_code=200, text='OK')
+        with pytest.raises(MoltinUnexpectedFormatResponseError):
+            authorized_session.get('v2/products')
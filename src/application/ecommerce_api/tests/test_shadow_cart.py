@@ -0,0 +1,172 @@
+from dataclasses import replace
+from decimal import Decimal
+import threading
+
+import pytest
+
+from application.database import RedisStorage
+from application.ecommerce_api.moltin_api.exceptions import (
+    MoltinApiError,
+    MoltinCircuitOpen,
+    MoltinUnavailable,
+)
+from application.ecommerce_api.moltin_api.moltin import MoltinApiSession
+from application.ecommerce_api.moltin_api.shadow_cart import (
+    ShadowCartMoltinApi,
+    format_amount,
+)
+
+
+@pytest.fixture
+def moltin_api(fake_moltin):
+    session = MoltinApiSession(fake_moltin.url, 'client id', 'client secret')
+    api = ShadowCartMoltinApi(session, sync_workers=2)
+    yield api
+    api.shutdown()
+
+
+def test_format_amount():
+    assert format_amount('$1,475.00', Decimal('2950')) == '$2,950.00'
+    assert format_amount('12.50 EUR', Decimal('25')) == '25.00 EUR'
+    assert format_amount(None, Decimal('3.5')) == '3.50'
+
+
+def test_cart_loop_served_from_shadow(moltin_api, fake_moltin):
+    products = moltin_api.get_products()
+    moltin_api.get_cart_with_items('chat')
+    requests = fake_moltin.requests
+
+    moltin_api.add_product_to_cart('chat', products[0].id)
+    moltin_api.add_product_to_cart('chat', products[1].id)
+    moltin_api.add_product_to_cart('chat', products[0].id)
+    header, items = moltin_api.get_cart_with_items('chat')
+
+    assert [(item.product_id, item.quantity) for item in items] == [
+        (products[0].id, 2), (products[1].id, 1)
+    ]
+    assert items[0].value == products[0].price * 2
+    assert header.price == products[0].price * 2 + products[1].price
+
+    moltin_api.shutdown()
+    # Changes are sent in one batch, the cart is not read back.
+    assert fake_moltin.requests == requests + 2
+    moltin_cart = fake_moltin.carts['chat']
+    assert sorted(item['quantity'] for item in moltin_cart.values()) == [1, 2]
+
+
+def test_remove_not_reconciled_product(moltin_api, fake_moltin):
+    product = moltin_api.get_products()[0]
+    moltin_api.get_cart_with_items('chat')
+
+    moltin_api.add_product_to_cart('chat', product.id)
+    moltin_api.remove_item_from_cart('chat', product.id)
+
+    assert moltin_api.get_cart_with_items('chat')[1] == []
+    header, items = moltin_api.sync_cart('chat')
+    assert items == []
+    assert fake_moltin.carts['chat'] == {}
+
+
+def test_reconciled_items_have_moltin_ids(moltin_api):
+    product = moltin_api.get_products()[0]
+    moltin_api.add_product_to_cart('chat', product.id)
+
+    header, items = moltin_api.get_cart_with_items('chat')
+
+    assert [item.id for item in items] == ['item-{}'.format(product.id)]
+    moltin_api.remove_item_from_cart('chat', items[0].id)
+    header, items = moltin_api.sync_cart('chat')
+    assert items == []
+    assert header.formatted_price_with_tax == '$0.00'
+
+
+def test_rejected_change_drops_shadow(moltin_api, mocker):
+    product = moltin_api.get_products()[0]
+    moltin_api.get_cart_with_items('chat')
+    mocker.patch.object(
+        moltin_api.session,
+        'post',
+        side_effect=MoltinApiError('url', 400, 'Insufficient stock', 'Out of stock'),
+    )
+
+    moltin_api.add_product_to_cart('chat', product.id)
+    moltin_api.cart_batcher.flush('chat')
+
+    assert RedisStorage.get(ShadowCartMoltinApi.key_template.format('chat')) is None
+    assert moltin_api.get_cart_with_items('chat')[1] == []
+
+
+def test_change_retried_while_moltin_unavailable(moltin_api, fake_moltin, monkeypatch):
+    monkeypatch.setattr(ShadowCartMoltinApi, 'sync_retry_backoff', 0.01)
+    product = moltin_api.get_products()[0]
+    moltin_api.get_cart_with_items('chat')
+    post = moltin_api.session.post
+    failures = [MoltinUnavailable(), MoltinCircuitOpen()]
+
+    def flaky_post(*args, **kwargs):
+        if failures:
+            raise failures.pop(0)
+        return post(*args, **kwargs)
+
+    monkeypatch.setattr(moltin_api.session, 'post', flaky_post)
+    moltin_api.add_product_to_cart('chat', product.id)
+    header, items = moltin_api.sync_cart('chat')
+
+    assert [(item.product_id, item.quantity) for item in items] == [(product.id, 1)]
+    assert RedisStorage.get(ShadowCartMoltinApi.key_template.format('chat')) is not None
+
+
+def test_change_dropped_after_retries(moltin_api, mocker, monkeypatch):
+    monkeypatch.setattr(ShadowCartMoltinApi, 'sync_retry_backoff', 0.01)
+    product = moltin_api.get_products()[0]
+    moltin_api.get_cart_with_items('chat')
+    post = mocker.patch.object(
+        moltin_api.session, 'post', side_effect=MoltinUnavailable()
+    )
+
+    moltin_api.add_product_to_cart('chat', product.id)
+    moltin_api.cart_batcher.flush('chat')
+
+    assert post.call_count == ShadowCartMoltinApi.sync_retries + 1
+    assert RedisStorage.get(ShadowCartMoltinApi.key_template.format('chat')) is None
+
+
+def test_concurrent_changes_of_cart_kept(moltin_api):
+    product = moltin_api.get_products()[0]
+    moltin_api.get_cart_with_items('chat')
+
+    def add_products():
+        for _ in range(10):
+            moltin_api.add_product_to_cart('chat', product.id)
+
+    threads = [threading.Thread(target=add_products) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    header, items = moltin_api.get_cart_with_items('chat')
+    assert [(item.product_id, item.quantity) for item in items] == [(product.id, 40)]
+
+
+def test_product_without_price_added_in_moltin(moltin_api, fake_moltin, mocker):
+    product = moltin_api.get_products()[0]
+    moltin_api.get_cart_with_items('chat')
+    mocker.patch.object(
+        moltin_api,
+        'get_product_by_id',
+        return_value=replace(product, formatted_price_with_tax=None),
+    )
+
+    new_product = moltin_api.add_product_to_cart('chat', product.id)
+
+    assert new_product.quantity == 1
+    assert RedisStorage.get(ShadowCartMoltinApi.key_template.format('chat')) is None
+    assert len(fake_moltin.carts['chat']) == 1
+
+
+def test_product_not_live_rejected_by_moltin(moltin_api, mocker):
+    mocker.patch.object(moltin_api, 'get_product_by_id', return_value=None)
+
+    with pytest.raises(MoltinApiError):
+        moltin_api.add_product_to_cart('chat', 'unknown')
@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+from application.ecommerce_api.moltin_api.cache import CachedMoltinApi
+from application.ecommerce_api.moltin_api.moltin import MoltinApiSession
+from application.ecommerce_api.moltin_api.warmer import CatalogSnapshot, CatalogWarmer
+
+
+def create_moltin_api(fake_moltin) -> CachedMoltinApi:
+    session = MoltinApiSession(fake_moltin.url, 'client id', 'client secret')
+    return CachedMoltinApi(session)
+
+
+@pytest.mark.parametrize('in_file', [False, True])
+def test_new_process_starts_from_snapshot(fake_moltin, tmp_path, in_file):
+    path = str(tmp_path / 'catalog') if in_file else None
+    warmer = CatalogWarmer(create_moltin_api(fake_moltin), CatalogSnapshot(path))
+    warmer.warm()
+    requests = fake_moltin.requests
+
+    moltin_api = create_moltin_api(fake_moltin)
+    assert CatalogWarmer(moltin_api, CatalogSnapshot(path)).load_snapshot()
+
+    products = moltin_api.get_products()
+    file = moltin_api.get_file_by_id(products[0].main_image_id)
+    assert len(products) == 5
+    assert file.id == products[0].main_image_id
+    assert moltin_api.search_products(products[0].name)[0] == products[0]
+    assert fake_moltin.requests == requests
+
+
+def test_warm_fetches_only_new_files(fake_moltin):
+    moltin_api = create_moltin_api(fake_moltin)
+    warmer = CatalogWarmer(moltin_api, CatalogSnapshot(), workers=2)
+    warmer.warm()
+    requests = fake_moltin.requests
+
+    warmer.warm()
+
+    assert len(moltin_api.catalog_files) == 5
+    # The catalog page is fetched again, images are not.
+    assert fake_moltin.requests == requests + 1
+
+
+def test_missing_snapshot(fake_moltin, tmp_path):
+    moltin_api = create_moltin_api(fake_moltin)
+    snapshot = CatalogSnapshot(str(tmp_path / 'catalog'))
+    assert not CatalogWarmer(moltin_api, snapshot).load_snapshot()
+    assert not CatalogWarmer(moltin_api, CatalogSnapshot()).load_snapshot()
+
+
+def test_old_snapshot_is_served_as_stale(fake_moltin):
+    clock = [1000.0]
+    snapshot = CatalogSnapshot(clock=lambda: clock[0])
+    CatalogWarmer(create_moltin_api(fake_moltin), snapshot).warm()
+    clock[0] += 120
+
+    moltin_api = create_moltin_api(fake_moltin)
+    CatalogWarmer(moltin_api, snapshot).load_snapshot()
+
+    assert moltin_api.catalog.clock() - moltin_api.catalog._fetched_at >= 120
+
+
+def test_expired_snapshot_is_loaded(fake_moltin):
+    clock = [1000.0]
+    snapshot = CatalogSnapshot(clock=lambda: clock[0])
+    CatalogWarmer(create_moltin_api(fake_moltin), snapshot).warm()
+    clock[0] += 3600
+
+    moltin_api = create_moltin_api(fake_moltin)
+    warmer = CatalogWarmer(moltin_api, snapshot)
+    loaded = []
+    thread = threading.Thread(
+        target=lambda: loaded.append(warmer.load_snapshot()), daemon=True
+    )
+    thread.start()
+    thread.join(timeout=1)
+
+    assert loaded == [True]
+    # Older than ttl + stale_ttl, so the next reader fetches the catalog.
+    requests = fake_moltin.requests
+    assert len(moltin_api.get_products()) == 5
+    assert fake_moltin.requests > requests
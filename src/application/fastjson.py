@@ -0,0 +1,34 @@
+"""
+JSON with the fastest available backend: orjson, ujson or the standard
+json module. Both backends are optional, install one of them to speed up
+parsing of large Moltin responses. Decoding errors are raised as ValueError.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _orjson_dumps(obj) -> str:
+    return orjson.dumps(obj).decode('utf-8')
+
+
+if orjson is not None:
+    backend = 'orjson'
+    loads = orjson.loads
+    dumps = _orjson_dumps
+elif ujson is not None:
+    backend = 'ujson'
+    loads = ujson.loads
+    dumps = ujson.dumps
+else:
+    backend = 'json'
+    loads = json.loads
+    dumps = json.dumps
@@ -0,0 +1,260 @@
+"""
+In-process metrics: counters and latency histograms which are exposed
+in Prometheus text format by MetricsServer or logged by MetricsDumper.
+Metrics are disabled by default, then instrumentation costs one attribute check.
+"""
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels_key(labels: Dict) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: Tuple, extra: Tuple = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels
+    ))
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+
+class MetricsRegistry:
+    """
+    Collects counters and histograms by name and labels.
+    Collectors are functions which return (name, type, labels, value) samples
+    of components keeping their own statistics, they are called on render.
+    """
+
+    def __init__(self, buckets: Tuple = DEFAULT_BUCKETS):
+        self.enabled = False
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def measure(self, name: str, **labels):
+        """Context manager which observes the duration of its block in seconds."""
+        if not self.enabled:
+            return nullcontext()
+        return self._measure(name, labels)
+
+    @contextmanager
+    def _measure(self, name: str, labels: Dict):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started_at, **labels)
+
+    def timed(self, name: str, **labels):
+        """
+        Decorator which observes the duration of calls,
+        the name of the function is added as the method label.
+        Raised exceptions are counted in errors_total.
+        """
+
+        def decorator(func):
+            func_labels = dict(labels, method=func.__name__)
+
+            @wraps(func)
+            def wrapped(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                started_at = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    self.increment(
+                        'errors_total', source=name, error=type(e).__name__, **func_labels
+                    )
+                    raise
+                finally:
+                    self.observe(name, time.perf_counter() - started_at, **func_labels)
+
+            return wrapped
+
+        return decorator
+
+    def register_collector(self, collector: Callable[[], List[Tuple]]):
+        self.collectors.append(collector)
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, (list(histogram.counts), histogram.sum, histogram.count))
+                for key, histogram in self.histograms.items()
+            )
+
+        lines = []
+        typed = set()
+
+        def add_type(name, metric_type):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} {}'.format(name, metric_type))
+
+        for (name, labels), value in counters:
+            add_type(name, 'counter')
+            lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+
+        for (name, labels), (counts, total, count) in histograms:
+            add_type(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(labels, (('le', bound),)), cumulative
+                ))
+            lines.append('{}_bucket{} {}'.format(
+                name, _format_labels(labels, (('le', '+Inf'),)), count
+            ))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels), total))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), count))
+
+        for collector in self.collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.error('Metrics collector failed: {}'.format(str(e)))
+                continue
+            for name, metric_type, labels, value in samples:
+                add_type(name, metric_type)
+                lines.append('{}{} {}'.format(
+                    name, _format_labels(_labels_key(labels)), value
+                ))
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        content = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """Serves metrics of the registry at /metrics."""
+
+    def __init__(
+            self,
+            registry: MetricsRegistry = registry,
+            listen: str = '0.0.0.0',
+            port: int = 9100,
+    ):
+        self.httpd = ThreadingHTTPServer((listen, port), MetricsRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, name='metrics-server', daemon=True
+        )
+        self._thread.start()
+        logger.debug('Metrics server started on port {}'.format(self.port))
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class MetricsDumper:
+    """Logs metrics of the registry every interval seconds."""
+
+    def __init__(self, registry: MetricsRegistry = registry, interval: float = 60):
+        self.registry = registry
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='metrics-dumper', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            logger.info('Metrics:\n{}'.format(self.registry.render()))
@@ -1,12 +1,41 @@
 from datetime import datetime
 from typing import Union
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from decimal import Decimal
+from functools import lru_cache
 import re
 
 from application.database import RedisStorage
 
+price_not_allowed_characters = re.compile(r'[^\d.]')
 
+
+@lru_cache(maxsize=4096)
+def parse_price(formatted_price: str) -> Decimal:
+    """
+    Decimal value of a formatted price like '$1,475.00'.
+    A catalog has few distinct prices, so results are cached.
+    """
+    return Decimal(price_not_allowed_characters.sub('', formatted_price))
+
+
+def slotted(cls):
+    """
+    Recreate a dataclass with __slots__ instead of __dict__: instances take
+    less memory and attribute access is faster. Defaults of the fields are
+    kept by the generated __init__, so the class attributes may be dropped.
+    """
+    field_names = tuple(field.name for field in fields(cls))
+    cls_dict = {
+        name: value
+        for name, value in cls.__dict__.items()
+        if name not in field_names and name not in ('__dict__', '__weakref__')
+    }
+    cls_dict['__slots__'] = field_names
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
+@slotted
 @dataclass
 class Product:
     id: str
@@ -21,9 +50,10 @@ class Product:
 
     @property
     def price(self) -> Decimal:
-        return Decimal(re.sub('[^\d\.]', '', self.formatted_price_with_tax))
+        return parse_price(self.formatted_price_with_tax)
 
 
+@slotted
 @dataclass
 class File:
     type: str
@@ -32,6 +62,7 @@ class File:
     file_name: str
 
 
+@slotted
 @dataclass
 class NewProductInCart:
     cart_id: str
@@ -39,6 +70,7 @@ class NewProductInCart:
     quantity: int
 
 
+@slotted
 @dataclass
 class CartHeader:
     id: str
@@ -48,9 +80,10 @@ class CartHeader:
 
     @property
     def price(self) -> Decimal:
-        return Decimal(re.sub('[^\d\.]', '', self.formatted_price_with_tax))
+        return parse_price(self.formatted_price_with_tax)
 
 
+@slotted
 @dataclass
 class CartContentProduct:
     id: str
@@ -66,11 +99,20 @@ class CartContentProduct:
 
 
 class User:
+    # Seconds to keep the state of an idle user, None keeps it forever.
+    state_ttl = None
+    # Optional UserStateCache in front of Redis.
+    state_cache = None
+
     def __init__(self, user_id: str):
         self.user_id = user_id
 
     def save_state_to_db(self, state):
-        return RedisStorage.set(self.user_id, state)
+        if User.state_cache is not None:
+            return User.state_cache.set(self.user_id, state)
+        return RedisStorage.set(self.user_id, state, ex=User.state_ttl)
 
     def get_state_from_db(self):
+        if User.state_cache is not None:
+            return User.state_cache.get(self.user_id)
         return RedisStorage.get(self.user_id)
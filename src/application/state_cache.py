@@ -0,0 +1,159 @@
+from collections import OrderedDict
+import logging
+import threading
+
+import redis
+
+from application.database import RedisStorage, decode_value
+from application.metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+
+class UserStateCache:
+    """
+    In-process LRU cache of user states in front of Redis. The mode tells
+    how states are read and written:
+
+    * sticky - updates of a chat are always handled by this process
+      (single process, webhook with sticky routing). Reads of cached users
+      never touch Redis, writes of an unchanged state are skipped and
+      changed states are written behind by a background thread with one
+      pipeline per flush;
+    * cas - several processes may handle the same chat. Every read gets the
+      state from Redis and every write is a compare-and-set against the state
+      read, also when the state is unchanged. If another process has changed
+      it in the meantime the write is rejected, so an update handled with
+      an outdated state is detected.
+    """
+
+    MODE_STICKY = 'sticky'
+    MODE_CAS = 'cas'
+
+    def __init__(
+            self,
+            max_size: int = 10000,
+            mode: str = MODE_STICKY,
+            flush_interval: float = 0.5,
+            ttl: int = None,
+    ):
+        if mode not in (UserStateCache.MODE_STICKY, UserStateCache.MODE_CAS):
+            raise ValueError('Unknown state cache mode: {}'.format(mode))
+        self.max_size = max_size
+        self.mode = mode
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self._states = OrderedDict()
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='user-state-flush', daemon=True
+        )
+
+    def start(self):
+        if self.mode == UserStateCache.MODE_STICKY:
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+    def get(self, user_id):
+        key = str(user_id)
+        if self.mode == UserStateCache.MODE_CAS:
+            state = RedisStorage.get(key)
+            with self._lock:
+                self._remember(key, state)
+            return state
+
+        with self._lock:
+            if key in self._dirty or key in self._states:
+                metrics.increment(
+                    'cache_requests_total', cache='user_state', result='hit'
+                )
+            if key in self._dirty:
+                return self._dirty[key]
+            if key in self._states:
+                self._states.move_to_end(key)
+                return self._states[key]
+
+        metrics.increment('cache_requests_total', cache='user_state', result='miss')
+        state = RedisStorage.get(key)
+        with self._lock:
+            self._remember(key, state)
+        return state
+
+    def set(self, user_id, state):
+        key = str(user_id)
+        with self._lock:
+            is_known = key in self._dirty or key in self._states
+            if key in self._dirty:
+                cached_state = self._dirty[key]
+            else:
+                cached_state = self._states.get(key)
+            if self.mode == UserStateCache.MODE_STICKY:
+                if is_known and cached_state == state:
+                    return True
+                self._dirty[key] = state
+                self._remember(key, state)
+                return True
+
+        if not is_known:
+            # Nothing to compare with, e.g. /start does not read the state.
+            RedisStorage.connection.set(key, state, ex=self.ttl)
+            with self._lock:
+                self._remember(key, state)
+            return True
+
+        if self._compare_and_set(key, cached_state, state):
+            with self._lock:
+                self._remember(key, state)
+            return True
+
+        logger.warning('State of user {} has been changed concurrently'.format(key))
+        self.invalidate(user_id)
+        return False
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._states.pop(str(user_id), None)
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        try:
+            RedisStorage.set_many(dirty, ex=self.ttl)
+        except redis.RedisError as e:
+            logger.error('Cannot flush {} user states: {}'.format(len(dirty), str(e)))
+            with self._lock:
+                for key, state in dirty.items():
+                    self._dirty.setdefault(key, state)
+
+    def _remember(self, key, state):
+        self._states[key] = state
+        self._states.move_to_end(key)
+        while len(self._states) > self.max_size:
+            self._states.popitem(last=False)
+
+    def _compare_and_set(self, key, expected_state, state) -> bool:
+        with RedisStorage.connection.pipeline() as pipeline:
+            try:
+                pipeline.watch(key)
+                if decode_value(pipeline.get(key)) != expected_state:
+                    pipeline.unwatch()
+                    return False
+                pipeline.multi()
+                pipeline.set(key, state, ex=self.ttl)
+                pipeline.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
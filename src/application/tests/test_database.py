@@ -0,0 +1,175 @@
+import threading
+
+import fakeredis
+import redis
+import pytest
+
+from application.database import RedisStorage, RedisPipelineBatcher
+from application.models import User
+
+
+@pytest.fixture
+def connection():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def batcher(connection, monkeypatch):
+    batcher = RedisPipelineBatcher(connection, interval=0.01)
+    monkeypatch.setattr(RedisStorage, 'connection', connection)
+    monkeypatch.setattr(RedisStorage, 'batcher', batcher)
+    batcher.start()
+    yield batcher
+    batcher.stop()
+
+
+def test_concurrent_reads_share_one_pipeline(connection, batcher, mocker):
+    for user_id in range(10):
+        connection.set(str(user_id), 'HANDLE_MENU')
+    pipeline = mocker.spy(connection, 'pipeline')
+
+    results = {}
+
+    def read_state(user_id):
+        results[user_id] = User(str(user_id)).get_state_from_db()
+
+    threads = [
+        threading.Thread(target=read_state, args=(user_id,)) for user_id in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {user_id: 'HANDLE_MENU' for user_id in range(10)}
+    assert pipeline.call_count < 10
+
+
+def test_pending_write_is_visible_before_flush(connection, batcher):
+    user = User('1')
+    user.save_state_to_db('HANDLE_CART')
+
+    assert user.get_state_from_db() == 'HANDLE_CART'
+
+    batcher.execute()
+    assert connection.get('1') == b'HANDLE_CART'
+
+
+def test_close_writes_pending_values(connection, batcher):
+    User('1').save_state_to_db('HANDLE_CART')
+
+    RedisStorage.close()
+
+    assert connection.get('1') == b'HANDLE_CART'
+    assert RedisStorage.batcher is None
+
+
+def test_state_saved_with_ttl(connection, batcher, monkeypatch):
+    monkeypatch.setattr(User, 'state_ttl', 60)
+    User('1').save_state_to_db('HANDLE_MENU')
+    batcher.execute()
+
+    assert 0 < connection.ttl('1') <= 60
+
+
+def test_get_many_and_set_many(connection, monkeypatch):
+    monkeypatch.setattr(RedisStorage, 'connection', connection)
+
+    RedisStorage.set_many({'1': 'HANDLE_MENU', '2': 'HANDLE_CART'})
+
+    assert RedisStorage.get_many(['1', '2', '3']) == ['HANDLE_MENU', 'HANDLE_CART', None]
+
+
+def test_failed_write_retried_in_next_tick(connection, mocker):
+    batcher = RedisPipelineBatcher(connection, max_retries=1)
+    execute = mocker.patch.object(
+        redis.client.Pipeline, 'execute', side_effect=redis.ConnectionError('down')
+    )
+
+    future = batcher.set('1', 'HANDLE_MENU')
+    batcher.execute()
+    assert not future.done()
+
+    execute.side_effect = None
+    execute.return_value = [True]
+    batcher.execute()
+    assert future.result(timeout=0) is True
+
+
+def test_write_fails_after_retries(connection, mocker):
+    batcher = RedisPipelineBatcher(connection, max_retries=1)
+    mocker.patch.object(
+        redis.client.Pipeline, 'execute', side_effect=redis.ConnectionError('down')
+    )
+
+    future = batcher.set('1', 'HANDLE_MENU')
+    batcher.execute()
+    batcher.execute()
+
+    with pytest.raises(redis.ConnectionError):
+        future.result(timeout=0)
+
+
+def test_read_times_out_without_pipeline_thread(connection):
+    batcher = RedisPipelineBatcher(connection, timeout=0.05)
+
+    with pytest.raises(redis.TimeoutError):
+        batcher.get('1')
+
+
+def test_delete_waits_for_running_pipeline(connection, monkeypatch):
+    batcher = RedisPipelineBatcher(connection)
+    execute = redis.client.Pipeline.execute
+    pipeline_started = threading.Event()
+    pipeline_released = threading.Event()
+
+    def slow_execute(pipeline, *args, **kwargs):
+        pipeline_started.set()
+        pipeline_released.wait(timeout=1)
+        return execute(pipeline, *args, **kwargs)
+
+    monkeypatch.setattr(redis.client.Pipeline, 'execute', slow_execute)
+    batcher.set('1', 'HANDLE_MENU')
+    pipeline = threading.Thread(target=batcher.execute)
+    pipeline.start()
+    pipeline_started.wait(timeout=1)
+    delete = threading.Thread(target=batcher.delete, args=('1',))
+    delete.start()
+
+    delete.join(timeout=0.05)
+    assert delete.is_alive()
+    pipeline_released.set()
+    pipeline.join()
+    delete.join()
+    assert connection.get('1') is None
+
+
+def test_retried_write_not_sent_after_delete(connection, mocker):
+    batcher = RedisPipelineBatcher(connection)
+    execute = mocker.patch.object(
+        redis.client.Pipeline, 'execute', side_effect=redis.ConnectionError('down')
+    )
+    future = batcher.set('1', 'HANDLE_MENU')
+    batcher.execute()
+
+    batcher.delete('1')
+    execute.side_effect = None
+    batcher.execute()
+
+    assert future.result(timeout=0) is False
+    assert execute.call_count == 1
+
+
+def test_writes_dropped_by_stop_logged(connection, mocker, caplog):
+    batcher = RedisPipelineBatcher(connection, interval=0.01, max_retries=100)
+    mocker.patch.object(
+        redis.client.Pipeline, 'execute', side_effect=redis.ConnectionError('down')
+    )
+    batcher.start()
+    future = batcher.set('1', 'HANDLE_MENU')
+
+    batcher.stop()
+
+    with pytest.raises(redis.ConnectionError):
+        future.result(timeout=0)
+    assert 'writes of 1 dropped' in caplog.text
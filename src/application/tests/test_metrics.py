@@ -0,0 +1,108 @@
+import time
+
+import fakeredis
+import pytest
+import requests
+import requests_mock
+
+from application.database import RedisStorage
+from application.ecommerce_api.moltin_api.moltin import MoltinApi, MoltinApiSession
+from application.metrics import registry, MetricsRegistry, MetricsServer
+
+
+@pytest.fixture
+def metrics():
+    registry.enabled = True
+    yield registry
+    registry.enabled = False
+    registry.reset()
+
+
+def test_disabled_registry_records_nothing():
+    metrics = MetricsRegistry()
+
+    @metrics.timed('call_seconds')
+    def call():
+        return 'result'
+
+    metrics.increment('calls_total')
+    with metrics.measure('block_seconds'):
+        pass
+
+    assert call() == 'result'
+    assert metrics.render() == '\n'
+
+
+def test_render_prometheus_text():
+    metrics = MetricsRegistry(buckets=(0.1, 1))
+    metrics.enabled = True
+    metrics.increment('cache_requests_total', cache='catalog', result='hit')
+    metrics.increment('cache_requests_total', cache='catalog', result='hit')
+    metrics.observe('call_seconds', 0.5, method='get')
+    metrics.register_collector(lambda: [('queue_size', 'gauge', {}, 3)])
+
+    assert metrics.render().splitlines() == [
+        '# TYPE cache_requests_total counter',
+        'cache_requests_total{cache="catalog",result="hit"} 2',
+        '# TYPE call_seconds histogram',
+        'call_seconds_bucket{method="get",le="0.1"} 0',
+        'call_seconds_bucket{method="get",le="1"} 1',
+        'call_seconds_bucket{method="get",le="+Inf"} 1',
+        'call_seconds_sum{method="get"} 0.5',
+        'call_seconds_count{method="get"} 1',
+        '# TYPE queue_size gauge',
+        'queue_size 3',
+    ]
+
+
+def test_timed_counts_errors():
+    metrics = MetricsRegistry()
+    metrics.enabled = True
+
+    @metrics.timed('call_seconds')
+    def call():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        call()
+
+    assert metrics.counters == {
+        ('errors_total', (
+            ('error', 'ValueError'), ('method', 'call'), ('source', 'call_seconds')
+        )): 1
+    }
+    assert metrics.histograms[('call_seconds', (('method', 'call'),))].count == 1
+
+
+def test_moltin_and_redis_calls_instrumented(metrics, monkeypatch):
+    monkeypatch.setattr(RedisStorage, 'connection', fakeredis.FakeRedis())
+    session = MoltinApiSession('http://fakeapi.com', 'client id', 'client secret')
+    session.access_token = 'access_token'
+    session.access_token_expires_in = time.time() + 1000
+    moltin_api = MoltinApi(session)
+
+    with requests_mock.Mocker() as m:
+        m.delete('http://fakeapi.com/v2/carts/1/items/2', json={'data': []})
+        moltin_api.remove_item_from_cart('1', '2')
+    RedisStorage.set('1', 'HANDLE_MENU')
+
+    output = metrics.render()
+    assert ('moltin_http_responses_total{method="delete",status="200"} 1'
+            in output)
+    assert ('moltin_api_call_seconds_count'
+            '{layer="moltin",method="remove_item_from_cart"} 1' in output)
+    assert 'redis_operation_seconds_count{method="set"} 1' in output
+
+
+def test_metrics_server(metrics):
+    metrics.increment('updates_total')
+    server = MetricsServer(metrics, listen='127.0.0.1', port=0)
+    server.start()
+    try:
+        url = 'http://127.0.0.1:{}'.format(server.port)
+        response = requests.get('{}/metrics'.format(url))
+        assert response.status_code == 200
+        assert 'updates_total 1' in response.text
+        assert requests.get('{}/other'.format(url)).status_code == 404
+    finally:
+        server.stop()
@@ -1,9 +1,12 @@
+from dataclasses import asdict
 import uuid
 import decimal
 
 import pytest
 
-from application.models import Product
+from application import fastjson
+from application.benchmark import parsing
+from application.models import Product, parse_price
 
 
 @pytest.fixture
@@ -22,3 +25,36 @@ def product():
 
 def test_formatted_price_field_converted_properly(product):
     assert product.price == decimal.Decimal(243.50)
+
+
+def test_product_has_slots(product):
+    assert not hasattr(product, '__dict__')
+    with pytest.raises(AttributeError):
+        product.unknown = 'value'
+    assert Product(**asdict(product)) == product
+
+
+def test_price_parse_cached():
+    parse_price.cache_clear()
+    assert parse_price('$1,475.00') == decimal.Decimal('1475.00')
+    assert parse_price('$1,475.00') == decimal.Decimal('1475.00')
+    assert parse_price.cache_info().hits == 1
+
+
+def test_fast_json_round_trip():
+    data = {'data': [{'id': 'product id', 'price': 1.5}]}
+    assert fastjson.loads(fastjson.dumps(data)) == data
+    assert fastjson.loads(fastjson.dumps(data).encode('utf-8')) == data
+    with pytest.raises(ValueError):
+        fastjson.loads(b'not json')
+
+
+def test_catalog_parsing_benchmark():
+    parse_price.cache_clear()
+    report = parsing.run(products=200, iterations=5)
+
+    assert all(report[name] >= 0 for name in ('decode', 'create', 'prices'))
+    assert report['product_bytes'] < report['product_bytes_baseline']
+    # Each price is parsed once, the other reads are served by the cache.
+    assert parse_price.cache_info().misses <= 200
+    assert parse_price.cache_info().hits >= 200 * 5
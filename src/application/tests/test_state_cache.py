@@ -0,0 +1,84 @@
+import fakeredis
+import pytest
+
+from application.database import RedisStorage
+from application.models import User
+from application.state_cache import UserStateCache
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    connection = fakeredis.FakeRedis()
+    monkeypatch.setattr(RedisStorage, 'connection', connection)
+    return connection
+
+
+def test_cached_state_read_once_and_unchanged_state_not_written(
+    connection, monkeypatch, mocker
+):
+    connection.set('1', 'HANDLE_CART')
+    monkeypatch.setattr(User, 'state_cache', UserStateCache())
+    redis_get = mocker.spy(RedisStorage, 'get')
+    redis_set_many = mocker.spy(RedisStorage, 'set_many')
+
+    user = User(1)
+    for _ in range(3):
+        assert user.get_state_from_db() == 'HANDLE_CART'
+        user.save_state_to_db('HANDLE_CART')
+    User.state_cache.flush()
+
+    assert redis_get.call_count == 1
+    assert redis_set_many.call_count == 0
+
+
+def test_changed_states_written_behind(connection):
+    state_cache = UserStateCache()
+    state_cache.set(1, 'HANDLE_MENU')
+    state_cache.set(2, 'HANDLE_PRODUCT')
+    state_cache.set(1, 'HANDLE_CART')
+    assert connection.get('1') is None
+
+    state_cache.flush()
+    assert connection.get('1') == b'HANDLE_CART'
+    assert connection.get('2') == b'HANDLE_PRODUCT'
+
+
+def test_least_recently_used_state_evicted(connection):
+    connection.set('1', 'HANDLE_MENU')
+    connection.set('2', 'HANDLE_CART')
+    state_cache = UserStateCache(max_size=1)
+
+    state_cache.get(1)
+    state_cache.get(2)
+    connection.set('1', 'HANDLE_PRODUCT')
+
+    assert state_cache.get(1) == 'HANDLE_PRODUCT'
+
+
+def test_compare_and_set_rejects_concurrent_change(connection):
+    connection.set('1', 'HANDLE_MENU')
+    state_cache = UserStateCache(mode=UserStateCache.MODE_CAS)
+    assert state_cache.get(1) == 'HANDLE_MENU'
+
+    assert state_cache.set(1, 'HANDLE_PRODUCT')
+    assert connection.get('1') == b'HANDLE_PRODUCT'
+
+    # Another process moves the user to the cart.
+    connection.set('1', 'HANDLE_CART')
+    assert not state_cache.set(1, 'HANDLE_MENU')
+    assert connection.get('1') == b'HANDLE_CART'
+    assert state_cache.get(1) == 'HANDLE_CART'
+
+
+def test_compare_and_set_reads_state_changed_by_other_process(connection):
+    connection.set('1', 'HANDLE_MENU')
+    state_cache = UserStateCache(mode=UserStateCache.MODE_CAS)
+    assert state_cache.get(1) == 'HANDLE_MENU'
+
+    connection.set('1', 'HANDLE_CART')
+    assert state_cache.get(1) == 'HANDLE_CART'
+
+    # The state is unchanged by this process, but has been changed by another.
+    connection.set('1', 'HANDLE_PRODUCT')
+    assert not state_cache.set(1, 'HANDLE_CART')
+    assert connection.get('1') == b'HANDLE_PRODUCT'
@@ -10,6 +10,13 @@ def convert_value_to_int(value):
         return 0
 
 
+def convert_value_to_float(value):
+    try:
+        return float(value)
+    except TypeError:
+        return 0.0
+
+
 class ConfigError(Exception):
     pass
 
@@ -20,6 +27,98 @@ class Config:
     MOLTIN_STORE_ID = os.getenv('MOLTIN_STORE_ID')
     MOLTIN_CLIENT_ID = os.getenv('MOLTIN_CLIENT_ID')
     MOLTIN_CLIENT_SECRET = os.getenv('MOLTIN_CLIENT_SECRET')
+    MOLTIN_CONNECT_TIMEOUT = convert_value_to_float(
+        os.getenv('MOLTIN_CONNECT_TIMEOUT', 3.05)
+    )
+    MOLTIN_READ_TIMEOUT = convert_value_to_float(os.getenv('MOLTIN_READ_TIMEOUT', 10))
+    MOLTIN_MAX_RETRIES = convert_value_to_int(os.getenv('MOLTIN_MAX_RETRIES', 2))
+    MOLTIN_CIRCUIT_FAILURE_THRESHOLD = convert_value_to_int(
+        os.getenv('MOLTIN_CIRCUIT_FAILURE_THRESHOLD', 5)
+    )
+    MOLTIN_CIRCUIT_RESET_TIMEOUT = convert_value_to_float(
+        os.getenv('MOLTIN_CIRCUIT_RESET_TIMEOUT', 30)
+    )
+    MOLTIN_RATE_LIMITS = {
+        'catalog': convert_value_to_float(os.getenv('MOLTIN_RATE_LIMIT_CATALOG')),
+        'cart': convert_value_to_float(os.getenv('MOLTIN_RATE_LIMIT_CART')),
+        'flows': convert_value_to_float(os.getenv('MOLTIN_RATE_LIMIT_FLOWS')),
+    }
+    MOLTIN_RATE_LIMIT_BURST = convert_value_to_float(
+        os.getenv('MOLTIN_RATE_LIMIT_BURST', 10)
+    )
+    MOLTIN_RATE_LIMIT_MAX_WAIT = convert_value_to_float(
+        os.getenv('MOLTIN_RATE_LIMIT_MAX_WAIT', 2)
+    )
+    MOLTIN_RATE_LIMIT_SHARED = os.getenv('MOLTIN_RATE_LIMIT_SHARED') == '1'
+    MOLTIN_RESPONSE_LOG_LIMIT = convert_value_to_int(
+        os.getenv('MOLTIN_RESPONSE_LOG_LIMIT', 1000)
+    )
+    MOLTIN_RESPONSE_LOG_SAMPLE_RATE = convert_value_to_float(
+        os.getenv('MOLTIN_RESPONSE_LOG_SAMPLE_RATE', 1)
+    )
+    CATALOG_CACHE_TTL = convert_value_to_int(os.getenv('CATALOG_CACHE_TTL', 60))
+    CATALOG_CACHE_STALE_TTL = convert_value_to_int(
+        os.getenv('CATALOG_CACHE_STALE_TTL', 300)
+    )
+    OBJECT_CACHE_TTL = convert_value_to_int(os.getenv('OBJECT_CACHE_TTL', 3600))
+    CATALOG_WARM_INTERVAL = convert_value_to_float(os.getenv('CATALOG_WARM_INTERVAL'))
+    CATALOG_WARM_WORKERS = convert_value_to_int(os.getenv('CATALOG_WARM_WORKERS', 8))
+    CATALOG_SNAPSHOT_PATH = os.getenv('CATALOG_SNAPSHOT_PATH')
+    CATALOG_EVENTS = os.getenv('CATALOG_EVENTS', '0') == '1'
+    SHADOW_CART = os.getenv('SHADOW_CART', '0') == '1'
+    SHADOW_CART_TTL = convert_value_to_int(os.getenv('SHADOW_CART_TTL', 86400))
+    SHADOW_CART_RECONCILE_INTERVAL = convert_value_to_float(
+        os.getenv('SHADOW_CART_RECONCILE_INTERVAL', 300)
+    )
+    SHADOW_CART_SYNC_WORKERS = convert_value_to_int(
+        os.getenv('SHADOW_CART_SYNC_WORKERS', 4)
+    )
+    SHADOW_CART_BATCH_WINDOW = convert_value_to_float(
+        os.getenv('SHADOW_CART_BATCH_WINDOW', 0.05)
+    )
+    USER_STATE_TTL = convert_value_to_int(os.getenv('USER_STATE_TTL')) or None
+    USER_STATE_CACHE_SIZE = convert_value_to_int(os.getenv('USER_STATE_CACHE_SIZE'))
+    USER_STATE_CACHE_MODE = os.getenv('USER_STATE_CACHE_MODE', 'sticky')
+    USER_STATE_CACHE_FLUSH_INTERVAL = convert_value_to_float(
+        os.getenv('USER_STATE_CACHE_FLUSH_INTERVAL', 0.5)
+    )
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+    WEBHOOK_SETTINGS = {
+        'url': WEBHOOK_URL,
+        'listen': os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+        'port': convert_value_to_int(os.getenv('PORT', 8443)),
+        'queue_size': convert_value_to_int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000)),
+        'workers': convert_value_to_int(os.getenv('WEBHOOK_WORKERS', 4)),
+    }
+    SCHEDULER_SHARDS = convert_value_to_int(os.getenv('SCHEDULER_SHARDS'))
+    SCHEDULER_SETTINGS = {
+        'shards': SCHEDULER_SHARDS,
+        'shard_queue_size': convert_value_to_int(
+            os.getenv('SCHEDULER_SHARD_QUEUE_SIZE', 100)
+        ),
+        'overflow_policy': os.getenv('SCHEDULER_OVERFLOW_POLICY', 'drop_newest'),
+        'merge_duplicate_callbacks': os.getenv(
+            'SCHEDULER_MERGE_DUPLICATE_CALLBACKS', '1'
+        ) == '1',
+    }
+    SEND_QUEUE_WORKERS = convert_value_to_int(os.getenv('SEND_QUEUE_WORKERS'))
+    SEND_QUEUE_SETTINGS = {
+        'workers': SEND_QUEUE_WORKERS,
+        'global_rate': convert_value_to_float(
+            os.getenv('TELEGRAM_GLOBAL_RATE_LIMIT', 30)
+        ),
+        'global_burst': convert_value_to_float(
+            os.getenv('TELEGRAM_GLOBAL_RATE_BURST', 30)
+        ),
+        'chat_rate': convert_value_to_float(os.getenv('TELEGRAM_CHAT_RATE_LIMIT', 1)),
+        'chat_burst': convert_value_to_float(os.getenv('TELEGRAM_CHAT_RATE_BURST', 3)),
+        'max_retries': convert_value_to_int(os.getenv('SEND_QUEUE_MAX_RETRIES', 3)),
+        'max_size': convert_value_to_int(os.getenv('SEND_QUEUE_SIZE', 10000)),
+        'stop_timeout': convert_value_to_float(os.getenv('SEND_QUEUE_STOP_TIMEOUT', 8)),
+    }
+    BOT_EDIT_MESSAGES = os.getenv('BOT_EDIT_MESSAGES', '1') == '1'
+    METRICS_PORT = convert_value_to_int(os.getenv('METRICS_PORT'))
+    METRICS_DUMP_INTERVAL = convert_value_to_float(os.getenv('METRICS_DUMP_INTERVAL'))
 
     required = [
         'TELEGRAM_BOT_TOKEN',
@@ -36,11 +135,23 @@ class DevelopmentConfig(Config):
         'host': os.getenv('REDIS_HOST'),
         'port': convert_value_to_int(os.getenv('REDIS_PORT')),
         'url': None,
+        'max_connections': convert_value_to_int(os.getenv('REDIS_POOL_SIZE')) or None,
+        'pipeline_interval': convert_value_to_float(
+            os.getenv('REDIS_PIPELINE_INTERVAL')
+        ),
     }
 
 
 class ProductionConfig(Config):
-    REDIS_SETTINGS = {'host': None, 'port': None, 'url': os.getenv('REDIS_URL')}
+    REDIS_SETTINGS = {
+        'host': None,
+        'port': None,
+        'url': os.getenv('REDIS_URL'),
+        'max_connections': convert_value_to_int(os.getenv('REDIS_POOL_SIZE')) or None,
+        'pipeline_interval': convert_value_to_float(
+            os.getenv('REDIS_PIPELINE_INTERVAL')
+        ),
+    }
 
 
 def setup_logging():
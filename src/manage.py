@@ -3,8 +3,20 @@ import logging
 
 import import_string
 
-from application.ecommerce_api.moltin_api.moltin import MoltinApiSession, MoltinApi
+from application.ecommerce_api.moltin_api.moltin import MoltinApiSession
+from application.ecommerce_api.moltin_api.policy import RetryPolicy, CircuitBreaker
+from application.ecommerce_api.moltin_api.ratelimit import create_rate_limiter
+from application.ecommerce_api.moltin_api.shadow_cart import ShadowCartMoltinApi
+from application.ecommerce_api.moltin_api.cache import (
+    CachedMoltinApi,
+    RedisObjectCache,
+)
+from application.ecommerce_api.moltin_api.catalog_events import CatalogEvents
+from application.ecommerce_api.moltin_api.warmer import CatalogSnapshot, CatalogWarmer
 from application.database import RedisStorage
+from application.metrics import registry as metrics, MetricsServer, MetricsDumper
+from application.models import User
+from application.state_cache import UserStateCache
 from application.bot.telegram_bot import TelegramBot
 from config import setup_logging
 
@@ -17,18 +29,114 @@ def main():
 
     setup_logging()
 
+    if app_config.METRICS_PORT or app_config.METRICS_DUMP_INTERVAL:
+        metrics.enabled = True
+    if app_config.METRICS_PORT:
+        MetricsServer(metrics, port=app_config.METRICS_PORT).start()
+    if app_config.METRICS_DUMP_INTERVAL:
+        MetricsDumper(metrics, interval=app_config.METRICS_DUMP_INTERVAL).start()
+
     RedisStorage.initialize(**app_config.REDIS_SETTINGS)
+    User.state_ttl = app_config.USER_STATE_TTL
+    if app_config.USER_STATE_CACHE_SIZE:
+        User.state_cache = UserStateCache(
+            max_size=app_config.USER_STATE_CACHE_SIZE,
+            mode=app_config.USER_STATE_CACHE_MODE,
+            flush_interval=app_config.USER_STATE_CACHE_FLUSH_INTERVAL,
+            ttl=app_config.USER_STATE_TTL,
+        )
+        User.state_cache.start()
+
+    rate_limiter = None
+    if any(app_config.MOLTIN_RATE_LIMITS.values()):
+        redis_key_prefix = None
+        if app_config.MOLTIN_RATE_LIMIT_SHARED:
+            redis_key_prefix = 'moltin:ratelimit:{}'.format(app_config.MOLTIN_STORE_ID)
+        rate_limiter = create_rate_limiter(
+            app_config.MOLTIN_RATE_LIMITS,
+            burst=app_config.MOLTIN_RATE_LIMIT_BURST,
+            max_wait=app_config.MOLTIN_RATE_LIMIT_MAX_WAIT,
+            redis_key_prefix=redis_key_prefix,
+        )
+        metrics.register_collector(rate_limiter.collect_metrics)
 
+    MoltinApiSession.response_log_limit = app_config.MOLTIN_RESPONSE_LOG_LIMIT
+    MoltinApiSession.response_log_sample_rate = (
+        app_config.MOLTIN_RESPONSE_LOG_SAMPLE_RATE
+    )
     moltin_api_session = MoltinApiSession(
         app_config.MOLTIN_API_URL,
         app_config.MOLTIN_CLIENT_ID,
-        app_config.MOLTIN_CLIENT_SECRET
+        app_config.MOLTIN_CLIENT_SECRET,
+        timeout=(app_config.MOLTIN_CONNECT_TIMEOUT, app_config.MOLTIN_READ_TIMEOUT),
+        retry_policy=RetryPolicy(max_retries=app_config.MOLTIN_MAX_RETRIES),
+        circuit_breaker=CircuitBreaker(
+            failure_threshold=app_config.MOLTIN_CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=app_config.MOLTIN_CIRCUIT_RESET_TIMEOUT,
+        ),
+        rate_limiter=rate_limiter,
     )
-    moltin_api = MoltinApi(moltin_api_session)
+    cache_kwargs = {
+        'catalog_ttl': app_config.CATALOG_CACHE_TTL,
+        'catalog_stale_ttl': app_config.CATALOG_CACHE_STALE_TTL,
+        'object_cache': RedisObjectCache(ttl=app_config.OBJECT_CACHE_TTL),
+    }
+    if app_config.SHADOW_CART:
+        moltin_api = ShadowCartMoltinApi(
+            moltin_api_session,
+            shadow_ttl=app_config.SHADOW_CART_TTL,
+            reconcile_interval=app_config.SHADOW_CART_RECONCILE_INTERVAL,
+            sync_workers=app_config.SHADOW_CART_SYNC_WORKERS,
+            batch_window=app_config.SHADOW_CART_BATCH_WINDOW,
+            **cache_kwargs
+        )
+    else:
+        moltin_api = CachedMoltinApi(moltin_api_session, **cache_kwargs)
+
+    catalog_events = None
+    if app_config.CATALOG_EVENTS:
+        catalog_events = CatalogEvents(moltin_api.catalog)
+        catalog_events.start()
+    catalog_warmer = None
+    if app_config.CATALOG_WARM_INTERVAL:
+        catalog_warmer = CatalogWarmer(
+            moltin_api,
+            CatalogSnapshot(path=app_config.CATALOG_SNAPSHOT_PATH),
+            interval=app_config.CATALOG_WARM_INTERVAL,
+            workers=app_config.CATALOG_WARM_WORKERS,
+        )
+        catalog_warmer.load_snapshot()
+        catalog_warmer.start()
 
-    telegram_bot = TelegramBot(app_config.TELEGRAM_BOT_TOKEN, moltin_api=moltin_api)
+    webhook_settings = app_config.WEBHOOK_SETTINGS if app_config.WEBHOOK_URL else None
+    scheduler_settings = (
+        app_config.SCHEDULER_SETTINGS if app_config.SCHEDULER_SHARDS else None
+    )
+    send_queue_settings = (
+        app_config.SEND_QUEUE_SETTINGS if app_config.SEND_QUEUE_WORKERS else None
+    )
+    telegram_bot = TelegramBot(
+        app_config.TELEGRAM_BOT_TOKEN,
+        moltin_api=moltin_api,
+        webhook_settings=webhook_settings,
+        scheduler_settings=scheduler_settings,
+        edit_messages=app_config.BOT_EDIT_MESSAGES,
+        send_queue_settings=send_queue_settings,
+    )
     telegram_bot.start()
 
+    # The bot has stopped: send what is still kept in memory.
+    if catalog_warmer is not None:
+        catalog_warmer.stop()
+    if catalog_events is not None:
+        catalog_events.stop()
+    if isinstance(moltin_api, ShadowCartMoltinApi):
+        moltin_api.shutdown()
+    if User.state_cache is not None:
+        User.state_cache.stop()
+    RedisStorage.close()
+    logger.info('Bot has stopped')
+
 
 if __name__ == '__main__':
     main()